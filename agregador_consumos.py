@@ -0,0 +1,154 @@
+"""
+Agregación de consumos BCP clasificados
+
+Los consumos se agregan de a uno a medida que se clasifican: conteos, totales
+y listas por categoría se mantienen al día, así el resumen de consola y el
+JSON de salida salen del mismo estado sin volver a recorrer los resultados, y
+el estado parcial se puede consultar en cualquier momento de una corrida larga.
+
+Los consumos se guardan como registros Consumo (una sola instancia por consumo,
+referenciada desde la lista general y la de su categoría) y los totales en
+céntimos enteros; los diccionarios del JSON se arman recién al exportar.
+"""
+
+import datetime
+import json
+
+# Categoría cuando la respuesta del modelo no trae el formato CATEGORIA|justificación
+CATEGORIA_POR_DEFECTO = "COMPRAS"
+EMOJI_POR_DEFECTO = '🛒'
+FUENTE_DATOS = "BCP - Consumos últimos 7 días"
+# Sangría del JSON exportado
+SANGRIA = 2
+
+
+def parsear_clasificacion(clasificacion):
+    """Separa una respuesta CATEGORIA|justificación en (categoria, justificacion)"""
+    if "|" in clasificacion:
+        categoria, justificacion = clasificacion.split("|", 1)
+        return categoria.strip(), justificacion.strip()
+    return CATEGORIA_POR_DEFECTO, clasificacion
+
+
+def _volcar(archivo, valor, nivel=0):
+    """
+    Escribe `valor` como json.dump(..., ensure_ascii=False, indent=SANGRIA), pero
+    los generadores se escriben como listas a medida que se recorren
+    """
+    if isinstance(valor, dict):
+        if not valor:
+            archivo.write('{}')
+            return
+        archivo.write('{')
+        for indice, (clave, elemento) in enumerate(valor.items()):
+            archivo.write(',\n' if indice else '\n')
+            archivo.write(' ' * SANGRIA * (nivel + 1) + json.dumps(clave, ensure_ascii=False) + ': ')
+            _volcar(archivo, elemento, nivel + 1)
+        archivo.write('\n' + ' ' * SANGRIA * nivel + '}')
+    elif isinstance(valor, list) or hasattr(valor, '__next__'):
+        vacio = True
+        for elemento in valor:
+            archivo.write(',\n' if not vacio else '[\n')
+            vacio = False
+            archivo.write(' ' * SANGRIA * (nivel + 1))
+            _volcar(archivo, elemento, nivel + 1)
+        archivo.write('[]' if vacio else '\n' + ' ' * SANGRIA * nivel + ']')
+    else:
+        archivo.write(json.dumps(valor, ensure_ascii=False))
+
+
+class AgregadorConsumos:
+    """Estado acumulado de los consumos clasificados de una corrida"""
+
+    def __init__(self, emojis):
+        self.emojis = emojis
+        self.resultados = []
+        self.cantidades = {}
+        self.centavos = {}
+        self.total_centavos = 0
+        # Todas las categorías conocidas aparecen en la salida, aunque no tengan consumos
+        self.consumos_por_categoria = {categoria: [] for categoria in emojis}
+
+    def __len__(self):
+        return len(self.resultados)
+
+    @property
+    def total_gastado(self):
+        return self.total_centavos / 100
+
+    def total_categoria(self, categoria):
+        return self.centavos.get(categoria, 0) / 100
+
+    def emoji(self, categoria):
+        return self.emojis.get(categoria, EMOJI_POR_DEFECTO)
+
+    def agregar(self, consumo, clasificacion):
+        """Agrega un Consumo con su respuesta CATEGORIA|justificación y lo devuelve"""
+        consumo.clasificar(*parsear_clasificacion(clasificacion))
+        categoria = consumo.categoria
+        centavos = consumo.centavos or 0
+        self.resultados.append(consumo)
+        self.cantidades[categoria] = self.cantidades.get(categoria, 0) + 1
+        self.centavos[categoria] = self.centavos.get(categoria, 0) + centavos
+        self.total_centavos += centavos
+        self.consumos_por_categoria.setdefault(categoria, []).append(consumo)
+        return consumo
+
+    def resumen_categorias(self):
+        """Cantidad, total y emoji de cada categoría con consumos (orden alfabético)"""
+        return {
+            categoria: {
+                "cantidad": self.cantidades[categoria],
+                "total": round(self.total_categoria(categoria), 2),
+                "emoji": self.emoji(categoria)
+            }
+            for categoria in sorted(self.cantidades)
+        }
+
+    def _estructura(self, periodo_datos, perezosa):
+        """Estructura del JSON de salida; con `perezosa` los consumos son generadores"""
+        def consumos(lista, con_categoria):
+            dicts = (consumo.a_dict(con_categoria) for consumo in lista)
+            return dicts if perezosa else list(dicts)
+
+        # Primero las categorías con consumos (orden alfabético), luego las vacías
+        categorias = sorted(self.cantidades) + [c for c in self.emojis if c not in self.cantidades]
+        return {
+            "metadata": {
+                "fecha_proceso": datetime.datetime.now().isoformat(),
+                "total_consumos": len(self.resultados),
+                "total_gastado": self.total_gastado,
+                "periodo_datos": periodo_datos,
+                "fuente": FUENTE_DATOS
+            },
+            "resumen_categorias": self.resumen_categorias(),
+            "consumos_por_categoria": {
+                categoria: {
+                    "emoji": self.emoji(categoria),
+                    "total_categoria": round(self.total_categoria(categoria), 2),
+                    "cantidad_consumos": len(self.consumos_por_categoria.get(categoria, [])),
+                    "consumos": consumos(self.consumos_por_categoria.get(categoria, []), False)
+                }
+                for categoria in categorias
+            },
+            "todos_los_consumos": consumos(self.resultados, True)
+        }
+
+    def a_json(self, periodo_datos='N/A'):
+        """Estructura JSON de salida con metadata, resumen y consumos por categoría"""
+        return self._estructura(periodo_datos, perezosa=False)
+
+    def escribir_json(self, archivo, periodo_datos='N/A'):
+        """Escribe el JSON de salida en `archivo` armando los consumos de a uno"""
+        _volcar(archivo, self._estructura(periodo_datos, perezosa=True))
+
+    def imprimir_resumen(self, periodo_datos='N/A'):
+        print("\n📊 RESUMEN POR CATEGORÍAS:")
+        for categoria, resumen in self.resumen_categorias().items():
+            print(f"{resumen['emoji']} {categoria}: {resumen['cantidad']} consumos - "
+                  f"S/ {self.total_categoria(categoria):.2f}")
+
+        print(f"\n💰 RESUMEN GENERAL:")
+        print(f"📧 Total consumos procesados: {len(self.resultados)}")
+        print(f"💵 Total gastado: S/ {self.total_gastado:.2f}")
+        print(f"📅 Período: {periodo_datos}")
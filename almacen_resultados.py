@@ -0,0 +1,159 @@
+"""
+Almacén persistente de resultados de clasificación (SQLite)
+
+Cada resultado se guarda por tarea ('correos', 'financiero', 'bcp'), id del
+item (message_id / email_id) y versión: un hash de la versión del prompt y
+del modelo. Al volver a correr un clasificador solo se envían al modelo los
+items nuevos o cuyo contenido cambió; subir la versión del prompt invalida
+los resultados anteriores de esa tarea sin tocar los de las demás.
+
+Los resultados se escriben a medida que se obtienen (en modo WAL), así que
+si una corrida se interrumpe la siguiente retoma donde quedó.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+ARCHIVO_RESULTADOS = 'resultados_clasificacion.db'
+
+
+def version_prompt(tarea, version, modelo):
+    """Hash corto que identifica la combinación de tarea, versión del prompt y modelo"""
+    return hashlib.sha1(f"{tarea}|{version}|{modelo}".encode('utf-8')).hexdigest()[:16]
+
+
+def huella(*campos):
+    """Hash del contenido de un item: si cambia, el resultado guardado deja de valer"""
+    return hashlib.sha1("\x1f".join(str(c) for c in campos).encode('utf-8')).hexdigest()
+
+
+class AlmacenResultados:
+    """
+    Resultados de clasificación de una tarea con una versión de prompt dada.
+    Los resultados con ERROR (o que la función `valido` rechaza, p. ej. sin
+    categoría reconocida) no se guardan: se reintentan en la próxima corrida.
+    """
+
+    def __init__(self, tarea, version, ruta=ARCHIVO_RESULTADOS):
+        self.tarea = tarea
+        self.version = version
+        self.ruta = ruta
+        self.reutilizados = 0
+        self.guardados = 0
+        # La API comparte el clasificador entre peticiones: conexión protegida por un lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS resultados (
+                tarea     TEXT NOT NULL,
+                item_id   TEXT NOT NULL,
+                version   TEXT NOT NULL,
+                huella    TEXT NOT NULL,
+                resultado TEXT NOT NULL,
+                creado    REAL NOT NULL,
+                PRIMARY KEY (tarea, item_id, version)
+            );
+            CREATE INDEX IF NOT EXISTS idx_resultados_creado ON resultados(tarea, creado);
+        """)
+
+    def buscar(self, claves):
+        """
+        Recibe una lista de (item_id, huella) y devuelve {item_id: resultado}
+        con los resultados vigentes (misma versión y mismo contenido).
+        """
+        encontrados = {}
+        claves = [(str(i), h) for i, h in claves if i]
+        with self._lock:
+            # De a 500 para no pasar el límite de parámetros de SQLite
+            for inicio in range(0, len(claves), 500):
+                tramo = dict(claves[inicio:inicio + 500])
+                filas = self.conn.execute(
+                    f"""SELECT item_id, huella, resultado FROM resultados
+                        WHERE tarea = ? AND version = ?
+                        AND item_id IN ({','.join('?' * len(tramo))})""",
+                    [self.tarea, self.version, *tramo]
+                )
+                for item_id, huella_guardada, resultado in filas:
+                    if tramo[item_id] == huella_guardada:
+                        encontrados[item_id] = resultado
+        return encontrados
+
+    def guardar_varios(self, filas, valido=None):
+        """
+        Guarda una lista de (item_id, huella, resultado) en una sola transacción;
+        `valido(resultado)` descarta además los resultados que no deben reutilizarse
+        """
+        ahora = time.time()
+        filas = [(self.tarea, str(i), self.version, h, r, ahora)
+                 for i, h, r in filas
+                 if i and r and not r.startswith("ERROR") and (valido is None or valido(r))]
+        if not filas:
+            return 0
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?, ?)", filas
+            )
+        self.guardados += len(filas)
+        return len(filas)
+
+    def resolver(self, items, clave, funcion, valido=None):
+        """
+        Devuelve los resultados de `items` (lista alineada): los vigentes salen del
+        almacén y el resto se obtiene con `funcion(pendientes)` y se guarda.
+        `clave(item)` devuelve (item_id, huella); `valido` es el de guardar_varios.
+        """
+        claves = [clave(item) for item in items]
+        guardados = self.buscar(claves)
+        resultados = [guardados.get(str(item_id)) if item_id else None for item_id, _ in claves]
+        self.reutilizados += sum(r is not None for r in resultados)
+        pendientes = [indice for indice, r in enumerate(resultados) if r is None]
+        if pendientes:
+            nuevos = funcion([items[indice] for indice in pendientes])
+            for indice, resultado in zip(pendientes, nuevos):
+                resultados[indice] = resultado
+            self.guardar_varios([(*claves[indice], resultados[indice]) for indice in pendientes],
+                                valido)
+        return resultados
+
+    def consultar(self, item_id=None, desde=None, todas_las_versiones=False, limite=None):
+        """
+        Resultados guardados de la tarea, del más nuevo al más viejo, como
+        diccionarios. Filtra por item, por fecha (`desde`, epoch) y, salvo
+        `todas_las_versiones`, por la versión actual del prompt.
+        """
+        condiciones, parametros = ["tarea = ?"], [self.tarea]
+        if not todas_las_versiones:
+            condiciones.append("version = ?")
+            parametros.append(self.version)
+        if item_id is not None:
+            condiciones.append("item_id = ?")
+            parametros.append(str(item_id))
+        if desde is not None:
+            condiciones.append("creado >= ?")
+            parametros.append(desde)
+        consulta = (f"SELECT item_id, version, resultado, creado FROM resultados "
+                    f"WHERE {' AND '.join(condiciones)} ORDER BY creado DESC")
+        if limite:
+            consulta += f" LIMIT {int(limite)}"
+        with self._lock:
+            filas = self.conn.execute(consulta, parametros).fetchall()
+        return [{'item_id': i, 'version': v, 'resultado': r, 'creado': c} for i, v, r, c in filas]
+
+    def purgar_versiones_anteriores(self):
+        """Elimina los resultados de la tarea guardados con otras versiones del prompt"""
+        with self._lock, self.conn:
+            return self.conn.execute(
+                "DELETE FROM resultados WHERE tarea = ? AND version != ?",
+                (self.tarea, self.version)
+            ).rowcount
+
+    def imprimir(self):
+        print(f"🗃️  Resultados reutilizados: {self.reutilizados} | nuevos guardados: {self.guardados}")
+
+    def cerrar(self):
+        with self._lock:
+            self.conn.close()
@@ -11,12 +11,11 @@ from typing import List, Optional, Dict, Any
 import json
 import uvicorn
 from datetime import datetime
-import tempfile
-import os
 
 # Importar clasificador con manejo de errores
 try:
     from clasificador_bcp import ClasificadorBCP
+    from consumo import Consumo
     CLASIFICADOR_DISPONIBLE = True
 except ImportError as e:
     print(f"⚠️  Error importando clasificador: {e}")
@@ -62,7 +61,7 @@ class EstadisticasRespuesta(BaseModel):
 # Instancia global del clasificador
 try:
     if CLASIFICADOR_DISPONIBLE:
-        clasificador = ClasificadorBCP()
+        clasificador = ClasificadorBCP(mostrar_progreso=False)
     else:
         clasificador = None
 except Exception as e:
@@ -70,6 +69,12 @@ except Exception as e:
     clasificador = None
     CLASIFICADOR_DISPONIBLE = False
 
+@app.on_event("shutdown")
+def cerrar_clasificador():
+    """Cierra las bases SQLite del clasificador global al detener el servidor"""
+    if clasificador is not None:
+        clasificador.cerrar()
+
 @app.get("/", summary="Información de la API")
 async def root():
     """Endpoint raíz con información básica de la API"""
@@ -148,12 +153,12 @@ async def clasificar_consumo_manual(consumo: ConsumoManual):
     
     try:
         # Preparar datos para clasificación
-        datos_consumo = {
-            'empresa': consumo.empresa,
-            'monto': consumo.monto,
-            'tipo_tarjeta': consumo.tipo_tarjeta,
-            'fecha': consumo.fecha or datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000 (UTC)")
-        }
+        datos_consumo = Consumo(
+            empresa=consumo.empresa,
+            monto=consumo.monto,
+            tipo_tarjeta=consumo.tipo_tarjeta,
+            fecha=consumo.fecha or datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000 (UTC)")
+        )
         
         # Clasificar usando el clasificador
         resultado = clasificador.clasificar_consumo(datos_consumo)
@@ -172,19 +177,11 @@ async def clasificar_consumo_manual(consumo: ConsumoManual):
             'SERVICIOS': '🏠', 'BANCARIO': '💳', 'ENTRETENIMIENTO': '🎮'
         }
         
-        # Extraer monto numérico
-        monto_numerico = 0
-        try:
-            monto_str = consumo.monto.replace('S/', '').replace(',', '').strip()
-            monto_numerico = float(monto_str)
-        except:
-            pass
-        
         return RespuestaClasificacion(
             categoria=categoria,
             justificacion=justificacion,
             emoji=emojis.get(categoria, '🛒'),
-            monto_numerico=monto_numerico
+            monto_numerico=datos_consumo.monto_numerico
         )
         
     except Exception as e:
@@ -206,35 +203,23 @@ async def clasificar_desde_archivo(archivo: UploadFile = File(...)):
         if not archivo.filename.endswith('.json'):
             raise HTTPException(status_code=400, detail="El archivo debe ser un JSON")
         
-        # Leer contenido del archivo
-        contenido = await archivo.read()
-        
-        # Crear archivo temporal
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(contenido.decode('utf-8'))
-            temp_path = temp_file.name
-        
+        # El archivo subido se lee en forma incremental: los consumos se clasifican
+        # a medida que se leen, sin cargar el JSON completo en memoria
+        # Instancia propia para no pisar el estado de la corrida del clasificador global
+        clasificador_temp = ClasificadorBCP(mostrar_progreso=False)
         try:
-            # Crear instancia del clasificador con archivo temporal
-            clasificador_temp = ClasificadorBCP()
-            
-            # Cargar datos desde el archivo temporal
-            with open(temp_path, 'r', encoding='utf-8') as f:
-                clasificador_temp.datos_bcp = json.load(f)
-            
-            # Obtener clasificación completa
-            resultado = clasificador_temp.obtener_json_clasificado()
-            
-            if not resultado:
-                raise HTTPException(status_code=400, detail="No se pudieron procesar los datos del archivo")
-            
-            return resultado
-            
+            resultado = clasificador_temp.obtener_json_clasificado(archivo.file)
         finally:
-            # Limpiar archivo temporal
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
+            # Cierra las conexiones SQLite del almacén y del caché de comercios
+            clasificador_temp.cerrar()
         
+        if not resultado:
+            raise HTTPException(status_code=400, detail="No se pudieron procesar los datos del archivo")
+        
+        return resultado
+        
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
         raise HTTPException(status_code=400, detail="El archivo JSON no es válido")
     except Exception as e:
@@ -325,12 +310,12 @@ async def health_check():
     """Endpoint para verificar que la API está funcionando"""
     try:
         # Verificar conexión con Vertex AI
-        test_consumo = {
-            'empresa': 'TEST',
-            'monto': 'S/ 10.00',
-            'tipo_tarjeta': 'Débito',
-            'fecha': '2025-01-01'
-        }
+        test_consumo = Consumo(
+            empresa='TEST',
+            monto='S/ 10.00',
+            tipo_tarjeta='Débito',
+            fecha='2025-01-01'
+        )
         
         # Intentar clasificar un consumo de prueba
         clasificador.clasificar_consumo(test_consumo)
@@ -0,0 +1,194 @@
+"""
+Caché persistente comercio → categoría para los consumos del BCP
+
+Una semana de consumos suele repetir los mismos comercios (TAMBO, UBER,
+GOOGLE...), así que la categoría se guarda por nombre de comercio
+normalizado y solo los comercios nunca vistos se envían a Gemini.
+
+El caché vive en memoria como LRU de a lo sumo `max_entradas` comercios y
+se respalda en SQLite. Las entradas vencen tras `ttl` segundos salvo las
+fijadas a mano (overrides), que tampoco se desalojan.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+ARCHIVO_CACHE_COMERCIOS = 'cache_comercios.db'
+# Comercios que se mantienen en el caché (los menos usados se desalojan)
+MAX_COMERCIOS = 5000
+# Segundos tras los que se vuelve a consultar la categoría de un comercio (90 días)
+TTL_COMERCIO = 90 * 24 * 3600
+
+# Pasarelas de pago que anteponen su nombre al del comercio: "DLC*GOOGLE YOUTUBE"
+_PASARELAS = {'DLC', 'PAYU', 'MERPAGO', 'MP', 'IZI', 'IZIPAY', 'NIUBIZ', 'PAYPAL', 'PP', 'CULQI', 'SP'}
+# Palabras de sucursal: desde ahí se descarta ("PLAZA VEA TDA SURCO"). Solo a
+# partir de la tercera palabra: "LA TIENDA DE JUAN" o "BANK OF CHINA" son el nombre
+_SUCURSAL = {'SUC', 'SUCURSAL', 'TDA', 'TIENDA', 'LOCAL', 'AGENCIA', 'AG', 'SEDE', 'OF', 'OFICINA'}
+# Las que nunca forman parte de un nombre también cortan tras la primera ("TAMBO SUC MIRAFLORES")
+_SUCURSAL_INEQUIVOCA = {'SUC', 'SUCURSAL'}
+# Razón social: "S.A.C.", "SAC", "EIRL"...
+_RE_RAZON_SOCIAL = re.compile(r'\b(S\s?A\s?C|S\s?A\s?A|S\s?A|E\s?I\s?R\s?L|S\s?R\s?L|S\s?A\s?S)\b')
+# Marcas de número de tienda: "PLAZA VEA #45", "KFC N° 12"
+_RE_MARCA_NUMERO = re.compile(r'(?:\bN[°ºO]?\s*|#\s*)(?=\d)')
+
+
+def normalizar_comercio(empresa):
+    """
+    Clave del caché para un nombre de comercio: mayúsculas sin acentos, sin la
+    pasarela de pago, sucursal ni razón social, y cortada en el número de tienda
+    ("PLAZA VEA 045 SURCO" -> "PLAZA VEA", "KFC N° 12" -> "KFC"). Un número sin
+    marca en la segunda palabra es parte del nombre ("CAFE 1900"), y lo que
+    sigue al '*' de un comercio que no es pasarela también ("UBER *EATS").
+    Devuelve '' si no hay comercio.
+    """
+    if not empresa or empresa == "N/A":
+        return ''
+    texto = unicodedata.normalize('NFD', str(empresa).upper())
+    texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+    if '*' in texto:
+        prefijo, _, resto = texto.partition('*')
+        texto = resto if prefijo.strip() in _PASARELAS else f"{prefijo} {resto}"
+    # Un número marcado con '#' o 'N°' siempre es la tienda
+    antes_marca = _RE_MARCA_NUMERO.split(texto, 1)[0]
+    if antes_marca.strip():
+        texto = antes_marca
+    texto = re.sub(r'[^\w ]+', ' ', texto).replace('_', ' ')
+    palabras = _RE_RAZON_SOCIAL.sub('', texto).split()
+    for indice, palabra in enumerate(palabras):
+        if indice == 1 and palabra in _SUCURSAL_INEQUIVOCA:
+            return palabras[0]
+        # Desde la tercera palabra, una sucursal o un número ("TAMBO MIRAFLORES 0123") es la tienda
+        if indice >= 2 and (palabra in _SUCURSAL or any(c.isdigit() for c in palabra)):
+            return ' '.join(palabras[:indice])
+    return ' '.join(palabras)
+
+
+class CacheComercios:
+    """Caché LRU con TTL, contadores de aciertos y overrides manuales"""
+
+    def __init__(self, ruta=ARCHIVO_CACHE_COMERCIOS, max_entradas=MAX_COMERCIOS, ttl=TTL_COMERCIO):
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.aciertos = 0
+        self.fallos = 0
+        # clave -> [categoria, justificacion, actualizado, override]; el final es lo más usado
+        self.entradas = OrderedDict()
+        self._usados = {}
+        # La API comparte el clasificador entre peticiones: conexión protegida por un lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS comercios (
+                clave         TEXT PRIMARY KEY,
+                categoria     TEXT NOT NULL,
+                justificacion TEXT,
+                actualizado   REAL NOT NULL,
+                ultimo_uso    REAL NOT NULL,
+                override      INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        filas = self.conn.execute(
+            """SELECT clave, categoria, justificacion, actualizado, override FROM comercios
+               WHERE override = 1 OR actualizado >= ? ORDER BY ultimo_uso""",
+            (time.time() - ttl,)
+        ).fetchall()
+        for clave, categoria, justificacion, actualizado, override in filas:
+            self.entradas[clave] = [categoria, justificacion, actualizado, bool(override)]
+        self._desalojar()
+
+    def __len__(self):
+        return len(self.entradas)
+
+    def _vigente(self, entrada):
+        return entrada[3] or entrada[2] >= time.time() - self.ttl
+
+    def _desalojar(self):
+        """Quita los comercios menos usados (nunca los overrides) hasta respetar el máximo"""
+        sobrantes = len(self.entradas) - self.max_entradas
+        if sobrantes <= 0:
+            return
+        desalojados = [c for c, e in self.entradas.items() if not e[3]][:sobrantes]
+        for clave in desalojados:
+            del self.entradas[clave]
+            self._usados.pop(clave, None)
+        with self.conn:
+            self.conn.executemany("DELETE FROM comercios WHERE clave = ?",
+                                  [(c,) for c in desalojados])
+
+    def obtener(self, empresa):
+        """Devuelve (categoria, justificacion) del comercio si está en el caché y vigente"""
+        clave = normalizar_comercio(empresa)
+        with self._lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None or not self._vigente(entrada):
+                self.fallos += 1
+                return None
+            self.entradas.move_to_end(clave)
+            self._usados[clave] = time.time()
+            self.aciertos += 1
+            return entrada[0], entrada[1]
+
+    def guardar(self, empresa, categoria, justificacion=''):
+        """Guarda la categoría obtenida del modelo (no pisa un override)"""
+        clave = normalizar_comercio(empresa)
+        if not clave:
+            return
+        ahora = time.time()
+        with self._lock:
+            entrada = self.entradas.get(clave)
+            if entrada and entrada[3]:
+                return
+            self.entradas[clave] = [categoria, justificacion, ahora, False]
+            self.entradas.move_to_end(clave)
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO comercios VALUES (?, ?, ?, ?, ?, 0)",
+                    (clave, categoria, justificacion, ahora, ahora)
+                )
+            self._desalojar()
+
+    def fijar(self, empresa, categoria, justificacion="Categoría fijada manualmente"):
+        """Fija a mano la categoría de un comercio: tiene prioridad y no vence"""
+        clave = normalizar_comercio(empresa)
+        ahora = time.time()
+        with self._lock:
+            self.entradas[clave] = [categoria, justificacion, ahora, True]
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO comercios VALUES (?, ?, ?, ?, ?, 1)",
+                    (clave, categoria, justificacion, ahora, ahora)
+                )
+
+    def olvidar(self, empresa):
+        """Elimina un comercio (incluido su override); la próxima vez se consulta al modelo"""
+        clave = normalizar_comercio(empresa)
+        with self._lock:
+            self.entradas.pop(clave, None)
+            self._usados.pop(clave, None)
+            with self.conn:
+                return self.conn.execute("DELETE FROM comercios WHERE clave = ?", (clave,)).rowcount
+
+    def tasa_aciertos(self):
+        consultas = self.aciertos + self.fallos
+        return self.aciertos / consultas if consultas else 0.0
+
+    def imprimir(self):
+        print(f"🏪 Caché de comercios: {self.aciertos} aciertos, {self.fallos} fallos "
+              f"({self.tasa_aciertos():.0%}) - {len(self.entradas)} comercios")
+
+    def persistir_usos(self):
+        """Guarda en disco el último uso de los comercios consultados (orden del LRU)"""
+        with self._lock, self.conn:
+            self.conn.executemany("UPDATE comercios SET ultimo_uso = ? WHERE clave = ?",
+                                  [(uso, clave) for clave, uso in self._usados.items()])
+            self._usados.clear()
+
+    def cerrar(self):
+        self.persistir_usos()
+        with self._lock:
+            self.conn.close()
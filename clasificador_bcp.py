@@ -1,10 +1,23 @@
 import json
 import re
 import datetime
+import itertools
 
 # Importar Vertex AI
 import vertexai
 from vertexai.generative_models import GenerativeModel
+from lotes_llm import clasificar_en_lotes, completar_individualmente, agrupar, MAX_ITEMS_LOTE
+from ejecutor_llm import EjecutorLLM, CONCURRENCIA_LLM
+from almacen_resultados import AlmacenResultados, version_prompt, huella
+from cache_comercios import CacheComercios, normalizar_comercio
+from reglas_comercios import ReglasComercios
+from agregador_consumos import AgregadorConsumos
+from lector_json import LectorJSONIncremental
+from consumo import Consumo, como_consumo
+
+MODELO_GEMINI = "gemini-2.0-flash-001"
+# Subir al cambiar el prompt: invalida los resultados guardados de versiones anteriores
+VERSION_PROMPT = 2
 
 # Pandas es opcional - solo para compatibilidad con el código legacy
 try:
@@ -15,25 +28,63 @@ except ImportError:
     print("⚠️  pandas no disponible - funcionalidad de Excel deshabilitada")
 
 class ClasificadorBCP:
-    def __init__(self):
+    def __init__(self, concurrencia_llm=CONCURRENCIA_LLM, mostrar_progreso=True, usar_almacen=True,
+                 usar_cache_comercios=True):
         # Inicializar Vertex AI
         vertexai.init(project="gassistant-466419", location="us-central1")
-        self.model = GenerativeModel("gemini-2.0-flash-001")
+        self.model = GenerativeModel(MODELO_GEMINI)
+        # Llamadas al modelo en paralelo, con límite de concurrencia
+        self.ejecutor_llm = EjecutorLLM(concurrencia_llm, progreso=mostrar_progreso)
+        # Taxonomía de categorías: contexto del prompt y reglas locales por comercio
+        self.reglas_comercios = ReglasComercios()
+        # Los consumos ya clasificados (misma versión del prompt y de las reglas) no se vuelven a enviar
+        self.almacen = AlmacenResultados(
+            'bcp', version_prompt('bcp', f"{VERSION_PROMPT}.{self.reglas_comercios.version}", MODELO_GEMINI)
+        ) if usar_almacen else None
+        # Categoría por comercio: solo los comercios nunca vistos se consultan al modelo
+        self.cache_comercios = CacheComercios() if usar_cache_comercios else None
         self.datos_bcp = None
-        
+        self.lector = None
+        # Estado de la última corrida: se puede consultar mientras avanza
+        self.agregador = None
+        
+    def cerrar(self):
+        """Cierra las bases SQLite del almacén de resultados y del caché de comercios"""
+        if self.almacen:
+            self.almacen.cerrar()
+            self.almacen = None
+        if self.cache_comercios is not None:
+            self.cache_comercios.cerrar()
+            self.cache_comercios = None
+    
     def cargar_datos_bcp(self, archivo_json="bcp-consumos-ultimos-7-dias.json"):
-        """Carga los datos financieros desde el JSON del BCP"""
+        """
+        Abre el JSON del BCP (ruta o archivo abierto) para leerlo en forma incremental:
+        la metadata queda en `datos_bcp` y los emails se leen de a uno al clasificar
+        """
         try:
-            with open(archivo_json, 'r', encoding='utf-8') as file:
-                self.datos_bcp = json.load(file)
+            self.lector = LectorJSONIncremental(archivo_json, clave='emails')
+            self.datos_bcp = self.lector.metadata
             print(f"✅ Cargados {self.datos_bcp.get('totalEmails', 0)} consumos del BCP")
             return True
         except Exception as e:
             print(f"❌ Error cargando datos del BCP: {e}")
             return False
     
+    def _iterar_emails(self):
+        """Emails del archivo abierto, o None si el arreglo está vacío"""
+        emails = iter(self.lector)
+        primero = next(emails, None)
+        if primero is None:
+            return None
+        return itertools.chain([primero], emails)
+    
     def extraer_datos_consumo(self, email):
         """Extrae datos específicos de un email de consumo del BCP"""
+        return self._extraer_consumo(email).a_datos()
+    
+    def _extraer_consumo(self, email):
+        """Consumo con los datos de un email del BCP (registro interno de la corrida)"""
         snippet = email.get('snippet', '')
         subject = email.get('subject', '')
         
@@ -52,78 +103,39 @@ class ClasificadorBCP:
         # Determinar tipo de tarjeta
         tipo_tarjeta = "Crédito" if "Crédito" in snippet else "Débito" if "Débito" in snippet else "N/A"
         
-        return {
-            'monto': monto,
-            'empresa': empresa,
-            'fecha': fecha,
-            'tipo_tarjeta': tipo_tarjeta,
-            'email_id': email.get('id', ''),
-            'leido': email.get('isRead', False)
-        }
+        return Consumo(
+            fecha=fecha,
+            empresa=empresa,
+            monto=monto,
+            tipo_tarjeta=tipo_tarjeta,
+            email_id=email.get('id', ''),
+            leido=email.get('isRead', False)
+        )
     
     def generar_contexto_clasificacion(self):
-        """Genera contexto para clasificar tipos de gastos basado en las 6 categorías"""
-        return """
-        Eres un clasificador especializado en gastos bancarios. Clasifica cada consumo en UNA de estas 6 categorías:
-
-        🍕 ALIMENTACIÓN:
-        - Restaurantes: KFC, McDonald's, Pizza Hut, Chilis, etc.
-        - Supermercados: Plaza Vea, Metro, Tottus, Wong, Vivanda
-        - Delivery: Rappi, UberEats, PedidosYa, Glovo
-        - Cafeterías: Starbucks, Juan Valdez, San Antonio
-        - Panaderías, mercados, tiendas de conveniencia como Tambo
-
-        🚗 TRANSPORTE:
-        - Uber, taxi, apps de transporte
-        - Combustible: Primax, Petroperú, Repsol
-        - Peajes, estacionamiento
-        - Mantenimiento de vehículo, talleres
-
-        🛒 COMPRAS:
-        - Tiendas por departamento: Falabella, Ripley, Saga
-        - Tiendas online: Amazon, MercadoLibre
-        - Ropa: Zara, H&M, Forever 21
-        - Tecnología: Apple Store, Samsung, tiendas de electrónicos
-        - Farmacias: InkaFarma, Boticas, Mifarma
-
-        🏠 SERVICIOS:
-        - Servicios básicos: Luz del Sur, Sedapal, gas, internet, telefonía
-        - Streaming: Netflix, Spotify, Disney+, Amazon Prime
-        - Suscripciones: Google, Microsoft, Adobe
-        - Seguros, alquiler
-
-        💳 BANCARIO:
-        - Comisiones bancarias, mantenimiento de cuenta
-        - Transferencias, cambio de divisas
-        - Intereses, pagos de tarjetas
-        - Servicios financieros
-
-        🎮 ENTRETENIMIENTO:
-        - Cines: Cineplex, Cineplanet, UVK
-        - Gimnasios, deportes
-        - Juegos, apps de entretenimiento
-        - Eventos, conciertos, actividades recreativas
-
-        REGLAS:
-        - Si reconoces el nombre del comercio, clasifícalo según su rubro principal
-        - TAMBO y tiendas de conveniencia = ALIMENTACIÓN
-        - MEGA PLAZA y centros comerciales = COMPRAS (a menos que sepas el comercio específico)
-        - GOOGLE = SERVICIOS (suscripciones digitales)
-        - Si no estás seguro, usa la categoría más probable según el contexto
-        """
+        """Genera el contexto de las categorías desde el archivo de reglas de comercios"""
+        return self.reglas_comercios.generar_contexto()
+    
+    def _texto_consumo(self, datos_consumo):
+        """Descripción del consumo que va en el prompt (individual o por lotes)"""
+        return f"""Empresa/Comercio: {datos_consumo.empresa}
+        Monto: {datos_consumo.monto}
+        Tipo de tarjeta: {datos_consumo.tipo_tarjeta}
+        Fecha: {datos_consumo.fecha}"""
     
     def clasificar_consumo(self, datos_consumo):
-        """Clasifica un consumo individual usando Gemini"""
+        """Clasifica un consumo individual: por regla local si el comercio es conocido, si no con Gemini"""
+        datos_consumo = como_consumo(datos_consumo)
+        local = self.reglas_comercios.clasificar(datos_consumo.empresa)
+        if local:
+            return local
         contexto = self.generar_contexto_clasificacion()
         
         prompt = f"""
         {contexto}
 
         CONSUMO A CLASIFICAR:
-        Empresa/Comercio: {datos_consumo['empresa']}
-        Monto: {datos_consumo['monto']}
-        Tipo de tarjeta: {datos_consumo['tipo_tarjeta']}
-        Fecha: {datos_consumo['fecha']}
+        {self._texto_consumo(datos_consumo)}
 
         Analiza el nombre del comercio y clasifica este gasto.
         
@@ -145,8 +157,110 @@ class ClasificadorBCP:
         except Exception as e:
             return f"ERROR|No se pudo clasificar: {e}"
     
+    def clasificar_consumos_lote(self, datos_consumos):
+        """
+        Clasifica varios consumos con un solo prompt por lote. Devuelve una lista
+        alineada con `datos_consumos` en el formato de clasificar_consumo; los
+        consumos cuya respuesta no se pudo parsear se clasifican de a uno.
+        """
+        datos_consumos = [como_consumo(datos) for datos in datos_consumos]
+        resultados = clasificar_en_lotes(
+            self.model,
+            self.generar_contexto_clasificacion(),
+            [self._texto_consumo(datos) for datos in datos_consumos],
+            """Analiza el nombre del comercio de cada consumo y clasifica el gasto.
+        
+        CATEGORIA es una de: ALIMENTACIÓN, TRANSPORTE, COMPRAS, SERVICIOS, BANCARIO, ENTRETENIMIENTO""",
+            '"categoria": "<CATEGORIA>", "justificacion": "<breve>"',
+            generation_config={"temperature": 0.1},
+            tokens_salida_por_item=50,
+            ejecutor=self.ejecutor_llm,
+        )
+        clasificaciones = [
+            f"{r.get('categoria', '')}|{r.get('justificacion', '')}" if r is not None else None
+            for r in resultados
+        ]
+        return completar_individualmente(clasificaciones, datos_consumos, self.clasificar_consumo,
+                                         self.ejecutor_llm)
+    
+    @staticmethod
+    def clave_resultado(datos_consumo):
+        """(item_id, huella) del consumo en el almacén de resultados"""
+        datos_consumo = como_consumo(datos_consumo)
+        return datos_consumo.email_id, huella(datos_consumo.empresa, datos_consumo.monto,
+                                              datos_consumo.tipo_tarjeta, datos_consumo.fecha)
+    
+    def clasificar_por_comercio(self, datos_consumos):
+        """
+        Clasifica los consumos por comercio: los del archivo de reglas se resuelven
+        localmente y los demás salen del caché de comercios; de cada comercio nuevo
+        se envía un solo consumo al modelo, su categoría se aplica a todos los
+        consumos de ese comercio y se guarda en el caché.
+        """
+        datos_consumos = [como_consumo(datos) for datos in datos_consumos]
+        clasificaciones = [None] * len(datos_consumos)
+        pendientes = {}  # comercio normalizado -> índices de sus consumos
+        for indice, datos in enumerate(datos_consumos):
+            local = self.reglas_comercios.clasificar(datos.empresa)
+            if local:
+                clasificaciones[indice] = local
+                continue
+            if self.cache_comercios is None:
+                pendientes[f"#{indice}"] = [indice]
+                continue
+            comercio = normalizar_comercio(datos.empresa)
+            guardado = self.cache_comercios.obtener(datos.empresa) if comercio else None
+            if guardado:
+                clasificaciones[indice] = "|".join(guardado)
+            else:
+                # Sin comercio reconocible cada consumo se clasifica por separado
+                pendientes.setdefault(comercio or f"#{indice}", []).append(indice)
+        if pendientes:
+            indices = list(pendientes.values())
+            respuestas = self.clasificar_consumos_lote([datos_consumos[i[0]] for i in indices])
+            for grupo, respuesta in zip(indices, respuestas):
+                for indice in grupo:
+                    clasificaciones[indice] = respuesta
+                if self.cache_comercios is None or "|" not in respuesta:
+                    continue
+                categoria, justificacion = respuesta.split("|", 1)
+                # Solo se cachean categorías conocidas: una etiqueta inventada por el
+                # modelo (o un ERROR) no debe fijar el comercio hasta que venza el TTL
+                if categoria.strip() in self.reglas_comercios.emojis:
+                    self.cache_comercios.guardar(datos_consumos[grupo[0]].empresa,
+                                                 categoria.strip(), justificacion.strip())
+        if self.cache_comercios is not None:
+            self.cache_comercios.persistir_usos()
+        return clasificaciones
+    
+    def clasificar_consumos(self, datos_consumos):
+        """
+        Clasifica los consumos reutilizando los resultados guardados y el caché de
+        comercios. Los nuevos se envían por grupos y se guardan al terminar cada
+        uno, así una corrida interrumpida retoma desde el último grupo. Recibe
+        diccionarios (como los de extraer_datos_consumo) o registros Consumo.
+        """
+        datos_consumos = [como_consumo(datos) for datos in datos_consumos]
+        if not self.almacen:
+            return self.clasificar_por_comercio(datos_consumos)
+        clasificaciones = []
+        for grupo in agrupar(datos_consumos, MAX_ITEMS_LOTE * self.ejecutor_llm.concurrencia):
+            clasificaciones.extend(
+                self.almacen.resolver(grupo, self.clave_resultado, self.clasificar_por_comercio)
+            )
+        return clasificaciones
+    
+    def _iterar_consumos_clasificados(self, emails):
+        """
+        Produce (Consumo, clasificacion) de cada email a medida que se clasifica,
+        por grupos de `MAX_ITEMS_LOTE * concurrencia` consumos
+        """
+        for grupo in agrupar(emails, MAX_ITEMS_LOTE * self.ejecutor_llm.concurrencia):
+            datos_consumos = [self._extraer_consumo(email) for email in grupo]
+            yield from zip(datos_consumos, self.clasificar_consumos(datos_consumos))
+    
     def procesar_consumos_bcp(self, exportar_json=True):
-        """Procesa y clasifica todos los consumos del BCP"""
+        """Procesa y clasifica todos los consumos del BCP; devuelve los consumos clasificados"""
         print("=" * 80)
         print("💳 CLASIFICADOR DE CONSUMOS BCP")
         print("=" * 80)
@@ -155,274 +269,74 @@ class ClasificadorBCP:
             print("❌ No se pudieron cargar los datos del BCP")
             return
         
-        emails = self.datos_bcp.get('emails', [])
-        if not emails:
+        emails = self._iterar_emails()
+        if emails is None:
             print("ℹ️  No se encontraron consumos para procesar")
             return
         
-        print(f"\n💰 Clasificando {len(emails)} consumos del BCP...\n")
-        
-        # Contadores por categoría
-        categorias_count = {}
-        total_por_categoria = {}
-        consumos_por_categoria = {}
-        resultados = []
+        # Los emails se leen del archivo a medida que se clasifican: el total viene de la metadata
+        total = self.datos_bcp.get('totalEmails', '?')
+        print(f"\n💰 Clasificando {total} consumos del BCP...\n")
         
-        # Emojis por categoría
-        emojis = {
-            'ALIMENTACIÓN': '🍕',
-            'TRANSPORTE': '🚗', 
-            'COMPRAS': '🛒',
-            'SERVICIOS': '🏠',
-            'BANCARIO': '💳',
-            'ENTRETENIMIENTO': '🎮'
-        }
+        # Conteos, totales y consumos por categoría se acumulan a medida que se clasifican
+        self.agregador = AgregadorConsumos(self.reglas_comercios.emojis)
         
-        # Inicializar categorías
-        for categoria in emojis.keys():
-            consumos_por_categoria[categoria] = []
-        
-        for i, email in enumerate(emails, 1):
-            print(f"--- CONSUMO {i}/{len(emails)} ---")
-            
-            # Extraer datos del consumo
-            datos_consumo = self.extraer_datos_consumo(email)
+        for i, (datos_consumo, clasificacion) in enumerate(self._iterar_consumos_clasificados(emails), 1):
+            print(f"--- CONSUMO {i}/{total} ---")
             
-            print(f"💰 Monto: {datos_consumo['monto']}")
-            print(f"🏪 Empresa: {datos_consumo['empresa']}")
-            print(f"💳 Tarjeta: {datos_consumo['tipo_tarjeta']}")
+            print(f"💰 Monto: {datos_consumo.monto}")
+            print(f"🏪 Empresa: {datos_consumo.empresa}")
+            print(f"💳 Tarjeta: {datos_consumo.tipo_tarjeta}")
             
-            # Clasificar
-            clasificacion = self.clasificar_consumo(datos_consumo)
-            
-            if "|" in clasificacion:
-                categoria, justificacion = clasificacion.split("|", 1)
-                categoria = categoria.strip()
-                justificacion = justificacion.strip()
-            else:
-                categoria = "COMPRAS"
-                justificacion = clasificacion
-            
-            emoji = emojis.get(categoria, '🛒')
-            print(f"{emoji} CATEGORÍA: {categoria}")
-            print(f"💭 Justificación: {justificacion}")
-            
-            # Contar categorías y sumar montos
-            categorias_count[categoria] = categorias_count.get(categoria, 0) + 1
-            
-            # Extraer valor numérico del monto para sumar
-            monto_numerico = 0
-            if datos_consumo['monto'] != "N/A":
-                try:
-                    monto_str = datos_consumo['monto'].replace('S/', '').replace(',', '').strip()
-                    monto_numerico = float(monto_str)
-                except:
-                    pass
-            
-            total_por_categoria[categoria] = total_por_categoria.get(categoria, 0) + monto_numerico
-            
-            # Crear detalle del consumo
-            consumo_detalle = {
-                'fecha': datos_consumo['fecha'],
-                'empresa': datos_consumo['empresa'],
-                'monto': datos_consumo['monto'],
-                'monto_numerico': monto_numerico,
-                'tipo_tarjeta': datos_consumo['tipo_tarjeta'],
-                'justificacion': justificacion,
-                'email_id': datos_consumo['email_id'],
-                'leido': datos_consumo['leido']
-            }
-            
-            # Guardar resultado completo y por categoría
-            resultados.append({**consumo_detalle, 'categoria': categoria})
-            
-            # Inicializar categoría si no existe
-            if categoria not in consumos_por_categoria:
-                consumos_por_categoria[categoria] = []
-            
-            consumos_por_categoria[categoria].append(consumo_detalle)
+            consumo = self.agregador.agregar(datos_consumo, clasificacion)
+            print(f"{self.agregador.emoji(consumo.categoria)} CATEGORÍA: {consumo.categoria}")
+            print(f"💭 Justificación: {consumo.justificacion}")
             
             print("=" * 60)
             print()
         
+        periodo_datos = self.datos_bcp.get('exportDate', 'N/A')
+        
         # Exportar a JSON si se solicita
-        if exportar_json and resultados:
+        if exportar_json and len(self.agregador):
             timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M')
             filename = f"consumos_bcp_clasificados_{timestamp}.json"
             
-            # Crear estructura completa del JSON
-            resultado_completo = {
-                "metadata": {
-                    "fecha_proceso": datetime.datetime.now().isoformat(),
-                    "total_consumos": len(resultados),
-                    "total_gastado": sum(r['monto_numerico'] for r in resultados),
-                    "periodo_datos": self.datos_bcp.get('exportDate', 'N/A'),
-                    "fuente": "BCP - Consumos últimos 7 días"
-                },
-                "resumen_categorias": {},
-                "consumos_por_categoria": {},
-                "todos_los_consumos": resultados
-            }
-            
-            # Agregar resumen y consumos por categoría
-            for categoria in sorted(categorias_count.keys()):
-                resultado_completo["resumen_categorias"][categoria] = {
-                    "cantidad": categorias_count[categoria],
-                    "total": round(total_por_categoria.get(categoria, 0), 2),
-                    "emoji": emojis.get(categoria, '🛒')
-                }
-                
-                # Agregar consumos de esta categoría
-                resultado_completo["consumos_por_categoria"][categoria] = {
-                    "emoji": emojis.get(categoria, '🛒'),
-                    "total_categoria": round(total_por_categoria.get(categoria, 0), 2),
-                    "cantidad_consumos": len(consumos_por_categoria.get(categoria, [])),
-                    "consumos": consumos_por_categoria.get(categoria, [])
-                }
-            
-            # Agregar categorías vacías para completitud
-            for categoria, emoji in emojis.items():
-                if categoria not in resultado_completo["consumos_por_categoria"]:
-                    resultado_completo["consumos_por_categoria"][categoria] = {
-                        "emoji": emoji,
-                        "total_categoria": 0.0,
-                        "cantidad_consumos": 0,
-                        "consumos": []
-                    }
-            
-            # Guardar JSON
             with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(resultado_completo, f, ensure_ascii=False, indent=2)
+                self.agregador.escribir_json(f, periodo_datos)
             
             print(f"� Resultados exportados a JSON: {filename}")
         
         # Mostrar resumen por categorías
-        print("\n📊 RESUMEN POR CATEGORÍAS:")
-        total_general = 0
-        for categoria in sorted(categorias_count.keys()):
-            count = categorias_count[categoria]
-            total_cat = total_por_categoria.get(categoria, 0)
-            total_general += total_cat
-            emoji = emojis.get(categoria, '🛒')
-            print(f"{emoji} {categoria}: {count} consumos - S/ {total_cat:.2f}")
-        
-        print(f"\n💰 RESUMEN GENERAL:")
-        print(f"📧 Total consumos procesados: {len(resultados)}")
-        print(f"💵 Total gastado: S/ {total_general:.2f}")
-        print(f"📅 Período: {self.datos_bcp.get('exportDate', 'N/A')}")
+        self.agregador.imprimir_resumen(periodo_datos)
+        if self.almacen:
+            self.almacen.imprimir()
+        if self.cache_comercios is not None:
+            self.cache_comercios.imprimir()
         print("=" * 80)
         
-        return resultados
+        # Los registros quedan en el agregador; hacia afuera, diccionarios como antes
+        return [consumo.a_dict() for consumo in self.agregador.resultados]
     
-    def obtener_json_clasificado(self):
-        """Retorna directamente el JSON clasificado sin exportar archivo"""
-        if not self.cargar_datos_bcp():
+    def obtener_json_clasificado(self, archivo_json=None):
+        """
+        Retorna directamente el JSON clasificado sin exportar archivo. `archivo_json`
+        (ruta o archivo abierto) reemplaza al archivo por defecto del BCP.
+        """
+        cargado = self.cargar_datos_bcp(archivo_json) if archivo_json else self.cargar_datos_bcp()
+        if not cargado:
             return None
         
-        emails = self.datos_bcp.get('emails', [])
-        if not emails:
+        emails = self._iterar_emails()
+        if emails is None:
             return None
         
         # Procesar sin mostrar en consola
-        resultados = []
-        categorias_count = {}
-        total_por_categoria = {}
-        consumos_por_categoria = {}
-        
-        emojis = {
-            'ALIMENTACIÓN': '🍕', 'TRANSPORTE': '🚗', 'COMPRAS': '🛒',
-            'SERVICIOS': '🏠', 'BANCARIO': '💳', 'ENTRETENIMIENTO': '🎮'
-        }
-        
-        # Inicializar categorías
-        for categoria in emojis.keys():
-            consumos_por_categoria[categoria] = []
-        
-        for email in emails:
-            datos_consumo = self.extraer_datos_consumo(email)
-            clasificacion = self.clasificar_consumo(datos_consumo)
-            
-            if "|" in clasificacion:
-                categoria, justificacion = clasificacion.split("|", 1)
-                categoria = categoria.strip()
-                justificacion = justificacion.strip()
-            else:
-                categoria = "COMPRAS"
-                justificacion = clasificacion
-            
-            categorias_count[categoria] = categorias_count.get(categoria, 0) + 1
-            
-            monto_numerico = 0
-            if datos_consumo['monto'] != "N/A":
-                try:
-                    monto_str = datos_consumo['monto'].replace('S/', '').replace(',', '').strip()
-                    monto_numerico = float(monto_str)
-                except:
-                    pass
-            
-            total_por_categoria[categoria] = total_por_categoria.get(categoria, 0) + monto_numerico
-            
-            consumo_detalle = {
-                'fecha': datos_consumo['fecha'],
-                'empresa': datos_consumo['empresa'],
-                'monto': datos_consumo['monto'],
-                'monto_numerico': monto_numerico,
-                'tipo_tarjeta': datos_consumo['tipo_tarjeta'],
-                'justificacion': justificacion,
-                'email_id': datos_consumo['email_id'],
-                'leido': datos_consumo['leido']
-            }
-            
-            # Agregar a la lista general y a la categoría específica
-            resultados.append({**consumo_detalle, 'categoria': categoria})
-            
-            # Inicializar categoría si no existe
-            if categoria not in consumos_por_categoria:
-                consumos_por_categoria[categoria] = []
-            
-            consumos_por_categoria[categoria].append(consumo_detalle)
-        
-        # Crear JSON estructurado
-        resultado_json = {
-            "metadata": {
-                "fecha_proceso": datetime.datetime.now().isoformat(),
-                "total_consumos": len(resultados),
-                "total_gastado": sum(r['monto_numerico'] for r in resultados),
-                "periodo_datos": self.datos_bcp.get('exportDate', 'N/A'),
-                "fuente": "BCP - Consumos últimos 7 días"
-            },
-            "resumen_categorias": {},
-            "consumos_por_categoria": {},
-            "todos_los_consumos": resultados
-        }
-        
-        # Agregar resumen y consumos por categoría
-        for categoria in sorted(categorias_count.keys()):
-            resultado_json["resumen_categorias"][categoria] = {
-                "cantidad": categorias_count[categoria],
-                "total": round(total_por_categoria.get(categoria, 0), 2),
-                "emoji": emojis.get(categoria, '🛒')
-            }
-            
-            # Agregar consumos de esta categoría
-            resultado_json["consumos_por_categoria"][categoria] = {
-                "emoji": emojis.get(categoria, '🛒'),
-                "total_categoria": round(total_por_categoria.get(categoria, 0), 2),
-                "cantidad_consumos": len(consumos_por_categoria.get(categoria, [])),
-                "consumos": consumos_por_categoria.get(categoria, [])
-            }
-        
-        # Agregar categorías vacías para completitud
-        for categoria, emoji in emojis.items():
-            if categoria not in resultado_json["consumos_por_categoria"]:
-                resultado_json["consumos_por_categoria"][categoria] = {
-                    "emoji": emoji,
-                    "total_categoria": 0.0,
-                    "cantidad_consumos": 0,
-                    "consumos": []
-                }
+        self.agregador = AgregadorConsumos(self.reglas_comercios.emojis)
+        for datos_consumo, clasificacion in self._iterar_consumos_clasificados(emails):
+            self.agregador.agregar(datos_consumo, clasificacion)
         
-        return resultado_json
+        return self.agregador.a_json(self.datos_bcp.get('exportDate', 'N/A'))
 
 def main():
     clasificador = ClasificadorBCP()
@@ -487,6 +401,8 @@ def main():
     except Exception as e:
         print(f"❌ Error: {e}")
         return None
+    finally:
+        clasificador.cerrar()
 
 if __name__ == "__main__":
     main()
@@ -1,22 +1,120 @@
 import pandas as pd
 import vertexai
 from vertexai.generative_models import GenerativeModel
-from gmail import get_gmail_service, listar_correos_con_campos, mover_correo_a_spam
-import datetime
+from exportador import cargar_registros
+from reglas import evaluar_reglas_importancia
+from lotes_llm import clasificar_en_lotes, completar_individualmente, agrupar, MAX_ITEMS_LOTE
+from ejecutor_llm import EjecutorLLM, CONCURRENCIA_LLM
+from preclasificador import (PreClasificador, MetricasCascada, normalizar_categoria,
+                             IMPORTANTE, UMBRAL_CONFIANZA)
+from reputacion_remitentes import ReputacionRemitentes
+from indice_similitud import IndiceSimilitud
+from almacen_resultados import AlmacenResultados, version_prompt, huella
+from gmail import (get_gmail_service, iterar_correos_con_campos, listar_correos_incrementales,
+                   confirmar_sincronizacion, en_segundo_plano, ColaSpam)
+import hashlib
 import json
+import os
+
+# Estado de sincronización incremental propio de este clasificador
+ARCHIVO_ESTADO_SYNC = 'sync_clasificador_correos.json'
+MODELO_GEMINI = "gemini-2.0-flash-001"
+# Subir al cambiar el prompt: invalida los resultados guardados de versiones anteriores
+VERSION_PROMPT = 1
+# Semilla del muestreo de ejemplos: el contexto es el mismo en cada corrida
+SEMILLA_MUESTREO = 42
+# Contextos de entrenamiento ya generados, por (ruta, mtime, sha256) del archivo histórico
+_CACHE_CONTEXTO = {}
+
+REGLAS_CLASIFICACION = """REGLAS DE CLASIFICACIÓN APRENDIDAS:
+        
+        ✅ IMPORTANTE cuando:
+        - Tiene labels: IMPORTANT, STARRED, PRIORITY
+        - Asunto contiene: urgente, importante, factura, pago, reunión, cita, crítico
+        - Remitente es: bancario, gubernamental, trabajo, seguros
+        - Requiere acción inmediata del usuario
+        
+        ❌ NO IMPORTANTE cuando:
+        - Tiene labels: CATEGORY_PROMOTIONS, CATEGORY_SOCIAL, SPAM
+        - Solo tiene UNREAD sin otros labels importantes
+        - Remitente es: noreply, marketing, redes sociales, tiendas online
+        - Asunto contiene: oferta, descuento, promoción, gratis, newsletter
+        - Es contenido promocional o social
+        
+        SÉ MUY ESTRICTO: Solo clasifica como IMPORTANTE si realmente requiere atención inmediata del usuario.
+        """
+
+# Contexto compacto cuando cada correo trae sus propios ejemplos del índice de similitud
+CONTEXTO_CON_EJEMPLOS = f"""
+        Eres un clasificador de correos entrenado con los datos históricos reales del usuario.
+        Cada correo a clasificar incluye los ejemplos más parecidos de su historial, con su categoría.
+
+        {REGLAS_CLASIFICACION}"""
+
+INSTRUCCIONES_CLASIFICACION = """Analiza cada correo comparándolo con los ejemplos históricos.
+        
+        PREGÚNTATE:
+        1. ¿Los labels son similares a correos importantes del historial?
+        2. ¿El remitente es de tipo trabajo/bancario/gubernamental?
+        3. ¿El asunto indica urgencia o requiere acción inmediata?
+        4. ¿Es contenido promocional/social como en los ejemplos NO importantes?
+        
+        CLASIFICA como IMPORTANTE solo si:
+        - Requiere acción inmediata del usuario
+        - Es de un remitente crítico (trabajo, banco, gobierno)
+        - Tiene labels que en el historial aparecen en correos importantes
+        
+        CLASIFICA como NO_IMPORTANTE si:
+        - Es promocional, marketing o social
+        - Solo tiene UNREAD sin otros labels importantes
+        - El remitente es típicamente no crítico (redes sociales, tiendas, newsletters)"""
+
+
+def _firma_archivo(ruta):
+    """Identifica una versión del archivo histórico: ruta absoluta, mtime y sha256"""
+    ruta = os.path.abspath(ruta)
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            sha.update(bloque)
+    return (ruta, os.path.getmtime(ruta), sha.hexdigest())
+
+
+def categoria_clasificacion(clasificacion):
+    """
+    IMPORTANTE o NO_IMPORTANTE de una respuesta CLASIFICACION|justificación;
+    None si el correo quedó sin clasificar (ERROR o sin categoría reconocida)
+    """
+    if not clasificacion or clasificacion.startswith("ERROR"):
+        return None
+    return normalizar_categoria(clasificacion.split("|", 1)[0])
+
 
 class ClasificadorCorreos:
-    def __init__(self):
+    def __init__(self, perfil_descarga='metadata', concurrencia_llm=CONCURRENCIA_LLM,
+                 mostrar_progreso=True):
         # Inicializar Vertex AI
         vertexai.init(project="gassistant-466419", location="us-central1")
-        self.model = GenerativeModel("gemini-2.0-flash-001")
+        self.model = GenerativeModel(MODELO_GEMINI)
+        # Llamadas al modelo en paralelo, con límite de concurrencia
+        self.ejecutor_llm = EjecutorLLM(concurrencia_llm, progreso=mostrar_progreso)
         self.gmail_service = get_gmail_service()
+        # Solo se usan headers y labels: 'full' es opcional (descarga el MIME completo)
+        self.perfil_descarga = perfil_descarga
         self.correos_historicos = None
+        self.firma_historico = None
+        self._contexto = None
+        # Con el índice activo, cada correo lleva sus ejemplos más parecidos
+        self.indice = None
+        # historyId de la sincronización incremental, pendiente hasta procesar los correos
+        self.history_id_pendiente = None
         
     def cargar_correos_historicos(self, archivo_excel="mis_correos_semana.xlsx"):
-        """Carga los correos históricos del archivo Excel"""
+        """Carga los correos históricos (Excel, Parquet, CSV o NDJSON según la extensión)"""
         try:
-            self.correos_historicos = pd.read_excel(archivo_excel)
+            self.correos_historicos = cargar_registros(archivo_excel)
+            self.firma_historico = _firma_archivo(archivo_excel)
+            self._contexto = None
             print(f"✅ Cargados {len(self.correos_historicos)} correos históricos")
             return True
         except Exception as e:
@@ -24,83 +122,50 @@ class ClasificadorCorreos:
             return False
     
     def generar_contexto_entrenamiento(self):
-        """Genera un contexto de entrenamiento basado en los correos históricos"""
+        """
+        Devuelve el contexto de entrenamiento, generado una sola vez por versión
+        del archivo histórico y compartido por todos los correos de la corrida
+        """
         if self.correos_historicos is None:
             return ""
+        if self._contexto is None:
+            if self.firma_historico is None:
+                # Datos asignados a mano: solo se memoiza en esta instancia
+                self._contexto = self._construir_contexto_entrenamiento()
+            else:
+                if self.firma_historico not in _CACHE_CONTEXTO:
+                    _CACHE_CONTEXTO[self.firma_historico] = self._construir_contexto_entrenamiento()
+                self._contexto = _CACHE_CONTEXTO[self.firma_historico]
+        return self._contexto
+    
+    def _construir_contexto_entrenamiento(self):
+        """Genera un contexto de entrenamiento basado en los correos históricos"""
+        # Evaluar todas las heurísticas sobre las columnas completas (una sola pasada)
+        df = self.correos_historicos
+        reglas = evaluar_reglas_importancia(df)
+        es_importante = reglas['es_importante']
         
-        # Analizar patrones más específicos en los datos históricos
-        correos_importantes = []
-        correos_no_importantes = []
+        # Recopilar ejemplos balanceados: los primeros 15 importantes; los demás
+        # que además cumplan criterios de no importante pasan a esa lista
+        en_importantes = es_importante & (es_importante.cumsum() <= 15)
+        candidatos_no = reglas['es_no_importante'] & ~en_importantes
         
-        # Dominios de trabajo comunes (puedes personalizar)
-        dominios_trabajo = ['@work.com', '@empresa.com', '@company.com', '@office.com', '@trabajo.com']
+        def _ejemplos(mascara, categoria):
+            filas = df.loc[mascara[mascara].index[:15]]
+            return [{
+                'subject': str(correo.get('subject', ''))[:80],  # Limitar longitud
+                'from': str(correo.get('from', ''))[:50],
+                'labels': str(correo.get('label_names', '')),
+                'categoria': categoria
+            } for _, correo in filas.iterrows()]
         
-        for _, correo in self.correos_historicos.iterrows():
-            labels = str(correo.get('label_names', ''))
-            subject = str(correo.get('subject', ''))
-            from_email = str(correo.get('from', ''))
-            
-            # CRITERIOS MÁS ESTRICTOS PARA IMPORTANTE
-            es_importante = any([
-                # Labels que indican importancia real
-                'IMPORTANT' in labels.upper(),
-                'STARRED' in labels.upper(),
-                'PRIORITY' in labels.upper(),
-                # Palabras clave específicas en el asunto
-                any(keyword in subject.upper() for keyword in [
-                    'URGENTE', 'IMPORTANTE', 'PRIORITY', 'URGENT', 'CRÍTICO', 'CRITICAL',
-                    'FACTURA', 'INVOICE', 'PAGO', 'PAYMENT', 'VENCIMIENTO', 'DUE',
-                    'REUNIÓN', 'MEETING', 'CITA', 'APPOINTMENT'
-                ]),
-                # Remitentes de trabajo o institucionales
-                any(domain in from_email.lower() for domain in dominios_trabajo),
-                # Remitentes bancarios o gubernamentales
-                any(keyword in from_email.lower() for keyword in [
-                    'banco', 'bank', 'sunat', 'gobierno', 'ministerio', 'seguro'
-                ])
-            ])
-            
-            # CRITERIOS PARA NO IMPORTANTE (más específicos)
-            es_no_importante = any([
-                # Labels que claramente indican no importancia
-                'CATEGORY_PROMOTIONS' in labels.upper(),
-                'CATEGORY_SOCIAL' in labels.upper(),
-                'SPAM' in labels.upper(),
-                'TRASH' in labels.upper(),
-                # Solo UNREAD sin otros labels importantes
-                (labels.count('UNREAD') > 0 and 'IMPORTANT' not in labels.upper() and 'STARRED' not in labels.upper()),
-                # Remitentes promocionales conocidos
-                any(keyword in from_email.lower() for keyword in [
-                    'noreply', 'no-reply', 'newsletter', 'marketing', 'promo', 'offer',
-                    'duolingo', 'youtube', 'facebook', 'instagram', 'twitter', 'linkedin',
-                    'amazon', 'mercadolibre', 'aliexpress'
-                ]),
-                # Asuntos promocionales
-                any(keyword in subject.upper() for keyword in [
-                    'OFERTA', 'DESCUENTO', 'PROMOCIÓN', 'SALE', 'OFFER', 'DISCOUNT',
-                    'GRATIS', 'FREE', 'NEWSLETTER', 'SUSCRIPCIÓN'
-                ])
-            ])
-            
-            # Recopilar ejemplos balanceados
-            if es_importante and len(correos_importantes) < 15:
-                correos_importantes.append({
-                    'subject': subject[:80],  # Limitar longitud
-                    'from': from_email[:50],
-                    'labels': labels,
-                    'categoria': 'IMPORTANTE'
-                })
-            elif es_no_importante and len(correos_no_importantes) < 15:
-                correos_no_importantes.append({
-                    'subject': subject[:80],
-                    'from': from_email[:50],
-                    'labels': labels,
-                    'categoria': 'NO_IMPORTANTE'
-                })
+        correos_importantes = _ejemplos(en_importantes, 'IMPORTANTE')
+        correos_no_importantes = _ejemplos(candidatos_no, 'NO_IMPORTANTE')
         
         # Agregar algunos ejemplos aleatorios si no tenemos suficientes
         if len(correos_no_importantes) < 10:
-            for _, correo in self.correos_historicos.sample(min(10, len(self.correos_historicos))).iterrows():
+            for _, correo in self.correos_historicos.sample(
+                    min(10, len(self.correos_historicos)), random_state=SEMILLA_MUESTREO).iterrows():
                 labels = str(correo.get('label_names', ''))
                 if 'IMPORTANT' not in labels.upper() and len(correos_no_importantes) < 15:
                     correos_no_importantes.append({
@@ -119,55 +184,66 @@ class ClasificadorCorreos:
         CORREOS MARCADOS COMO NO IMPORTANTES ({len(correos_no_importantes)} ejemplos):
         {json.dumps(correos_no_importantes, indent=2, ensure_ascii=False)}
 
-        REGLAS DE CLASIFICACIÓN APRENDIDAS:
-        
-        ✅ IMPORTANTE cuando:
-        - Tiene labels: IMPORTANT, STARRED, PRIORITY
-        - Asunto contiene: urgente, importante, factura, pago, reunión, cita, crítico
-        - Remitente es: bancario, gubernamental, trabajo, seguros
-        - Requiere acción inmediata del usuario
-        
-        ❌ NO IMPORTANTE cuando:
-        - Tiene labels: CATEGORY_PROMOTIONS, CATEGORY_SOCIAL, SPAM
-        - Solo tiene UNREAD sin otros labels importantes
-        - Remitente es: noreply, marketing, redes sociales, tiendas online
-        - Asunto contiene: oferta, descuento, promoción, gratis, newsletter
-        - Es contenido promocional o social
-        
-        SÉ MUY ESTRICTO: Solo clasifica como IMPORTANTE si realmente requiere atención inmediata del usuario.
-        """
+        {REGLAS_CLASIFICACION}"""
         
         return contexto
     
+    def activar_indice_similitud(self, ruta=None):
+        """
+        Abre el índice de similitud persistente y le agrega los correos del
+        historial que aún no tiene (o cuya etiqueta cambió)
+        """
+        self.indice = IndiceSimilitud(ruta) if ruta else IndiceSimilitud()
+        nuevos = 0
+        if self.correos_historicos is not None:
+            nuevos = self.indice.sincronizar(
+                self.correos_historicos.to_dict('records'),
+                PreClasificador.etiquetar_historial(self.correos_historicos)
+            )
+        print(f"🧭 Índice de similitud: {len(self.indice)} ejemplos ({nuevos} nuevos)")
+    
+    def cerrar_indice_similitud(self):
+        if self.indice is not None:
+            self.indice.cerrar()
+            self.indice = None
+    
+    def _contexto_prompt(self):
+        """Contexto del prompt: compacto con el índice; si no, el de entrenamiento completo"""
+        if self.indice is not None:
+            return CONTEXTO_CON_EJEMPLOS
+        return self.generar_contexto_entrenamiento()
+    
+    def _extracto_cuerpo(self, correo):
+        """Línea con el cuerpo del correo (solo con el perfil de descarga 'full')"""
+        if not correo.get('body_text'):
+            return ""
+        return f"Extracto del cuerpo: {correo['body_text']}"
+    
+    def _texto_correo(self, correo):
+        """Descripción del correo que va en el prompt (individual o por lotes)"""
+        texto = f"""Asunto: {correo.get('subject', '')}
+        De: {correo.get('from', '')}
+        Labels de Gmail: {correo.get('label_names', [])}
+        {self._extracto_cuerpo(correo)}"""
+        if self.indice is not None:
+            ejemplos = self.indice.ejemplos_para_prompt(correo)
+            if ejemplos:
+                texto += f"""
+        Ejemplos similares del historial:
+        {ejemplos}"""
+        return texto
+    
     def clasificar_correo(self, correo):
         """Clasifica un correo individual usando Gemini"""
-        contexto = self.generar_contexto_entrenamiento()
+        contexto = self._contexto_prompt()
         
         prompt = f"""
         {contexto}
 
         CORREO A CLASIFICAR:
-        Asunto: {correo.get('subject', '')}
-        De: {correo.get('from', '')}
-        Labels de Gmail: {correo.get('label_names', [])}
+        {self._texto_correo(correo)}
 
-        Analiza este correo comparándolo con los ejemplos históricos.
-        
-        PREGÚNTATE:
-        1. ¿Los labels son similares a correos importantes del historial?
-        2. ¿El remitente es de tipo trabajo/bancario/gubernamental?
-        3. ¿El asunto indica urgencia o requiere acción inmediata?
-        4. ¿Es contenido promocional/social como en los ejemplos NO importantes?
-        
-        CLASIFICA como IMPORTANTE solo si:
-        - Requiere acción inmediata del usuario
-        - Es de un remitente crítico (trabajo, banco, gobierno)
-        - Tiene labels que en el historial aparecen en correos importantes
-        
-        CLASIFICA como NO_IMPORTANTE si:
-        - Es promocional, marketing o social
-        - Solo tiene UNREAD sin otros labels importantes
-        - El remitente es típicamente no crítico (redes sociales, tiendas, newsletters)
+        {INSTRUCCIONES_CLASIFICACION}
         
         Responde EXACTAMENTE en este formato:
         CLASIFICACION|justificación_breve
@@ -187,28 +263,132 @@ class ClasificadorCorreos:
         except Exception as e:
             return f"ERROR|No se pudo clasificar: {e}"
     
-    def obtener_correos_nuevos(self, horas=24):
-        """Obtiene correos nuevos de las últimas X horas"""
-        print(f"🔄 Obteniendo correos de las últimas {horas} horas...")
-        
-        # Calcular fecha de inicio
-        ahora = datetime.datetime.now()
-        inicio = ahora - datetime.timedelta(hours=horas)
-        
-        # Usar el servicio de Gmail para obtener correos recientes
-        correos = listar_correos_con_campos(self.gmail_service, days=1)
+    def clasificar_correos_lote(self, correos, tamano_lote=MAX_ITEMS_LOTE):
+        """
+        Clasifica varios correos con un solo prompt por lote (el contexto de
+        entrenamiento se envía una vez por lote). Devuelve una lista alineada con
+        `correos` en el mismo formato que clasificar_correo; los correos cuya
+        respuesta no se pudo parsear se clasifican de a uno.
+        """
+        resultados = clasificar_en_lotes(
+            self.model,
+            self._contexto_prompt(),
+            [self._texto_correo(correo) for correo in correos],
+            INSTRUCCIONES_CLASIFICACION,
+            '"clasificacion": "IMPORTANTE" o "NO_IMPORTANTE", "justificacion": "<breve>"',
+            generation_config={"temperature": 0.0},
+            tokens_salida_por_item=60,
+            max_items_lote=tamano_lote,
+            ejecutor=self.ejecutor_llm,
+        )
+        clasificaciones = [
+            f"{r.get('clasificacion', '')}|{r.get('justificacion', '')}" if r is not None else None
+            for r in resultados
+        ]
+        return completar_individualmente(clasificaciones, correos, self.clasificar_correo,
+                                         self.ejecutor_llm)
+    
+    def clasificar_grupo(self, correos, tamano_lote=MAX_ITEMS_LOTE, preclasificador=None,
+                         metricas=None, reputacion=None):
+        """
+        Clasifica un grupo de correos en cascada: primero la reputación del
+        remitente (veredictos previos de Gemini), luego el pre-clasificador local;
+        solo el resto se envía en lotes a Gemini y sus veredictos alimentan la
+        reputación. Devuelve una lista alineada en formato CLASIFICACION|justificación.
+        """
+        clasificaciones = [None] * len(correos)
+        escalados = []
+        predicciones_locales = {}
+        for indice, correo in enumerate(correos):
+            decision = reputacion.consultar(correo.get('from', '')) if reputacion else None
+            if decision:
+                categoria, confianza, clave = decision
+                clasificaciones[indice] = (f"{categoria}|Reputación del remitente {clave} "
+                                           f"(confianza {confianza:.0%})")
+                if metricas:
+                    metricas.registrar_local('reputacion')
+                continue
+            if preclasificador is None:
+                escalados.append(indice)
+                continue
+            categoria, confianza, nivel, escalar = preclasificador.predecir(correo)
+            if escalar:
+                escalados.append(indice)
+                predicciones_locales[indice] = categoria
+            else:
+                clasificaciones[indice] = (f"{categoria}|Clasificación local por {nivel} "
+                                           f"(confianza {confianza:.0%})")
+                if metricas:
+                    metricas.registrar_local(nivel)
         
-        # Filtrar solo los correos muy recientes
-        correos_nuevos = []
-        for correo in correos:
-            # Aquí podrías agregar lógica más sofisticada para filtrar por fecha exacta
-            # Por simplicidad, tomamos todos los del último día
-            correos_nuevos.append(correo)
+        if escalados:
+            pendientes = [correos[indice] for indice in escalados]
+            if tamano_lote > 1:
+                respuestas = self.clasificar_correos_lote(pendientes, tamano_lote)
+            else:
+                respuestas = self.ejecutor_llm.mapear(self.clasificar_correo, pendientes)
+            etiquetados = []
+            for indice, clasificacion in zip(escalados, respuestas):
+                clasificaciones[indice] = clasificacion
+                # Los errores y las respuestas sin categoría reconocida no son veredictos
+                categoria = categoria_clasificacion(clasificacion)
+                if reputacion and categoria is not None:
+                    reputacion.registrar(correos[indice].get('from', ''), categoria)
+                if self.indice is not None and categoria is not None and correos[indice].get('message_id'):
+                    etiquetados.append((correos[indice]['message_id'], correos[indice], categoria))
+                if metricas:
+                    metricas.registrar_escalado(predicciones_locales.get(indice), categoria)
+            # Los veredictos de Gemini pasan a ser ejemplos para los próximos correos
+            if etiquetados:
+                self.indice.agregar_varios(etiquetados)
+        return clasificaciones
+    
+    @staticmethod
+    def clave_resultado(correo):
+        """(item_id, huella) del correo en el almacén de resultados"""
+        return correo.get('message_id'), huella(correo.get('subject', ''), correo.get('from', ''),
+                                                correo.get('body_text', ''))
+    
+    @staticmethod
+    def abrir_almacen():
+        """Almacén de resultados de este clasificador, con la versión actual del prompt"""
+        return AlmacenResultados('correos', version_prompt('correos', VERSION_PROMPT, MODELO_GEMINI))
+    
+    def iterar_correos_nuevos(self, horas=24, incremental=False):
+        """Produce los correos nuevos de las últimas X horas a medida que se descargan"""
+        if incremental:
+            print("🔄 Obteniendo correos nuevos desde la última sincronización...")
+            correos, self.history_id_pendiente = listar_correos_incrementales(
+                self.gmail_service, horas=horas, archivo_estado=ARCHIVO_ESTADO_SYNC,
+                perfil=self.perfil_descarga
+            )
+            yield from correos
+            return
+
+        print(f"🔄 Obteniendo correos de las últimas {horas} horas...")
         
+        # La ventana exacta va en la query de Gmail (after:/before: en segundos epoch):
+        # solo se listan y descargan los correos de las últimas `horas` horas
+        yield from iterar_correos_con_campos(self.gmail_service, horas=horas, perfil=self.perfil_descarga)
+    
+    def obtener_correos_nuevos(self, horas=24, incremental=False):
+        """
+        Obtiene correos nuevos de las últimas X horas. Con `incremental`, llamar a
+        confirmar_sincronizacion() una vez procesados.
+        """
+        correos_nuevos = list(self.iterar_correos_nuevos(horas, incremental=incremental))
         print(f"✅ Encontrados {len(correos_nuevos)} correos recientes")
         return correos_nuevos
     
-    def clasificar_correos_nuevos(self, horas=24, mover_a_spam=True):
+    def confirmar_sincronizacion(self):
+        """Guarda el historyId de la última sincronización incremental ya procesada"""
+        confirmar_sincronizacion(ARCHIVO_ESTADO_SYNC, self.history_id_pendiente)
+        self.history_id_pendiente = None
+    
+    def clasificar_correos_nuevos(self, horas=24, mover_a_spam=True, incremental=False,
+                                  tamano_lote=MAX_ITEMS_LOTE, preclasificar=True,
+                                  umbral_confianza=UMBRAL_CONFIANZA, usar_reputacion=True,
+                                  usar_indice_similitud=True, usar_almacen=True):
         """Clasifica todos los correos nuevos y muestra resultados en consola"""
         print("=" * 80)
         print("🤖 CLASIFICADOR AUTOMÁTICO DE CORREOS")
@@ -219,76 +399,125 @@ class ClasificadorCorreos:
             print("❌ No se pudieron cargar los correos históricos")
             return
         
-        # Obtener correos nuevos
-        correos_nuevos = self.obtener_correos_nuevos(horas)
-        
-        if not correos_nuevos:
-            print("ℹ️  No hay correos nuevos para clasificar")
-            return
-        
-        print(f"\n📧 Clasificando {len(correos_nuevos)} correos nuevos...\n")
-        
+        # Nivel local: los casos evidentes se resuelven sin llamar a Gemini
+        preclasificador = None
+        metricas = MetricasCascada()
+        if preclasificar:
+            preclasificador = PreClasificador(umbral_confianza).entrenar(self.correos_historicos)
+        reputacion = almacen = cola_spam = correos_nuevos = None
         importantes = 0
         no_importantes = 0
+        sin_clasificar = 0  # ERROR o respuesta sin categoría: nunca se mueven a spam
         correos_para_spam = []  # Lista de IDs para mover a spam
-        
-        for i, correo in enumerate(correos_nuevos, 1):
-            print(f"--- CORREO {i}/{len(correos_nuevos)} ---")
-            print(f"📨 Asunto: {correo.get('subject', 'Sin asunto')[:60]}...")
-            print(f"👤 De: {correo.get('from', 'Desconocido')}")
-            print(f"🏷️  Labels: {correo.get('label_names', [])}")
-            
-            # Clasificar
-            clasificacion = self.clasificar_correo(correo)
-            
-            if "|" in clasificacion:
-                categoria, justificacion = clasificacion.split("|", 1)
-                categoria = categoria.strip()
-                justificacion = justificacion.strip()
-            else:
-                categoria = clasificacion
-                justificacion = "Sin justificación"
+        movidos_exitosamente = 0
+        # Si Gemini o Gmail fallan a mitad de camino, igual se cierran los almacenes
+        # y se terminan de mover los correos que ya estaban en la cola de spam
+        try:
+            # Los remitentes ya clasificados por Gemini se deciden desde su reputación
+            reputacion = ReputacionRemitentes() if usar_reputacion else None
+            # Ejemplos few-shot por correo en lugar del historial completo en cada prompt
+            if usar_indice_similitud:
+                self.activar_indice_similitud()
+            # Los correos ya clasificados (misma versión del prompt) no se vuelven a enviar
+            almacen = self.abrir_almacen() if usar_almacen else None
             
-            if "IMPORTANTE" in categoria.upper():
-                print(f"🔴 CLASIFICACIÓN: IMPORTANTE")
-                importantes += 1
-                emoji = "🔴"
-            else:
-                print(f"🔵 CLASIFICACIÓN: NO IMPORTANTE")
-                no_importantes += 1
-                emoji = "🔵"
-                
-                # Agregar a lista para mover a spam
-                if mover_a_spam and correo.get('message_id'):
-                    correos_para_spam.append(correo['message_id'])
-                    print(f"� Marcado para mover a SPAM")
+            # Los correos se clasifican a medida que llegan: la descarga sigue en un
+            # hilo aparte y los no importantes se mueven a spam en otro
+            correos_nuevos = en_segundo_plano(self.iterar_correos_nuevos(horas, incremental=incremental))
+            cola_spam = ColaSpam(self.gmail_service) if mover_a_spam else None
             
-            print(f"�💭 Justificación: {justificacion}")
-            print(f"{emoji} {'='*50}")
-            print()
-        
-        # Mover correos no importantes a spam
-        if mover_a_spam and correos_para_spam:
-            print(f"\n🗑️  Moviendo {len(correos_para_spam)} correos no importantes a SPAM...")
+            print(f"\n📧 Clasificando correos nuevos a medida que llegan...\n")
             
-            movidos_exitosamente = 0
-            for i, message_id in enumerate(correos_para_spam, 1):
-                print(f"   Moviendo {i}/{len(correos_para_spam)}...", end=" ")
-                if mover_correo_a_spam(self.gmail_service, message_id):
-                    print("✅")
-                    movidos_exitosamente += 1
+            i = 0
+            # Se clasifican por grupos: nivel local y un prompt por lote para los escalados;
+            # cada grupo alcanza para tener `concurrencia` llamadas a Gemini en paralelo
+            for grupo in agrupar(correos_nuevos, tamano_lote * self.ejecutor_llm.concurrencia):
+                clasificar = lambda correos: self.clasificar_grupo(correos, tamano_lote, preclasificador,
+                                                                   metricas, reputacion)
+                if almacen:
+                    clasificaciones = almacen.resolver(
+                        grupo, self.clave_resultado, clasificar,
+                        valido=lambda clasificacion: categoria_clasificacion(clasificacion) is not None
+                    )
                 else:
-                    print("❌")
-            
+                    clasificaciones = clasificar(grupo)
+                for correo, clasificacion in zip(grupo, clasificaciones):
+                    i += 1
+                    print(f"--- CORREO {i} ---")
+                    print(f"📨 Asunto: {correo.get('subject', 'Sin asunto')[:60]}...")
+                    print(f"👤 De: {correo.get('from', 'Desconocido')}")
+                    print(f"🏷️  Labels: {correo.get('label_names', [])}")
+                    
+                    if "|" in clasificacion:
+                        categoria, justificacion = clasificacion.split("|", 1)
+                        categoria = categoria.strip()
+                        justificacion = justificacion.strip()
+                    else:
+                        categoria = clasificacion
+                        justificacion = "Sin justificación"
+                    
+                    categoria_final = categoria_clasificacion(clasificacion)
+                    if categoria_final == IMPORTANTE:
+                        print(f"🔴 CLASIFICACIÓN: IMPORTANTE")
+                        importantes += 1
+                        emoji = "🔴"
+                    elif categoria_final is None:
+                        print(f"⚠️  SIN CLASIFICAR: {categoria or 'sin categoría'}")
+                        sin_clasificar += 1
+                        emoji = "⚠️"
+                    else:
+                        print(f"🔵 CLASIFICACIÓN: NO IMPORTANTE")
+                        no_importantes += 1
+                        emoji = "🔵"
+                    
+                        # Agregar a lista para mover a spam
+                        if mover_a_spam and correo.get('message_id'):
+                            correos_para_spam.append(correo['message_id'])
+                            cola_spam.agregar(correo['message_id'])
+                            print(f"� Marcado para mover a SPAM")
+                    
+                    print(f"�💭 Justificación: {justificacion}")
+                    print(f"{emoji} {'='*50}")
+                    print()
+        finally:
+            if correos_nuevos is not None:
+                correos_nuevos.close()
+            if reputacion:
+                reputacion.cerrar()
+            if almacen:
+                almacen.cerrar()
+            self.cerrar_indice_similitud()
+            # Terminar de mover los correos no importantes que queden en la cola
+            if cola_spam:
+                movidos_exitosamente = cola_spam.cerrar()
+        
+        if correos_para_spam:
             print(f"\n✅ {movidos_exitosamente}/{len(correos_para_spam)} correos movidos a SPAM exitosamente")
+        if sin_clasificar and self.history_id_pendiente:
+            # Sin guardar el historyId, la próxima corrida incremental vuelve a listar
+            # estos correos (los ya clasificados se toman del almacén de resultados)
+            self.history_id_pendiente = None
+        else:
+            # Recién ahora los correos de la sincronización incremental quedan procesados
+            self.confirmar_sincronizacion()
+        
+        if importantes + no_importantes + sin_clasificar == 0:
+            print("ℹ️  No hay correos nuevos para clasificar")
+            return
         
         # Resumen final
         print("\n📊 RESUMEN DE CLASIFICACIÓN:")
         print(f"🔴 Importantes: {importantes}")
         print(f"🔵 No importantes: {no_importantes}")
+        if sin_clasificar:
+            print(f"⚠️  Sin clasificar (no se movieron; se reintentan cuando se vuelvan a listar): {sin_clasificar}")
         if mover_a_spam:
             print(f"🗑️  Movidos a SPAM: {len(correos_para_spam)}")
         print(f"📊 Total clasificados: {importantes + no_importantes}")
+        if preclasificador or reputacion:
+            metricas.imprimir()
+        if almacen:
+            almacen.imprimir()
         print("=" * 80)
 
 def main():
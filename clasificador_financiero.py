@@ -1,23 +1,51 @@
 import pandas as pd
 import vertexai
 from vertexai.generative_models import GenerativeModel
-from gmail import get_gmail_service, listar_correos_con_campos
+from exportador import cargar_registros, crear_exportador, convertir_a_excel
+from gmail import (get_gmail_service, iterar_correos_con_campos, listar_correos_con_campos,
+                   listar_correos_incrementales, confirmar_sincronizacion, en_segundo_plano)
+from reglas import es_correo_financiero, evaluar_reglas_financieras, QUERIES_FINANCIERAS
+from lotes_llm import clasificar_en_lotes, completar_individualmente, agrupar, MAX_ITEMS_LOTE
+from ejecutor_llm import EjecutorLLM, CONCURRENCIA_LLM
+from almacen_resultados import AlmacenResultados, version_prompt, huella
 import datetime
 import json
+import os
 import re
 
+# Estado de sincronización incremental propio de este clasificador
+ARCHIVO_ESTADO_SYNC = 'sync_clasificador_financiero.json'
+MODELO_GEMINI = "gemini-2.0-flash-001"
+# Subir al cambiar el prompt: invalida los resultados guardados de versiones anteriores
+VERSION_PROMPT = 1
+
+INSTRUCCIONES_CLASIFICACION = """Analiza cada correo y clasifícalo en UNA de las categorías listadas arriba.
+        
+        INSTRUCCIONES:
+        1. Lee cuidadosamente el asunto y remitente
+        2. Identifica de qué tipo de gasto se trata
+        3. Asigna la categoría más apropiada
+        4. Si detectas un monto, inclúyelo en tu respuesta"""
+
 class ClasificadorFinanciero:
-    def __init__(self):
+    def __init__(self, perfil_descarga='metadata', concurrencia_llm=CONCURRENCIA_LLM,
+                 mostrar_progreso=True):
         # Inicializar Vertex AI
         vertexai.init(project="gassistant-466419", location="us-central1")
-        self.model = GenerativeModel("gemini-2.0-flash-001")
+        self.model = GenerativeModel(MODELO_GEMINI)
+        # Llamadas al modelo en paralelo, con límite de concurrencia
+        self.ejecutor_llm = EjecutorLLM(concurrencia_llm, progreso=mostrar_progreso)
         self.gmail_service = get_gmail_service()
+        # Solo se usan headers y labels: 'full' es opcional (descarga el MIME completo)
+        self.perfil_descarga = perfil_descarga
         self.correos_historicos = None
+        # historyId de la sincronización incremental, pendiente hasta procesar los correos
+        self.history_id_pendiente = None
         
     def cargar_correos_historicos(self, archivo_excel="mis_correos_semana.xlsx"):
-        """Carga los correos históricos del archivo Excel"""
+        """Carga los correos históricos (Excel, Parquet, CSV o NDJSON según la extensión)"""
         try:
-            self.correos_historicos = pd.read_excel(archivo_excel)
+            self.correos_historicos = cargar_registros(archivo_excel)
             print(f"✅ Cargados {len(self.correos_historicos)} correos históricos")
             return True
         except Exception as e:
@@ -26,56 +54,67 @@ class ClasificadorFinanciero:
     
     def es_correo_financiero(self, correo):
         """Determina si un correo contiene información financiera"""
-        subject = str(correo.get('subject', '')).upper()
-        from_email = str(correo.get('from', '')).lower()
-        
-        # Palabras clave financieras en el asunto
-        palabras_financieras = [
-            'PAGO', 'PAYMENT', 'TRANSFERENCIA', 'TRANSFER', 'COMPRA', 'PURCHASE',
-            'FACTURA', 'INVOICE', 'RECIBO', 'RECEIPT', 'COBRO', 'CHARGE',
-            'TARJETA', 'CARD', 'DÉBITO', 'DEBIT', 'CRÉDITO', 'CREDIT',
-            'BANCO', 'BANK', 'CUENTA', 'ACCOUNT', 'SALDO', 'BALANCE',
-            'TRANSACCIÓN', 'TRANSACTION', 'MOVIMIENTO', 'MOVEMENT',
-            'RETIRO', 'WITHDRAWAL', 'DEPÓSITO', 'DEPOSIT', 'AHORRO', 'SAVINGS',
-            'PRÉSTAMO', 'LOAN', 'CUOTA', 'INSTALLMENT', 'INTERÉS', 'INTEREST',
-            'COMISIÓN', 'COMMISSION', 'FEE', 'COSTO', 'COST', 'PRECIO', 'PRICE',
-            'TOTAL', 'AMOUNT', 'SUMA', 'MONTO', 'VALOR', 'VALUE',
-            'YAPE', 'PLIN', 'BCP', 'BBVA', 'INTERBANK', 'SCOTIABANK',
-            'VISA', 'MASTERCARD', 'AMERICAN EXPRESS', 'DINERS'
-        ]
-        
-        # Remitentes financieros conocidos
-        remitentes_financieros = [
-            'banco', 'bank', 'bcp', 'bbva', 'interbank', 'scotiabank',
-            'visa', 'mastercard', 'yape', 'plin', 'paypal', 'mercadopago',
-            'culqi', 'izipay', 'payme', 'tunki', 'lukita', 'billetera',
-            'wallet', 'fintech', 'nequi', 'daviplata', 'financier',
-            'credito', 'prestamo', 'seguros', 'insurance', 'sunat',
-            'tributario', 'tax', 'facturacion', 'billing', 'cobranza'
-        ]
-        
-        # Patrones de montos (S/, $, €, etc.)
-        patron_monto = r'[S$€£¥]\s*[\d,]+\.?\d*|[\d,]+\.?\d*\s*[S$€£¥]|PEN|USD|EUR|GBP'
-        
-        # Verificar criterios
-        tiene_palabra_financiera = any(palabra in subject for palabra in palabras_financieras)
-        tiene_remitente_financiero = any(keyword in from_email for keyword in remitentes_financieros)
-        tiene_monto = bool(re.search(patron_monto, subject))
-        
-        return tiene_palabra_financiera or tiene_remitente_financiero or tiene_monto
+        # Palabras clave en el asunto, remitentes financieros o montos (S/, $, €, etc.)
+        return es_correo_financiero(correo)
     
-    def extraer_correos_financieros(self, dias=30):
-        """Extrae correos financieros de los últimos X días"""
-        print(f"🔄 Obteniendo correos de los últimos {dias} días...")
-        
-        # Obtener correos recientes
-        correos = listar_correos_con_campos(self.gmail_service, days=dias)
+    def iterar_correos_financieros(self, dias=30, incremental=False, prefiltro_servidor=False):
+        """
+        Produce los correos financieros de los últimos X días a medida que se descargan.
+        Con prefiltro_servidor (opcional), Gmail solo lista los correos cuyo remitente
+        o asunto contiene alguna palabra financiera completa; es_correo_financiero
+        queda como segunda pasada precisa. Gmail no busca subcadenas ni montos, así
+        que el prefiltro puede perder correos que las reglas locales aceptarían.
+        """
+        consultas = QUERIES_FINANCIERAS if prefiltro_servidor else None
+        if incremental:
+            # Solo lo nuevo desde la última corrida (escaneo completo la primera vez)
+            print("🔄 Obteniendo correos nuevos desde la última sincronización...")
+            correos, self.history_id_pendiente = listar_correos_incrementales(
+                self.gmail_service, days=dias, archivo_estado=ARCHIVO_ESTADO_SYNC,
+                perfil=self.perfil_descarga, consultas=consultas
+            )
+        else:
+            print(f"🔄 Obteniendo correos de los últimos {dias} días...")
+            # Obtener correos recientes página por página
+            correos = iterar_correos_con_campos(self.gmail_service, days=dias, perfil=self.perfil_descarga,
+                                                consultas=consultas)
         
         # Filtrar solo correos financieros
-        correos_financieros = []
+        total = financieros = 0
         for correo in correos:
+            total += 1
             if self.es_correo_financiero(correo):
-                correos_financieros.append(correo)
+                financieros += 1
+                yield correo
+        
+        print(f"✅ Encontrados {financieros} correos financieros de {total} totales")
+    
+    def confirmar_sincronizacion(self):
+        """Guarda el historyId de la última sincronización incremental ya procesada"""
+        confirmar_sincronizacion(ARCHIVO_ESTADO_SYNC, self.history_id_pendiente)
+        self.history_id_pendiente = None
+    
+    def extraer_correos_financieros(self, dias=30, incremental=False, prefiltro_servidor=False):
+        """
+        Extrae correos financieros de los últimos X días (prefiltro_servidor: ver
+        iterar_correos_financieros). Con `incremental`, llamar a
+        confirmar_sincronizacion() una vez procesados.
+        """
+        consultas = QUERIES_FINANCIERAS if prefiltro_servidor else None
+        if incremental:
+            correos, self.history_id_pendiente = listar_correos_incrementales(
+                self.gmail_service, days=dias, archivo_estado=ARCHIVO_ESTADO_SYNC,
+                perfil=self.perfil_descarga, consultas=consultas
+            )
+        else:
+            correos = listar_correos_con_campos(self.gmail_service, days=dias, perfil=self.perfil_descarga,
+                                                consultas=consultas)
+        if not correos:
+            return []
+        
+        # Con la lista completa, las reglas se evalúan por columnas en una pasada
+        es_financiero = evaluar_reglas_financieras(pd.DataFrame(correos))
+        correos_financieros = [c for c, ok in zip(correos, es_financiero) if ok]
         
         print(f"✅ Encontrados {len(correos_financieros)} correos financieros de {len(correos)} totales")
         return correos_financieros
@@ -114,10 +153,8 @@ class ClasificadorFinanciero:
         Si un gasto no encaja claramente en ninguna categoría, asígnalo a la más cercana.
         """
     
-    def clasificar_correo_financiero(self, correo):
-        """Clasifica un correo financiero por tipo de gasto"""
-        contexto = self.generar_contexto_clasificacion_financiera()
-        
+    def _texto_correo(self, correo):
+        """Descripción del correo financiero que va en el prompt (individual o por lotes)"""
         # Extraer información del monto si está disponible
         subject = str(correo.get('subject', ''))
         from_email = str(correo.get('from', ''))
@@ -126,22 +163,25 @@ class ClasificadorFinanciero:
         patron_monto = r'[S$€£¥]\s*[\d,]+\.?\d*|[\d,]+\.?\d*\s*[S$€£¥]'
         montos_encontrados = re.findall(patron_monto, subject)
         monto_info = f"Montos encontrados: {montos_encontrados}" if montos_encontrados else "Sin monto visible"
+        # El cuerpo solo viene con el perfil de descarga 'full'
+        cuerpo_info = f"Extracto del cuerpo: {correo['body_text']}" if correo.get('body_text') else ""
+        
+        return f"""Asunto: {subject}
+        De: {from_email}
+        {monto_info}
+        {cuerpo_info}"""
+    
+    def clasificar_correo_financiero(self, correo):
+        """Clasifica un correo financiero por tipo de gasto"""
+        contexto = self.generar_contexto_clasificacion_financiera()
         
         prompt = f"""
         {contexto}
 
         CORREO FINANCIERO A CLASIFICAR:
-        Asunto: {subject}
-        De: {from_email}
-        {monto_info}
+        {self._texto_correo(correo)}
 
-        Analiza este correo y clasifícalo en UNA de las categorías listadas arriba.
-        
-        INSTRUCCIONES:
-        1. Lee cuidadosamente el asunto y remitente
-        2. Identifica de qué tipo de gasto se trata
-        3. Asigna la categoría más apropiada
-        4. Si detectas un monto, inclúyelo en tu respuesta
+        {INSTRUCCIONES_CLASIFICACION}
         
         Responde EXACTAMENTE en este formato:
         CATEGORIA|monto_detectado|justificación_breve
@@ -164,82 +204,156 @@ class ClasificadorFinanciero:
         except Exception as e:
             return f"ERROR|N/A|No se pudo clasificar: {e}"
     
-    def procesar_correos_financieros(self, dias=30, exportar_excel=True):
-        """Procesa y clasifica todos los correos financieros"""
+    def clasificar_correos_financieros_lote(self, correos, tamano_lote=MAX_ITEMS_LOTE):
+        """
+        Clasifica varios correos financieros con un solo prompt por lote. Devuelve
+        una lista alineada con `correos` en el formato de clasificar_correo_financiero;
+        los correos cuya respuesta no se pudo parsear se clasifican de a uno.
+        """
+        resultados = clasificar_en_lotes(
+            self.model,
+            self.generar_contexto_clasificacion_financiera(),
+            [self._texto_correo(correo) for correo in correos],
+            INSTRUCCIONES_CLASIFICACION + """
+        
+        CATEGORIA es una de: ALIMENTACIÓN, TRANSPORTE, COMPRAS, SERVICIOS, BANCARIO, ENTRETENIMIENTO""",
+            '"categoria": "<CATEGORIA>", "monto": "<monto detectado o N/A>", '
+            '"justificacion": "<máximo 30 palabras>"',
+            generation_config={"temperature": 0.1},
+            tokens_salida_por_item=80,
+            max_items_lote=tamano_lote,
+            ejecutor=self.ejecutor_llm,
+        )
+        clasificaciones = [
+            f"{r.get('categoria', '')}|{r.get('monto', 'N/A')}|{r.get('justificacion', '')}"
+            if r is not None else None
+            for r in resultados
+        ]
+        return completar_individualmente(clasificaciones, correos, self.clasificar_correo_financiero,
+                                         self.ejecutor_llm)
+    
+    @staticmethod
+    def clave_resultado(correo):
+        """(item_id, huella) del correo en el almacén de resultados"""
+        return correo.get('message_id'), huella(correo.get('subject', ''), correo.get('from', ''),
+                                                correo.get('body_text', ''))
+    
+    @staticmethod
+    def abrir_almacen():
+        """Almacén de resultados de este clasificador, con la versión actual del prompt"""
+        return AlmacenResultados('financiero', version_prompt('financiero', VERSION_PROMPT, MODELO_GEMINI))
+    
+    def procesar_correos_financieros(self, dias=30, exportar_excel=True, incremental=False,
+                                     formato_exportacion='.ndjson', tamano_lote=MAX_ITEMS_LOTE,
+                                     usar_almacen=True, prefiltro_servidor=False):
+        """
+        Procesa y clasifica todos los correos financieros.
+        Con exportar_excel los resultados se escriben por lotes en `formato_exportacion`
+        a medida que se clasifican y al final se genera la copia en Excel.
+        prefiltro_servidor: ver iterar_correos_financieros.
+        """
         print("=" * 80)
         print("💰 CLASIFICADOR FINANCIERO DE CORREOS")
         print("=" * 80)
         
-        # Extraer correos financieros
-        correos_financieros = self.extraer_correos_financieros(dias)
-        
-        if not correos_financieros:
-            print("ℹ️  No se encontraron correos financieros")
-            return
+        # Los correos financieros se clasifican a medida que se descargan
+        correos_financieros = en_segundo_plano(self.iterar_correos_financieros(
+            dias, incremental=incremental, prefiltro_servidor=prefiltro_servidor))
+        # Los correos ya clasificados (misma versión del prompt) no se vuelven a enviar
+        almacen = self.abrir_almacen() if usar_almacen else None
         
-        print(f"\n💳 Clasificando {len(correos_financieros)} correos financieros...\n")
+        print(f"\n💳 Clasificando correos financieros a medida que llegan...\n")
         
         # Contadores por categoría
         categorias_count = {}
         resultados = []
+        exportador = None
+        if exportar_excel:
+            base = f"correos_financieros_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}"
+            exportador = crear_exportador(base + formato_exportacion)
         
-        for i, correo in enumerate(correos_financieros, 1):
-            print(f"--- CORREO FINANCIERO {i}/{len(correos_financieros)} ---")
-            print(f"📨 Asunto: {correo.get('subject', 'Sin asunto')[:60]}...")
-            print(f"👤 De: {correo.get('from', 'Desconocido')[:40]}...")
-            
-            # Clasificar
-            clasificacion = self.clasificar_correo_financiero(correo)
-            
-            if "|" in clasificacion:
-                partes = clasificacion.split("|", 2)
-                categoria = partes[0].strip() if len(partes) > 0 else "COMPRAS"
-                monto = partes[1].strip() if len(partes) > 1 else "N/A"
-                justificacion = partes[2].strip() if len(partes) > 2 else "Sin justificación"
+        i = 0
+        # Se clasifican por lotes: un prompt por cada `tamano_lote` correos y
+        # `concurrencia` prompts en paralelo por grupo
+        for grupo in agrupar(correos_financieros, tamano_lote * self.ejecutor_llm.concurrencia):
+            if tamano_lote > 1:
+                clasificar = lambda correos: self.clasificar_correos_financieros_lote(correos, tamano_lote)
             else:
-                categoria = "COMPRAS"
-                monto = "N/A"
-                justificacion = clasificacion
-            
-            # Mapear emojis por categoría (solo 6 categorías)
-            emojis = {
-                'ALIMENTACIÓN': '🍕',
-                'TRANSPORTE': '🚗', 
-                'COMPRAS': '🛒',
-                'SERVICIOS': '🏠',
-                'BANCARIO': '💳',
-                'ENTRETENIMIENTO': '🎮'
-            }
-            
-            emoji = emojis.get(categoria, '🛒')
-            print(f"{emoji} CATEGORÍA: {categoria}")
-            if monto != "N/A":
-                print(f"💵 Monto: {monto}")
-            print(f"💭 Justificación: {justificacion}")
-            
-            # Contar categorías
-            categorias_count[categoria] = categorias_count.get(categoria, 0) + 1
-            
-            # Guardar resultado
-            resultados.append({
-                'fecha': correo.get('date', ''),
-                'asunto': correo.get('subject', ''),
-                'remitente': correo.get('from', ''),
-                'categoria': categoria,
-                'monto': monto,
-                'justificacion': justificacion,
-                'labels': correo.get('label_names', [])
-            })
-            
-            print("=" * 60)
-            print()
+                clasificar = lambda correos: self.ejecutor_llm.mapear(self.clasificar_correo_financiero, correos)
+            if almacen:
+                clasificaciones = almacen.resolver(grupo, self.clave_resultado, clasificar)
+            else:
+                clasificaciones = clasificar(grupo)
+            for correo, clasificacion in zip(grupo, clasificaciones):
+                i += 1
+                print(f"--- CORREO FINANCIERO {i} ---")
+                print(f"📨 Asunto: {correo.get('subject', 'Sin asunto')[:60]}...")
+                print(f"👤 De: {correo.get('from', 'Desconocido')[:40]}...")
+                
+                if "|" in clasificacion:
+                    partes = clasificacion.split("|", 2)
+                    categoria = partes[0].strip() if len(partes) > 0 else "COMPRAS"
+                    monto = partes[1].strip() if len(partes) > 1 else "N/A"
+                    justificacion = partes[2].strip() if len(partes) > 2 else "Sin justificación"
+                else:
+                    categoria = "COMPRAS"
+                    monto = "N/A"
+                    justificacion = clasificacion
+                
+                # Mapear emojis por categoría (solo 6 categorías)
+                emojis = {
+                    'ALIMENTACIÓN': '🍕',
+                    'TRANSPORTE': '🚗', 
+                    'COMPRAS': '🛒',
+                    'SERVICIOS': '🏠',
+                    'BANCARIO': '💳',
+                    'ENTRETENIMIENTO': '🎮'
+                }
+                
+                emoji = emojis.get(categoria, '🛒')
+                print(f"{emoji} CATEGORÍA: {categoria}")
+                if monto != "N/A":
+                    print(f"💵 Monto: {monto}")
+                print(f"💭 Justificación: {justificacion}")
+                
+                # Contar categorías
+                categorias_count[categoria] = categorias_count.get(categoria, 0) + 1
+                
+                # Guardar resultado
+                resultado = {
+                    'fecha': correo.get('date', ''),
+                    'asunto': correo.get('subject', ''),
+                    'remitente': correo.get('from', ''),
+                    'categoria': categoria,
+                    'monto': monto,
+                    'justificacion': justificacion,
+                    'labels': correo.get('label_names', [])
+                }
+                resultados.append(resultado)
+                if exportador:
+                    exportador.agregar(resultado)
+                
+                print("=" * 60)
+                print()
         
-        # Exportar a Excel si se solicita
-        if exportar_excel and resultados:
-            filename = f"correos_financieros_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-            df = pd.DataFrame(resultados)
-            df.to_excel(filename, index=False)
-            print(f"📊 Resultados exportados a: {filename}")
+        if exportador:
+            exportador.cerrar()
+        if almacen:
+            almacen.cerrar()
+        # Recién ahora los correos de la sincronización incremental quedan procesados
+        self.confirmar_sincronizacion()
+        
+        if not resultados:
+            print("ℹ️  No se encontraron correos financieros")
+            if exportador and os.path.exists(exportador.filename):
+                os.remove(exportador.filename)
+            return
+        
+        # Exportar a Excel si se solicita (paso final sobre el archivo ya escrito)
+        if exportador:
+            print(f"📊 Resultados exportados a: {exportador.filename}")
+            if not exportador.filename.endswith('.xlsx'):
+                print(f"📊 Copia en Excel: {convertir_a_excel(exportador.filename)}")
         
         # Mostrar resumen por categorías
         print("\n📊 RESUMEN POR CATEGORÍAS:")
@@ -248,6 +362,8 @@ class ClasificadorFinanciero:
             print(f"{emoji} {categoria}: {count} correos")
         
         print(f"\n💰 Total correos financieros procesados: {len(resultados)}")
+        if almacen:
+            almacen.imprimir()
         print("=" * 80)
         
         return resultados
@@ -267,8 +383,12 @@ def main():
         exportar = input("¿Exportar resultados a Excel? (s/n, default: s): ").strip().lower()
         exportar_excel = exportar != 'n'
         
+        prefiltro = input("¿Listar solo los correos que pasan el prefiltro de Gmail? (s/n, default: n): ").strip().lower()
+        prefiltro_servidor = prefiltro == 's'
+        
         print(f"\n🔍 Buscando correos financieros de los últimos {dias} días...")
-        resultados = clasificador.procesar_correos_financieros(dias=dias, exportar_excel=exportar_excel)
+        resultados = clasificador.procesar_correos_financieros(dias=dias, exportar_excel=exportar_excel,
+                                                               prefiltro_servidor=prefiltro_servidor)
         
         if resultados:
             print(f"\n✅ Proceso completado exitosamente!")
@@ -0,0 +1,99 @@
+"""
+Registro compacto de un consumo BCP
+
+Cada consumo se guarda una sola vez como dataclass con __slots__ (sin
+__dict__ por instancia), con el monto en céntimos enteros y las categorías y
+tipos de tarjeta internados: todas las instancias comparten el mismo string.
+Las listas por categoría guardan referencias al mismo registro; el formato
+de diccionario del JSON de salida se arma recién al exportar.
+
+La interfaz pública de ClasificadorBCP sigue recibiendo y devolviendo
+diccionarios: como_consumo convierte en la entrada y a_dict en la salida.
+"""
+
+import re
+import sys
+from dataclasses import dataclass
+
+_RE_MONTO = re.compile(r'^\d+(\.\d*)?$')
+
+
+def monto_a_centavos(monto):
+    """Céntimos de un monto como 'S/ 1,234.50'; None si no se puede leer"""
+    if not isinstance(monto, str) or monto == "N/A":
+        return None
+    texto = monto.replace('S/', '').replace(',', '').strip()
+    if not _RE_MONTO.match(texto):
+        return None
+    return round(float(texto) * 100)
+
+
+@dataclass(slots=True)
+class Consumo:
+    fecha: str
+    empresa: str
+    monto: str
+    tipo_tarjeta: str
+    email_id: str = ''
+    leido: bool = False
+    centavos: int = None
+    categoria: str = None
+    justificacion: str = ''
+
+    def __post_init__(self):
+        self.tipo_tarjeta = sys.intern(str(self.tipo_tarjeta))
+        if self.centavos is None:
+            self.centavos = monto_a_centavos(self.monto)
+
+    @classmethod
+    def desde_dict(cls, datos):
+        """Consumo a partir de un diccionario como el de extraer_datos_consumo"""
+        return cls(
+            fecha=datos.get('fecha', ''),
+            empresa=datos.get('empresa', 'N/A'),
+            monto=datos.get('monto', 'N/A'),
+            tipo_tarjeta=datos.get('tipo_tarjeta', 'N/A'),
+            email_id=datos.get('email_id', ''),
+            leido=datos.get('leido', False)
+        )
+
+    @property
+    def monto_numerico(self):
+        """Monto en soles (0 si el monto no se pudo leer, como en el JSON original)"""
+        return self.centavos / 100 if self.centavos is not None else 0
+
+    def clasificar(self, categoria, justificacion):
+        self.categoria = sys.intern(categoria)
+        self.justificacion = justificacion
+
+    def a_datos(self):
+        """Diccionario con los datos extraídos del email (formato de extraer_datos_consumo)"""
+        return {
+            'monto': self.monto,
+            'empresa': self.empresa,
+            'fecha': self.fecha,
+            'tipo_tarjeta': self.tipo_tarjeta,
+            'email_id': self.email_id,
+            'leido': self.leido
+        }
+
+    def a_dict(self, con_categoria=True):
+        """Diccionario con el formato de los consumos del JSON de salida"""
+        datos = {
+            'fecha': self.fecha,
+            'empresa': self.empresa,
+            'monto': self.monto,
+            'monto_numerico': self.monto_numerico,
+            'tipo_tarjeta': self.tipo_tarjeta,
+            'justificacion': self.justificacion,
+            'email_id': self.email_id,
+            'leido': self.leido
+        }
+        if con_categoria:
+            datos['categoria'] = self.categoria
+        return datos
+
+
+def como_consumo(datos):
+    """Devuelve `datos` como Consumo (los diccionarios se convierten)"""
+    return datos if isinstance(datos, Consumo) else Consumo.desde_dict(datos)
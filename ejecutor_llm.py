@@ -0,0 +1,64 @@
+"""
+Ejecución concurrente de llamadas a Gemini
+
+Las llamadas a generate_content pasan casi todo el tiempo esperando la red,
+así que un pool de hilos con un límite de concurrencia reduce el tiempo de
+una corrida al de las llamadas más lentas en lugar de la suma de todas.
+"""
+
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Llamadas simultáneas al modelo por defecto
+CONCURRENCIA_LLM = 8
+# Cada cuánto revisa el hilo principal los resultados (permite Ctrl+C)
+INTERVALO_ESPERA = 0.5
+
+
+class EjecutorLLM:
+    """
+    Aplica una función que llama al modelo a varios items en paralelo, con
+    a lo sumo `concurrencia` llamadas en curso. Los resultados vuelven en el
+    orden original. Con `progreso` se muestra en consola cuántos terminaron.
+    """
+
+    def __init__(self, concurrencia=CONCURRENCIA_LLM, progreso=False):
+        self.concurrencia = max(1, concurrencia)
+        self.progreso = progreso
+
+    def _reportar(self, completados, total, descripcion):
+        if self.progreso and total > 1:
+            fin = "\n" if completados == total else ""
+            sys.stdout.write(f"\r⏳ {descripcion}: {completados}/{total}{fin}")
+            sys.stdout.flush()
+
+    def mapear(self, funcion, items, descripcion="Llamadas a Gemini"):
+        """Aplica `funcion` a cada item en paralelo y devuelve los resultados en orden"""
+        items = list(items)
+        if self.concurrencia == 1 or len(items) <= 1:
+            resultados = []
+            for completados, item in enumerate(items, 1):
+                resultados.append(funcion(item))
+                self._reportar(completados, len(items), descripcion)
+            return resultados
+
+        resultados = [None] * len(items)
+        pool = ThreadPoolExecutor(max_workers=min(self.concurrencia, len(items)),
+                                  thread_name_prefix='llm')
+        try:
+            futuros = {pool.submit(funcion, item): indice for indice, item in enumerate(items)}
+            pendientes = set(futuros)
+            while pendientes:
+                # Espera con timeout para que Ctrl+C llegue al hilo principal
+                listos, pendientes = wait(pendientes, timeout=INTERVALO_ESPERA,
+                                          return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    resultados[futuros[futuro]] = futuro.result()
+                if listos:
+                    self._reportar(len(items) - len(pendientes), len(items), descripcion)
+        except BaseException:
+            # Ctrl+C o error: no lanzar lo que aún no empezó
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return resultados
@@ -1,17 +1,17 @@
 import pandas as pd
 import os
+from exportador import cargar_registros
 
-def explorar_correos_excel():
-    """Explora la estructura del archivo Excel con correos"""
-    archivo = "mis_correos_semana.xlsx"
+def explorar_correos_excel(archivo="mis_correos_semana.xlsx"):
+    """Explora la estructura del archivo de correos (Excel, Parquet, CSV o NDJSON)"""
     
     if not os.path.exists(archivo):
         print(f"❌ No se encuentra el archivo {archivo}")
         return
     
     try:
-        # Leer archivo Excel
-        df = pd.read_excel(archivo)
+        # Leer archivo (las columnas de listas vuelven como listas)
+        df = cargar_registros(archivo)
         
         print("📊 ESTRUCTURA DEL ARCHIVO DE CORREOS:")
         print("=" * 50)
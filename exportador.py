@@ -0,0 +1,246 @@
+"""
+Exportación de registros (correos, resultados de clasificación) por lotes
+
+Formatos: Parquet (columnas de listas tipadas), CSV y NDJSON, escritos a
+medida que llegan los registros. Excel queda como paso final opcional
+(convertir_a_excel) porque openpyxl necesita tener todo en memoria.
+"""
+
+import ast
+import csv
+import json
+import os
+
+# pandas y pyarrow son opcionales: sin ellos no hay Excel ni Parquet
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Registros que se acumulan antes de escribir un lote
+TAMANO_LOTE_EXPORTACION = 1000
+# Columnas que contienen listas (en CSV/Excel se guardan como JSON)
+COLUMNAS_LISTA = ('labels', 'label_names')
+
+
+def _a_texto_plano(registro):
+    """Serializa las listas como JSON para formatos sin tipos anidados"""
+    return {k: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v
+            for k, v in registro.items()}
+
+
+class Exportador:
+    """Base de los exportadores: acumula registros y los escribe por lotes"""
+
+    def __init__(self, filename, tamano_lote=TAMANO_LOTE_EXPORTACION, columnas_excluidas=()):
+        self.filename = filename
+        self.tamano_lote = tamano_lote
+        self.columnas_excluidas = set(columnas_excluidas)
+        self.total = 0
+        self._pendientes = []
+
+    def agregar(self, registro):
+        if self.columnas_excluidas:
+            registro = {k: v for k, v in registro.items() if k not in self.columnas_excluidas}
+        self._pendientes.append(registro)
+        if len(self._pendientes) >= self.tamano_lote:
+            self.vaciar()
+
+    def vaciar(self):
+        """Escribe los registros pendientes"""
+        if self._pendientes:
+            self._escribir_lote(self._pendientes)
+            self.total += len(self._pendientes)
+            self._pendientes = []
+
+    def cerrar(self):
+        self.vaciar()
+        self._finalizar()
+        return self.total
+
+    def _escribir_lote(self, registros):
+        raise NotImplementedError
+
+    def _finalizar(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+class ExportadorNDJSON(Exportador):
+    """Un objeto JSON por línea; conserva listas y tipos"""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._archivo = open(filename, 'w', encoding='utf-8')
+
+    def _escribir_lote(self, registros):
+        self._archivo.writelines(
+            json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in registros
+        )
+        self._archivo.flush()
+
+    def _finalizar(self):
+        self._archivo.close()
+
+
+class ExportadorCSV(Exportador):
+    """CSV en streaming; las columnas las fija el primer lote y las listas van como JSON"""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._archivo = open(filename, 'w', encoding='utf-8', newline='')
+        self._writer = None
+
+    def _escribir_lote(self, registros):
+        if self._writer is None:
+            columnas = list(dict.fromkeys(k for r in registros for k in r))
+            self._writer = csv.DictWriter(self._archivo, fieldnames=columnas, extrasaction='ignore')
+            self._writer.writeheader()
+        self._writer.writerows(_a_texto_plano(r) for r in registros)
+        self._archivo.flush()
+
+    def _finalizar(self):
+        self._archivo.close()
+
+
+class ExportadorParquet(Exportador):
+    """Parquet por row groups; el esquema (con list<string>) se infiere del primer lote"""
+
+    def __init__(self, filename, **kwargs):
+        if not PYARROW_AVAILABLE:
+            raise ImportError("pyarrow no disponible - instala pyarrow para exportar a Parquet")
+        super().__init__(filename, **kwargs)
+        self._writer = None
+
+    def _escribir_lote(self, registros):
+        if self._writer is None:
+            # Columnas sin valores en el primer lote: se asumen de texto
+            campos = []
+            for campo in pa.Table.from_pylist(registros).schema:
+                if campo.type == pa.null():
+                    campo = pa.field(campo.name, pa.string())
+                elif campo.type == pa.list_(pa.null()):
+                    campo = pa.field(campo.name, pa.list_(pa.string()))
+                campos.append(campo)
+            tabla = pa.Table.from_pylist(registros, schema=pa.schema(campos))
+            self._writer = pq.ParquetWriter(self.filename, tabla.schema)
+        else:
+            tabla = pa.Table.from_pylist(registros, schema=self._writer.schema)
+        self._writer.write_table(tabla)
+
+    def _finalizar(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ExportadorExcel(Exportador):
+    """Excel vía pandas/openpyxl: se escribe todo al cerrar (usar solo para volúmenes chicos)"""
+
+    def __init__(self, filename, **kwargs):
+        if not PANDAS_AVAILABLE:
+            raise ImportError("pandas no disponible - funcionalidad de Excel deshabilitada")
+        super().__init__(filename, **kwargs)
+        self._registros = []
+
+    def _escribir_lote(self, registros):
+        self._registros.extend(_a_texto_plano(r) for r in registros)
+
+    def _finalizar(self):
+        pd.DataFrame(self._registros).to_excel(self.filename, index=False)
+
+
+EXPORTADORES = {
+    '.parquet': ExportadorParquet,
+    '.csv': ExportadorCSV,
+    '.ndjson': ExportadorNDJSON,
+    '.jsonl': ExportadorNDJSON,
+    '.xlsx': ExportadorExcel,
+}
+
+
+def crear_exportador(filename, **kwargs):
+    """Devuelve el exportador que corresponde a la extensión del archivo"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in EXPORTADORES:
+        raise ValueError(f"Formato de exportación no soportado: {extension}")
+    return EXPORTADORES[extension](filename, **kwargs)
+
+
+def extension_por_defecto():
+    """Parquet si pyarrow está instalado; si no, NDJSON"""
+    return '.parquet' if PYARROW_AVAILABLE else '.ndjson'
+
+
+def exportar_registros(registros, filename, **kwargs):
+    """Exporta un iterable de dicts por lotes y devuelve la cantidad escrita"""
+    exportador = crear_exportador(filename, **kwargs)
+    with exportador:
+        for registro in registros:
+            exportador.agregar(registro)
+    return exportador.total
+
+
+def _parsear_lista(valor):
+    """Convierte una lista serializada (JSON o repr de Python) de vuelta a lista"""
+    if isinstance(valor, str) and valor.startswith('['):
+        try:
+            return json.loads(valor)
+        except ValueError:
+            try:
+                return ast.literal_eval(valor)
+            except (ValueError, SyntaxError):
+                return valor
+    return valor
+
+
+def cargar_registros(filename):
+    """
+    Lee un archivo exportado (Parquet, CSV, NDJSON o Excel) como DataFrame.
+    Las columnas de listas vuelven como listas en todos los formatos.
+    """
+    if not PANDAS_AVAILABLE:
+        raise ImportError("pandas no disponible - no se pueden cargar registros")
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.parquet':
+        df = pd.read_parquet(filename)
+    elif extension == '.csv':
+        df = pd.read_csv(filename)
+    elif extension in ('.ndjson', '.jsonl'):
+        df = pd.read_json(filename, lines=True, dtype=False)
+    elif extension in ('.xlsx', '.xls'):
+        df = pd.read_excel(filename)
+    else:
+        raise ValueError(f"Formato no soportado: {extension}")
+
+    for columna in COLUMNAS_LISTA:
+        if columna in df.columns:
+            df[columna] = df[columna].map(
+                lambda v: list(v) if hasattr(v, 'tolist') else _parsear_lista(v)
+            )
+    return df
+
+
+def convertir_a_excel(origen, destino=None):
+    """Paso final opcional: genera un .xlsx a partir de un archivo ya exportado"""
+    destino = destino or os.path.splitext(origen)[0] + '.xlsx'
+    df = cargar_registros(origen)
+    for columna in COLUMNAS_LISTA:
+        if columna in df.columns:
+            df[columna] = df[columna].map(
+                lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, list) else v
+            )
+    df.to_excel(destino, index=False)
+    return destino
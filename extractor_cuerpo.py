@@ -0,0 +1,97 @@
+"""
+Extracción del cuerpo de texto de un mensaje de Gmail (payload format='full')
+
+Recorre el árbol MIME de forma iterativa, prefiere text/plain y, si no hay,
+convierte text/html a texto. Solo decodifica los bytes necesarios para
+respetar el tope de tamaño, así un newsletter enorme no dispara la memoria.
+"""
+
+import base64
+import codecs
+import html
+import re
+
+# Tope por defecto del texto extraído (bytes decodificados del cuerpo)
+MAX_BYTES_CUERPO = 4096
+
+_RE_CHARSET = re.compile(r'charset\s*=\s*"?([\w\-.:]+)"?', re.IGNORECASE)
+_RE_BLOQUES_OCULTOS = re.compile(r'<(script|style|head)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_RE_SALTOS = re.compile(r'<\s*(br|/p|/div|/tr|/li|/h[1-6])\b[^>]*>', re.IGNORECASE)
+_RE_ETIQUETAS = re.compile(r'<[^>]+>')
+_RE_ESPACIOS = re.compile(r'[ \t\r\f\v]+')
+_RE_LINEAS_VACIAS = re.compile(r'\n\s*\n+')
+
+
+def _charset(part):
+    """Devuelve el charset declarado en el Content-Type de la parte (utf-8 por defecto)"""
+    for header in part.get('headers', []):
+        if header.get('name', '').lower() == 'content-type':
+            match = _RE_CHARSET.search(header.get('value', ''))
+            if match:
+                try:
+                    return codecs.lookup(match.group(1)).name
+                except LookupError:
+                    break
+    return 'utf-8'
+
+
+def _decodificar(data, charset, max_bytes):
+    """
+    Decodifica base64url solo hasta `max_bytes` bytes y los convierte a texto.
+    Un carácter multibyte cortado por el tope se descarta.
+    """
+    # 4 caracteres base64 = 3 bytes: se toma solo el prefijo necesario
+    largo = -(-max_bytes // 3) * 4
+    prefijo = data[:largo]
+    prefijo += '=' * (-len(prefijo) % 4)
+    crudo = base64.urlsafe_b64decode(prefijo)[:max_bytes]
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    return decoder.decode(crudo, final=len(data) <= largo)
+
+
+def html_a_texto(contenido):
+    """Convierte HTML a texto plano con expresiones regulares (sin parsear el DOM)"""
+    contenido = _RE_BLOQUES_OCULTOS.sub(' ', contenido)
+    contenido = _RE_SALTOS.sub('\n', contenido)
+    contenido = _RE_ETIQUETAS.sub(' ', contenido)
+    contenido = html.unescape(contenido)
+    contenido = _RE_ESPACIOS.sub(' ', contenido)
+    return _RE_LINEAS_VACIAS.sub('\n', contenido).strip()
+
+
+def _partes_texto(payload):
+    """Recorre el árbol MIME sin recursión y devuelve (plain, html): la primera parte de cada tipo"""
+    plain = html_part = None
+    pila = [payload]
+    while pila and plain is None:
+        part = pila.pop()
+        hijos = part.get('parts')
+        if hijos:
+            # Invertidos para visitar las partes en su orden original
+            pila.extend(reversed(hijos))
+            continue
+        # Los adjuntos (con nombre de archivo) no son el cuerpo
+        if part.get('filename') or not part.get('body', {}).get('data'):
+            continue
+        mime = part.get('mimeType', '').lower()
+        if mime == 'text/plain':
+            plain = part
+        elif mime == 'text/html' and html_part is None:
+            html_part = part
+    return plain, html_part
+
+
+def extraer_cuerpo(payload, max_bytes=MAX_BYTES_CUERPO):
+    """
+    Devuelve el texto del cuerpo del mensaje, como máximo `max_bytes` bytes
+    decodificados. Usa text/plain si existe; si no, text/html convertido a
+    texto. Devuelve '' si el mensaje no tiene partes de texto.
+    """
+    plain, html_part = _partes_texto(payload)
+    if plain is not None:
+        return _decodificar(plain['body']['data'], _charset(plain), max_bytes).strip()
+    if html_part is not None:
+        # El HTML pierde mucho al quitar etiquetas: se decodifica con más margen
+        contenido = _decodificar(html_part['body']['data'], _charset(html_part), max_bytes * 4)
+        return html_a_texto(contenido)[:max_bytes]
+    return ''
@@ -2,20 +2,141 @@ import os
 import datetime
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
 import base64
+import httplib2
+import json
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+
+from exportador import exportar_registros, extension_por_defecto, convertir_a_excel
+from extractor_cuerpo import extraer_cuerpo, MAX_BYTES_CUERPO
 
 # Permisos para leer y modificar Gmail
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Gmail acepta como máximo 100 peticiones por cada llamada batch
+MAX_BATCH_SIZE = 100
+# messages.batchModify acepta hasta 1000 IDs por llamada
+MAX_BATCH_MODIFY = 1000
+# Códigos HTTP que justifican reintentar una petición
+CODIGOS_REINTENTABLES = (429, 500, 502, 503, 504)
+# Costo en unidades de cuota de cada método de Gmail
+COSTOS_CUOTA = {'list': 5, 'get': 5, 'modify': 5, 'batchModify': 50, 'history': 2, 'labels': 1}
+# Gmail permite 250 unidades de cuota por usuario por segundo
+CUOTA_POR_SEGUNDO = 250
+# Peticiones (o lotes) a Gmail en vuelo al mismo tiempo
+PARALELISMO_POR_DEFECTO = 8
+# Archivo donde se guarda el último historyId sincronizado
+ARCHIVO_ESTADO_SYNC = 'gmail_sync_state.json'
+# Segundos que se reutiliza el mapa de labels antes de volver a pedirlo
+TTL_LABELS = 600
+# El token se renueva en segundo plano este número de segundos antes de expirar
+MARGEN_RENOVACION_TOKEN = 300
+# Base SQLite local con los metadatos de los correos ya descargados
+ARCHIVO_ALMACEN = 'correos_cache.db'
+
+# Perfiles de descarga para messages.get. 'metadata' trae solo los headers y
+# campos que usan los clasificadores (máscara `fields=`); 'full' trae el MIME completo.
+HEADERS_CLASIFICACION = ['Subject', 'From', 'To', 'Date']
+PERFILES_DESCARGA = {
+    'metadata': {
+        'format': 'metadata',
+        'metadataHeaders': HEADERS_CLASIFICACION,
+        'fields': 'id,threadId,historyId,internalDate,labelIds,payload/headers',
+    },
+    'full': {
+        'format': 'full',
+    },
+}
+
+
+class _HttpContador:
+    """Envuelve un cliente httplib2 y cuenta los bytes enviados y recibidos"""
+
+    _lock = threading.Lock()
+    totales = {'enviados': 0, 'recibidos': 0, 'peticiones': 0}
+
+    def __init__(self, http):
+        self._http = http
+
+    def request(self, *args, **kwargs):
+        resp, content = self._http.request(*args, **kwargs)
+        body = kwargs.get('body') or (args[2] if len(args) > 2 else None)
+        with self._lock:
+            self.totales['enviados'] += len(body or b'')
+            self.totales['recibidos'] += len(content or b'')
+            self.totales['peticiones'] += 1
+        return resp, content
+
+    def __getattr__(self, nombre):
+        # credentials, timeout, redirect_codes, etc. del cliente original
+        return getattr(self._http, nombre)
+
+
+def bytes_transferidos():
+    """Devuelve una copia del contador de bytes transferidos con Gmail"""
+    with _HttpContador._lock:
+        return dict(_HttpContador.totales)
+
+
+def reiniciar_contador_bytes():
+    with _HttpContador._lock:
+        for clave in _HttpContador.totales:
+            _HttpContador.totales[clave] = 0
+
+
+def _imprimir_transferencia(antes):
+    despues = bytes_transferidos()
+    recibidos = despues['recibidos'] - antes['recibidos']
+    peticiones = despues['peticiones'] - antes['peticiones']
+    if peticiones:
+        print(f"📦 {recibidos / 1024:.1f} KB descargados de Gmail en {peticiones} peticiones")
+
+
+# Caché de proceso: credenciales y servicio se crean una sola vez por script
+_SERVICIO_GMAIL = None
+_CREDENCIALES = None
+_LOCK_SERVICIO = threading.Lock()
+
+
+def _guardar_token(creds):
+    with open('token.json', 'w') as token_file:
+        token_file.write(creds.to_json())
+
+
+def _programar_renovacion(creds):
+    """Renueva el token en segundo plano un poco antes de que expire"""
+    if not creds.expiry or not creds.refresh_token:
+        return
+    ahora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    espera = max(0, (creds.expiry - ahora).total_seconds() - MARGEN_RENOVACION_TOKEN)
+
+    def _renovar():
+        try:
+            creds.refresh(Request())
+            _guardar_token(creds)
+        except Exception as e:
+            # AuthorizedHttp igual renovará el token al recibir un 401
+            print(f"⚠️  No se pudo renovar el token de Gmail: {e}")
+            return
+        _programar_renovacion(creds)
 
-import datetime
-from googleapiclient.discovery import build
-import pandas as pd
+    timer = threading.Timer(espera, _renovar)
+    timer.daemon = True
+    timer.start()
 
 
-def get_gmail_service():
+def _obtener_credenciales():
     creds = None
     # Token de acceso guardado tras primer login
     if os.path.exists('token.json'):
@@ -29,110 +150,644 @@ def get_gmail_service():
                 'credentials.json', SCOPES)
             creds = flow.run_local_server(port=8080)
         # Guardamos para próximos runs
-        with open('token.json', 'w') as token_file:
-            token_file.write(creds.to_json())
+        _guardar_token(creds)
+    return creds
+
 
-    return build('gmail', 'v1', credentials=creds)
+def get_gmail_service():
+    """
+    Devuelve el servicio de Gmail del proceso, creándolo la primera vez.
 
+    Usa el documento de discovery estático que trae google-api-python-client
+    (sin descarga por red) y deja programada la renovación del token.
+    """
+    global _SERVICIO_GMAIL, _CREDENCIALES
+    with _LOCK_SERVICIO:
+        if _SERVICIO_GMAIL is None:
+            _CREDENCIALES = _obtener_credenciales()
+            _programar_renovacion(_CREDENCIALES)
+            http = _HttpContador(AuthorizedHttp(_CREDENCIALES, http=httplib2.Http()))
+            _SERVICIO_GMAIL = build('gmail', 'v1', http=http,
+                                    static_discovery=True, cache_discovery=False)
+        return _SERVICIO_GMAIL
 
 
-def listar_correos_semana(service):
-    # Fecha de hoy y hace 7 días
-    hoy = datetime.datetime.now()
-    hace_7_dias = hoy - datetime.timedelta(days=7)
 
-    # Gmail espera fechas en formato YYYY/MM/DD
-    fecha_inicio = hace_7_dias.strftime('%Y/%m/%d')
-    # Opcional: limitar hasta mañana para excluir correos de hoy después de la hora actual
-    mañana = (hoy + datetime.timedelta(days=1)).strftime('%Y/%m/%d')
+def construir_query_ventana(horas, hasta=None):
+    """
+    Query de Gmail para los correos de las últimas `horas` horas hasta `hasta`
+    (datetime; ahora por defecto). Usa segundos epoch en after:/before:, que
+    Gmail acepta con precisión de segundos; con fechas YYYY/MM/DD la ventana
+    se redondea a días completos en la zona horaria de la cuenta.
+    """
+    fin = (hasta or datetime.datetime.now()).timestamp()
+    inicio = fin - horas * 3600
+    # before: es exclusivo: +1 para incluir el segundo actual
+    return f'after:{int(inicio)} before:{int(fin) + 1}'
+
 
-    # Construye la query: correos desde hace 7 días hasta hoy
-    query = f'after:{fecha_inicio} before:{mañana}'
+def listar_correos_semana(service):
+    # Correos de los últimos 7 días, hasta este momento
+    query = construir_query_ventana(7 * 24)
 
+    ejecutor = EjecutorGmail(service)
     mensajes = []
     request = service.users().messages().list(userId='me', q=query)
     while request is not None:
-        resp = request.execute()
+        resp = ejecutor.ejecutar(request, COSTOS_CUOTA['list'])
         mensajes.extend(resp.get('messages', []))
         request = service.users().messages().list_next(request, resp)
 
-    print(f"Encontrados {len(mensajes)} correos en los últimos 7 días:\n")
-    for m in mensajes:
-        msg = service.users().messages().get(
+    def _obtener(m):
+        return ejecutor.ejecutar(service.users().messages().get(
             userId='me',
             id=m['id'],
             format='metadata',
             metadataHeaders=['Date','From','Subject']
-        ).execute()
+        ))
+
+    print(f"Encontrados {len(mensajes)} correos en los últimos 7 días:\n")
+    for msg in ejecutor.mapear(_obtener, mensajes):
         headers = {h['name']: h['value'] for h in msg['payload']['headers']}
         print(f"- {headers.get('Date')} | {headers.get('From')} | {headers.get('Subject')}")
 
 
+class AlmacenCorreos:
+    """
+    Copia local (SQLite) de los metadatos de los correos ya descargados,
+    indexada por message_id, fecha y remitente.
 
+    Los labels guardados reflejan el momento de la descarga; la sincronización
+    incremental vuelve a descargar y actualiza los mensajes reetiquetados.
+    """
 
+    def __init__(self, ruta=ARCHIVO_ALMACEN):
+        self.ruta = ruta
+        self.conn = sqlite3.connect(ruta)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mensajes (
+                message_id     TEXT PRIMARY KEY,
+                thread_id      TEXT,
+                history_id     TEXT,
+                subject        TEXT,
+                remitente      TEXT,
+                remitente_email TEXT,
+                destinatario   TEXT,
+                fecha          TEXT,
+                internal_date  INTEGER,
+                label_ids      TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_mensajes_fecha ON mensajes(internal_date);
+            CREATE INDEX IF NOT EXISTS idx_mensajes_remitente ON mensajes(remitente_email);
+        """)
+
+    @staticmethod
+    def _a_mensaje(fila):
+        """Reconstruye un mensaje con la forma de la API a partir de una fila"""
+        message_id, thread_id, history_id, subject, remitente, destinatario, fecha, internal_date, label_ids = fila
+        return {
+            'id': message_id,
+            'threadId': thread_id,
+            'historyId': history_id,
+            'internalDate': str(internal_date or ''),
+            'labelIds': json.loads(label_ids or '[]'),
+            'payload': {'headers': [
+                {'name': 'Subject', 'value': subject},
+                {'name': 'From', 'value': remitente},
+                {'name': 'To', 'value': destinatario},
+                {'name': 'Date', 'value': fecha},
+            ]}
+        }
+
+    def obtener(self, ids):
+        """Devuelve un dict message_id → mensaje para los IDs que ya están guardados"""
+        ids = list(ids)
+        encontrados = {}
+        # SQLite limita la cantidad de parámetros por consulta
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            marcadores = ','.join('?' * len(lote))
+            filas = self.conn.execute(
+                f"""SELECT message_id, thread_id, history_id, subject, remitente,
+                           destinatario, fecha, internal_date, label_ids
+                    FROM mensajes WHERE message_id IN ({marcadores})""",
+                lote
+            )
+            for fila in filas:
+                encontrados[fila[0]] = self._a_mensaje(fila)
+        return encontrados
+
+    def guardar(self, mensajes):
+        """Inserta o actualiza mensajes (dict message_id → mensaje de la API)"""
+        filas = []
+        for msg_id, msg in mensajes.items():
+            hdrs = {h['name']: h['value'] for h in msg.get('payload', {}).get('headers', [])}
+            remitente = hdrs.get('From', '')
+            filas.append((
+                msg_id,
+                msg.get('threadId'),
+                msg.get('historyId'),
+                hdrs.get('Subject', ''),
+                remitente,
+                parseaddr(remitente)[1].lower(),
+                hdrs.get('To', ''),
+                hdrs.get('Date', ''),
+                int(msg['internalDate']) if msg.get('internalDate') else None,
+                json.dumps(msg.get('labelIds', []))
+            ))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO mensajes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", filas
+            )
+
+    def buscar_por_remitente(self, email):
+        """Devuelve los mensajes guardados de un remitente, del más reciente al más antiguo"""
+        filas = self.conn.execute(
+            """SELECT message_id, thread_id, history_id, subject, remitente,
+                      destinatario, fecha, internal_date, label_ids
+               FROM mensajes WHERE remitente_email = ?
+               ORDER BY internal_date DESC""",
+            (email.lower(),)
+        )
+        return [self._a_mensaje(fila) for fila in filas]
+
+    def cerrar(self):
+        self.conn.close()
+
+
+def _es_error_reintentable(error):
+    """Indica si un error de la API es temporal (cuota o fallo del servidor)"""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in CODIGOS_REINTENTABLES:
+        return True
+    # Gmail devuelve 403 con rateLimitExceeded cuando se supera la cuota por usuario
+    return error.resp.status == 403 and 'rateLimitExceeded' in str(error)
 
-def listar_correos_con_campos(service, days=7):
-    hoy = datetime.datetime.now()
-    inicio = (hoy - datetime.timedelta(days=days)).strftime('%Y/%m/%d')
-    fin    = (hoy + datetime.timedelta(days=1)).strftime('%Y/%m/%d')
-    query  = f'after:{inicio} before:{fin}'
 
-    # 1) Listar IDs
-    ids, req = [], service.users().messages().list(userId='me', q=query)
-    while req:
-        resp = req.execute()
-        ids += [m['id'] for m in resp.get('messages', [])]
-        req = service.users().messages().list_next(req, resp)
+def _espera_backoff(intento, base=1.0, tope=32.0):
+    """Backoff exponencial con jitter completo (en segundos)"""
+    return random.uniform(0, min(tope, base * 2 ** intento))
 
-    # 2) Obtener labels map (ID → nombre)
-    labels_resp = service.users().labels().list(userId='me').execute()
-    labels_map  = {lbl['id']: lbl['name'] for lbl in labels_resp.get('labels', [])}
 
-    datos = []
-    for msg_id in ids:
-        msg = service.users().messages().get(
-            userId='me', id=msg_id, format='full'
-        ).execute()
-        hdrs = {h['name']: h['value'] for h in msg['payload']['headers']}
+class LimitadorCuota:
+    """
+    Token bucket calibrado en unidades de cuota de Gmail.
+
+    Una petición que cuesta más que la capacidad (p. ej. un batch de 100 gets)
+    espera a tener el balde lleno y lo deja en negativo, así las siguientes
+    esperan lo que corresponde.
+    """
 
-        # Mapear labelIds a nombres
-        label_names = [labels_map.get(l, l) for l in msg.get('labelIds', [])]
+    def __init__(self, unidades_por_segundo=CUOTA_POR_SEGUNDO):
+        self.tasa = unidades_por_segundo
+        self.capacidad = unidades_por_segundo
+        self.tokens = float(unidades_por_segundo)
+        self.ultimo = time.monotonic()
+        self._lock = threading.Lock()
 
-        datos.append({
-            'message_id':  msg_id,  # Agregar ID del mensaje
-            'subject':     hdrs.get('Subject', ''),
-            'from':        hdrs.get('From', ''),
-            'to':          hdrs.get('To', ''),
-            'date':        hdrs.get('Date', ''),
-            'labels':      msg.get('labelIds', []),
-            'label_names': label_names,
-            'clasificacion': ""  # columna vacía para tu etiquetado manual
-        })
+    def consumir(self, unidades):
+        requerido = min(unidades, self.capacidad)
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= requerido:
+                    self.tokens -= unidades
+                    return
+                espera = (requerido - self.tokens) / self.tasa
+            time.sleep(espera)
 
-    return datos
 
-def _extraer_cuerpo(payload):
+# La cuota es por usuario: todos los ejecutores del proceso comparten el limitador
+_LIMITADOR_GLOBAL = LimitadorCuota()
+
+
+class EjecutorGmail:
     """
-    Busca en el payload la parte text/plain y devuelve su contenido.
+    Ejecuta peticiones de Gmail en paralelo respetando la cuota por usuario.
+
+    Cada hilo usa su propio cliente HTTP (httplib2 no es thread-safe). Los
+    errores 429/5xx se reintentan con backoff exponencial con jitter.
     """
-    if 'parts' in payload:
-        for part in payload['parts']:
-            if part.get('mimeType') == 'text/plain':
-                data = part['body'].get('data')
-                if data:
-                    import base64
-                    return base64.urlsafe_b64decode(data).decode('utf-8')
-    # fallback al snippet si no hay text/plain
-    return payload.get('body', {}).get('data', '')
 
+    def __init__(self, service, paralelismo=PARALELISMO_POR_DEFECTO, limitador=None,
+                 max_reintentos=5):
+        self.service = service
+        self.paralelismo = max(1, paralelismo)
+        self.limitador = limitador or _LIMITADOR_GLOBAL
+        self.max_reintentos = max_reintentos
+        self._local = threading.local()
+
+    def _http_hilo(self):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            original = getattr(self.service._http, '_http', self.service._http)
+            if isinstance(original, AuthorizedHttp):
+                base = AuthorizedHttp(original.credentials, http=httplib2.Http())
+            else:
+                base = httplib2.Http()
+            http = self._local.http = _HttpContador(base)
+        return http
+
+    def ejecutar(self, request, costo=COSTOS_CUOTA['get']):
+        """Ejecuta una petición (o un BatchHttpRequest) descontando `costo` unidades"""
+        for intento in range(self.max_reintentos + 1):
+            self.limitador.consumir(costo)
+            try:
+                return request.execute(http=self._http_hilo())
+            except Exception as e:
+                if not _es_error_reintentable(e) or intento == self.max_reintentos:
+                    raise
+                time.sleep(_espera_backoff(intento))
+
+    def mapear(self, funcion, items):
+        """Aplica `funcion` a cada item en paralelo y devuelve los resultados en orden"""
+        items = list(items)
+        if self.paralelismo == 1 or len(items) <= 1:
+            return [funcion(item) for item in items]
+        pool = ThreadPoolExecutor(max_workers=self.paralelismo)
+        try:
+            resultados = list(pool.map(funcion, items))
+        except BaseException:
+            # Ctrl+C o error: no lanzar lo que aún no empezó
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return resultados
+
+
+def _obtener_mensajes_batch(service, ids, batch_size=MAX_BATCH_SIZE, batch_uri=None,
+                            max_reintentos=3, ejecutor=None, **params_get):
+    """
+    Descarga mensajes agrupando los `messages.get` en peticiones batch de Gmail.
 
-def mover_correo_a_spam(service, message_id):
+    Devuelve un dict message_id → mensaje. Los fallos se manejan por item:
+    los errores temporales se reintentan en un lote posterior y el resto se
+    informa por consola y se omite. Con batch_size=1 se hace un get por mensaje.
+    `batch_uri` permite apuntar el batch a otro endpoint (p. ej. un servidor falso local).
+    Los lotes se envían en paralelo a través de `ejecutor` (EjecutorGmail).
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    ejecutor = ejecutor or EjecutorGmail(service)
+    mensajes = {}
+    pendientes = list(ids)
+
+    def _descargar_lote(lote):
+        """Devuelve (mensajes, errores) de un lote"""
+        obtenidos, errores = {}, {}
+
+        def _callback(request_id, response, exception):
+            if exception is not None:
+                errores[request_id] = exception
+            else:
+                obtenidos[request_id] = response
+
+        if len(lote) == 1:
+            try:
+                _callback(lote[0], ejecutor.ejecutar(service.users().messages().get(
+                    userId='me', id=lote[0], **params_get), COSTOS_CUOTA['get']), None)
+            except Exception as e:
+                _callback(lote[0], None, e)
+            return obtenidos, errores
+
+        if batch_uri:
+            batch = BatchHttpRequest(callback=_callback, batch_uri=batch_uri)
+        else:
+            batch = service.new_batch_http_request(callback=_callback)
+        for msg_id in lote:
+            batch.add(
+                service.users().messages().get(userId='me', id=msg_id, **params_get),
+                request_id=msg_id
+            )
+        try:
+            ejecutor.ejecutar(batch, COSTOS_CUOTA['get'] * len(lote))
+        except Exception as e:
+            # Si falla el batch completo, todos sus items quedan pendientes
+            for msg_id in lote:
+                errores[msg_id] = e
+        return obtenidos, errores
+
+    for intento in range(max_reintentos + 1):
+        if not pendientes:
+            break
+        if intento > 0:
+            time.sleep(_espera_backoff(intento))
+
+        lotes = [pendientes[i:i + batch_size] for i in range(0, len(pendientes), batch_size)]
+        pendientes = []
+        for obtenidos, errores in ejecutor.mapear(_descargar_lote, lotes):
+            mensajes.update(obtenidos)
+            for msg_id, error in errores.items():
+                if _es_error_reintentable(error) and intento < max_reintentos:
+                    pendientes.append(msg_id)
+                else:
+                    print(f"❌ Error obteniendo correo {msg_id}: {error}")
+
+    return mensajes
+
+
+def _construir_registro(msg_id, msg, labels_map, incluir_cuerpo=False):
+    """
+    Convierte un mensaje de la API en el dict que consumen los clasificadores.
+    Con incluir_cuerpo (perfil 'full') agrega 'body_text' acotado.
+    """
+    hdrs = {h['name']: h['value'] for h in msg['payload']['headers']}
+
+    # Mapear labelIds a nombres
+    label_names = [labels_map.get(l, l) for l in msg.get('labelIds', [])]
+
+    registro = {
+        'message_id':  msg_id,  # Agregar ID del mensaje
+        'subject':     hdrs.get('Subject', ''),
+        'from':        hdrs.get('From', ''),
+        'to':          hdrs.get('To', ''),
+        'date':        hdrs.get('Date', ''),
+        'labels':      msg.get('labelIds', []),
+        'label_names': label_names,
+        'clasificacion': ""  # columna vacía para tu etiquetado manual
+    }
+    if incluir_cuerpo:
+        registro['body_text'] = _extraer_cuerpo(msg['payload'])
+    return registro
+
+
+_CACHE_LABELS = {'mapa': None, 'expira': 0.0}
+
+
+def invalidar_cache_labels():
+    """Fuerza a que el próximo _obtener_labels_map vuelva a consultar la API"""
+    _CACHE_LABELS['mapa'] = None
+
+
+def _obtener_labels_map(service, ejecutor=None, requeridos=()):
+    """
+    Devuelve el mapa labelId → nombre de la cuenta, cacheado por TTL_LABELS segundos.
+    Si falta alguno de los labelIds `requeridos` (p. ej. un label recién creado
+    que aparece en el historial), el caché se invalida.
+    """
+    mapa = _CACHE_LABELS['mapa']
+    if mapa is not None and time.monotonic() < _CACHE_LABELS['expira'] \
+            and all(label_id in mapa for label_id in requeridos):
+        return mapa
+
+    ejecutor = ejecutor or EjecutorGmail(service)
+    labels_resp = ejecutor.ejecutar(service.users().labels().list(userId='me'), COSTOS_CUOTA['labels'])
+    mapa = {lbl['id']: lbl['name'] for lbl in labels_resp.get('labels', [])}
+    _CACHE_LABELS['mapa'] = mapa
+    _CACHE_LABELS['expira'] = time.monotonic() + TTL_LABELS
+    return mapa
+
+
+def iterar_correos_con_campos(service, days=7, batch_size=MAX_BATCH_SIZE, batch_uri=None,
+                              almacen=None, usar_almacen=True, perfil='metadata', ejecutor=None,
+                              horas=None, consultas=None):
+    """
+    Versión generadora de listar_correos_con_campos: produce los registros
+    página por página, a medida que se descargan, sin armar la lista completa.
+    La ventana es de `horas` horas si se indica; si no, de `days` días.
+    `consultas` (lista de expresiones de búsqueda de Gmail) restringe el
+    listado del lado del servidor a los correos que cumplen alguna.
+    """
+    antes = bytes_transferidos()
+    ejecutor = ejecutor or EjecutorGmail(service)
+    if usar_almacen:
+        almacen = almacen or AlmacenCorreos()
+    ventana = construir_query_ventana(horas if horas is not None else days * 24)
+    # Con varias consultas (p. ej. un prefiltro repartido por largo) se listan
+    # todas y cada mensaje se procesa una sola vez
+    queries = [f'{ventana} ({consulta})' for consulta in consultas] if consultas else [ventana]
+    vistos = set()
+
+    for query in queries:
+        req = service.users().messages().list(userId='me', q=query)
+        while req:
+            # 1) Listar una página de IDs
+            resp = ejecutor.ejecutar(req, COSTOS_CUOTA['list'])
+            ids = [m['id'] for m in resp.get('messages', []) if m['id'] not in vistos]
+            vistos.update(ids)
+            req = service.users().messages().list_next(req, resp)
+
+            # 2) Leer primero del almacén local y descargar en lotes solo los que faltan
+            # (el almacén no guarda cuerpos: con el perfil 'full' se descarga todo)
+            mensajes = almacen.obtener(ids) if usar_almacen and perfil != 'full' else {}
+            faltantes = [msg_id for msg_id in ids if msg_id not in mensajes]
+            if faltantes:
+                descargados = _obtener_mensajes_batch(
+                    service, faltantes, batch_size=batch_size, batch_uri=batch_uri,
+                    ejecutor=ejecutor, **PERFILES_DESCARGA[perfil]
+                )
+                if usar_almacen:
+                    almacen.guardar(descargados)
+                mensajes.update(descargados)
+
+            # 3) Obtener labels map (ID → nombre), cacheado entre llamadas
+            labels_vistos = {l for msg in mensajes.values() for l in msg.get('labelIds', [])}
+            labels_map = _obtener_labels_map(service, ejecutor, requeridos=labels_vistos)
+
+            # Conservar el orden del listado; los mensajes que fallaron se omiten
+            for msg_id in ids:
+                if msg_id in mensajes:
+                    yield _construir_registro(msg_id, mensajes[msg_id], labels_map,
+                                              incluir_cuerpo=perfil == 'full')
+
+    _imprimir_transferencia(antes)
+
+
+def listar_correos_con_campos(service, days=7, batch_size=MAX_BATCH_SIZE, batch_uri=None,
+                              almacen=None, usar_almacen=True, perfil='metadata', ejecutor=None,
+                              horas=None, consultas=None):
+    return list(iterar_correos_con_campos(
+        service, days=days, batch_size=batch_size, batch_uri=batch_uri, almacen=almacen,
+        usar_almacen=usar_almacen, perfil=perfil, ejecutor=ejecutor, horas=horas,
+        consultas=consultas
+    ))
+
+
+def en_segundo_plano(iterable, max_pendientes=200):
+    """
+    Consume `iterable` en un hilo aparte y entrega sus elementos a través de una
+    cola acotada, para que la descarga avance mientras se clasifica.
+    Los errores del productor se relanzan en el consumidor.
+    """
+    cola = queue.Queue(maxsize=max_pendientes)
+    detener = threading.Event()
+    fin = object()
+
+    def _poner(item):
+        while not detener.is_set():
+            try:
+                cola.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _producir():
+        try:
+            for item in iterable:
+                if detener.is_set():
+                    return
+                _poner(item)
+        except BaseException as e:
+            _poner(_ErrorProductor(e))
+        finally:
+            _poner(fin)
+
+    hilo = threading.Thread(target=_producir, daemon=True)
+    hilo.start()
+    try:
+        while True:
+            item = cola.get()
+            if item is fin:
+                break
+            if isinstance(item, _ErrorProductor):
+                raise item.error
+            yield item
+    finally:
+        detener.set()
+
+
+class _ErrorProductor:
+    def __init__(self, error):
+        self.error = error
+
+
+def _leer_history_id(archivo_estado):
+    """Lee el último historyId guardado (o None si no hay sincronización previa)"""
+    if not os.path.exists(archivo_estado):
+        return None
+    try:
+        with open(archivo_estado, 'r', encoding='utf-8') as f:
+            return json.load(f).get('historyId')
+    except (OSError, ValueError):
+        return None
+
+
+def confirmar_sincronizacion(archivo_estado, history_id):
+    """
+    Guarda el historyId devuelto por listar_correos_incrementales. Llamarla recién
+    cuando los correos ya se procesaron: si la corrida se interrumpe antes, la
+    próxima vuelve a traer los mismos cambios.
+    """
+    if history_id is None:
+        return
+    with open(archivo_estado, 'w', encoding='utf-8') as f:
+        json.dump({
+            'historyId': str(history_id),
+            'actualizado': datetime.datetime.now().isoformat()
+        }, f)
+
+
+def _listar_ids_historial(service, start_history_id, ejecutor):
+    """
+    Lista los IDs de mensajes agregados o reetiquetados desde `start_history_id`.
+    Devuelve (ids, historyId_actual, labelIds_vistos). Lanza HttpError 404 si el
+    historyId expiró.
+    """
+    ids, vistos, labels_vistos = [], set(), set()
+    history_id_actual = start_history_id
+    req = service.users().history().list(
+        userId='me',
+        startHistoryId=start_history_id,
+        historyTypes=['messageAdded', 'labelAdded', 'labelRemoved']
+    )
+    while req:
+        resp = ejecutor.ejecutar(req, COSTOS_CUOTA['history'])
+        history_id_actual = resp.get('historyId', history_id_actual)
+        for evento in resp.get('history', []):
+            for clave in ('messagesAdded', 'labelsAdded', 'labelsRemoved'):
+                for item in evento.get(clave, []):
+                    msg_id = item['message']['id']
+                    labels_vistos.update(item.get('labelIds', []))
+                    labels_vistos.update(item['message'].get('labelIds', []))
+                    if msg_id not in vistos:
+                        vistos.add(msg_id)
+                        ids.append(msg_id)
+        req = service.users().history().list_next(req, resp)
+    return ids, history_id_actual, labels_vistos
+
+
+def listar_correos_incrementales(service, days=7, archivo_estado=ARCHIVO_ESTADO_SYNC,
+                                 batch_size=MAX_BATCH_SIZE, batch_uri=None,
+                                 almacen=None, usar_almacen=True, perfil='metadata',
+                                 ejecutor=None, horas=None, consultas=None):
+    """
+    Devuelve solo los correos agregados o reetiquetados desde la última sincronización,
+    usando users.history.list a partir del historyId guardado en `archivo_estado`.
+    Devuelve (correos, history_id): el nuevo historyId no se guarda acá, el
+    llamador lo confirma con confirmar_sincronizacion después de procesarlos.
+
+    Si no hay sincronización previa o el historyId expiró, hace un escaneo completo
+    de los últimos `days` días (o `horas` horas, si se indica), filtrado por
+    `consultas` si se indican; el historial no admite búsquedas y trae todo. Los registros tienen la misma forma que los de
+    listar_correos_con_campos; `perfil` es una clave de PERFILES_DESCARGA.
+    """
+    ejecutor = ejecutor or EjecutorGmail(service)
+    history_id = _leer_history_id(archivo_estado)
+    ids = None
+
+    if history_id:
+        try:
+            ids, nuevo_history_id, labels_vistos = _listar_ids_historial(
+                service, history_id, ejecutor
+            )
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            print("⚠️  El historyId guardado expiró, se hará un escaneo completo")
+
+    if ids is None:
+        # Tomar el historyId antes del escaneo para no perder cambios intermedios
+        perfil_cuenta = ejecutor.ejecutar(service.users().getProfile(userId='me'), 1)
+        correos = listar_correos_con_campos(
+            service, days=days, batch_size=batch_size, batch_uri=batch_uri,
+            almacen=almacen, usar_almacen=usar_almacen, perfil=perfil, ejecutor=ejecutor,
+            horas=horas, consultas=consultas
+        )
+        return correos, perfil_cuenta['historyId']
+
+    # Un label desconocido en el historial invalida el mapa cacheado
+    labels_map = _obtener_labels_map(service, ejecutor, requeridos=labels_vistos)
+    # Estos mensajes cambiaron: se descargan siempre y se actualiza el almacén
+    mensajes = _obtener_mensajes_batch(
+        service, ids, batch_size=batch_size, batch_uri=batch_uri,
+        ejecutor=ejecutor, **PERFILES_DESCARGA[perfil]
+    )
+    if usar_almacen:
+        (almacen or AlmacenCorreos()).guardar(mensajes)
+
+    correos = []
+    for msg_id in ids:
+        msg = mensajes.get(msg_id)
+        # Los correos ya enviados a spam o papelera no vuelven a procesarse
+        if msg is None or {'SPAM', 'TRASH'} & set(msg.get('labelIds', [])):
+            continue
+        correos.append(_construir_registro(msg_id, msg, labels_map,
+                                           incluir_cuerpo=perfil == 'full'))
+
+    print(f"🔄 Sincronización incremental: {len(correos)} correos nuevos o modificados")
+    return correos, nuevo_history_id
+
+
+def _extraer_cuerpo(payload, max_bytes=MAX_BYTES_CUERPO):
+    """
+    Busca en el payload la parte de texto (recorriendo multiparts anidados)
+    y devuelve su contenido, acotado a `max_bytes`.
+    """
+    return extraer_cuerpo(payload, max_bytes=max_bytes)
+
+
+def mover_correo_a_spam(service, message_id, ejecutor=None):
     """
     Mueve un correo específico a la bandeja de spam
     """
+    ejecutor = ejecutor or EjecutorGmail(service)
     try:
         # Obtener los labels actuales del mensaje
-        msg = service.users().messages().get(userId='me', id=message_id).execute()
+        msg = ejecutor.ejecutar(
+            service.users().messages().get(userId='me', id=message_id), COSTOS_CUOTA['get']
+        )
         current_labels = msg.get('labelIds', [])
         
         # Preparar las modificaciones de labels
@@ -144,14 +799,14 @@ def mover_correo_a_spam(service, message_id):
             labels_to_remove.append('INBOX')
         
         # Aplicar los cambios
-        service.users().messages().modify(
+        ejecutor.ejecutar(service.users().messages().modify(
             userId='me',
             id=message_id,
             body={
                 'addLabelIds': labels_to_add,
                 'removeLabelIds': labels_to_remove
             }
-        ).execute()
+        ), COSTOS_CUOTA['modify'])
         
         return True
     except Exception as e:
@@ -159,38 +814,101 @@ def mover_correo_a_spam(service, message_id):
         return False
 
 
-def marcar_como_spam_batch(service, message_ids):
+def marcar_como_spam_batch(service, message_ids, ejecutor=None, tamano_lote=MAX_BATCH_MODIFY):
     """
-    Mueve múltiples correos a spam de forma eficiente
+    Mueve múltiples correos a spam con messages.batchModify (hasta 1000 IDs por llamada).
+    Agrega SPAM y quita INBOX sin leer antes cada mensaje; informa el resultado
+    de cada lote y devuelve la cantidad de correos movidos.
     """
     if not message_ids:
         return 0
     
+    ejecutor = ejecutor or EjecutorGmail(service)
+    tamano_lote = max(1, min(tamano_lote, MAX_BATCH_MODIFY))
+    lotes = [message_ids[i:i + tamano_lote] for i in range(0, len(message_ids), tamano_lote)]
+
+    def _mover_lote(lote):
+        try:
+            ejecutor.ejecutar(service.users().messages().batchModify(
+                userId='me',
+                body={
+                    'ids': lote,
+                    'addLabelIds': ['SPAM'],
+                    'removeLabelIds': ['INBOX']
+                }
+            ), COSTOS_CUOTA['batchModify'])
+            return len(lote), None
+        except Exception as e:
+            return 0, e
+
     exitosos = 0
-    for msg_id in message_ids:
-        if mover_correo_a_spam(service, msg_id):
-            exitosos += 1
+    for n, (lote, (movidos, error)) in enumerate(zip(lotes, ejecutor.mapear(_mover_lote, lotes)), 1):
+        if error is None:
+            print(f"   Lote {n}/{len(lotes)}: ✅ {movidos} correos movidos a SPAM")
+        else:
+            print(f"   Lote {n}/{len(lotes)}: ❌ {len(lote)} correos no se pudieron mover: {error}")
+        exitosos += movidos
     
     return exitosos
 
 
 
 
+class ColaSpam:
+    """
+    Etapa de movimiento a spam de un pipeline: acumula IDs en una cola acotada
+    y un hilo los envía a marcar_como_spam_batch en lotes de `tamano_lote`.
+    """
+
+    def __init__(self, service, tamano_lote=100, max_pendientes=1000):
+        self.service = service
+        self.tamano_lote = tamano_lote
+        self.movidos = 0
+        self._cola = queue.Queue(maxsize=max_pendientes)
+        self._hilo = threading.Thread(target=self._consumir, daemon=True)
+        self._hilo.start()
+
+    def agregar(self, message_id):
+        self._cola.put(message_id)
+
+    def _consumir(self):
+        lote = []
+        while True:
+            message_id = self._cola.get()
+            if message_id is not None:
+                lote.append(message_id)
+            if lote and (message_id is None or len(lote) >= self.tamano_lote):
+                self.movidos += marcar_como_spam_batch(self.service, lote)
+                lote = []
+            if message_id is None:
+                return
+
+    def cerrar(self):
+        """Envía lo pendiente, espera al hilo y devuelve la cantidad de correos movidos"""
+        self._cola.put(None)
+        self._hilo.join()
+        return self.movidos
+
+
+def exportar_correos(correos, filename="mis_correos_semana.parquet"):
+    """
+    Exporta los correos por lotes a medida que llegan (Parquet, CSV, NDJSON o
+    Excel según la extensión), sin body_text ni snippet.
+    """
+    total = exportar_registros(correos, filename, columnas_excluidas=('body_text', 'snippet'))
+    print(f"✅ {total} correos exportados a '{filename}'")
+    return total
+
+
 def exportar_correos_a_excel(correos, filename="mis_correos_semana.xlsx"):
-    # Crear DataFrame y quitar columnas innecesarias
-    df = pd.DataFrame(correos)
-    # Asegúrate de no tener body_text ni snippet
-    for col in ['body_text', 'snippet']:
-        if col in df.columns:
-            df.drop(columns=[col], inplace=True)
-    # Exportar
-    df.to_excel(filename, index=False)
-    print(f"✅ {len(df)} correos exportados a '{filename}'")
+    return exportar_correos(correos, filename)
 
 if __name__ == '__main__':
     service = get_gmail_service()
-    correos = listar_correos_con_campos(service, days=30)
-    exportar_correos_a_excel(correos)
+    archivo = "mis_correos_semana" + extension_por_defecto()
+    exportar_correos(iterar_correos_con_campos(service, days=30), archivo)
+    # Excel como paso final opcional (los clasificadores leen cualquiera de los formatos)
+    print(f"✅ Copia en Excel: '{convertir_a_excel(archivo)}'")
 
 
 
@@ -0,0 +1,185 @@
+"""
+Índice de similitud de correos (TF-IDF con hashing)
+
+Cada correo etiquetado se representa con las palabras del asunto y el
+remitente (email y dominio), proyectadas a un espacio fijo de
+DIMENSION_HASH posiciones con crc32, así no hace falta guardar un
+vocabulario. Para un correo nuevo se recuperan los k ejemplos más
+parecidos (similitud coseno con pesos TF-IDF) y se arman como ejemplos
+few-shot del prompt, con un tope de caracteres.
+
+Los vectores se guardan en SQLite; al abrir el índice se reconstruye en
+memoria el índice invertido sin volver a tokenizar. Los ejemplos nuevos
+se agregan de a uno y actualizan las frecuencias de documento.
+"""
+
+import json
+import math
+import re
+import sqlite3
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+from email.utils import parseaddr
+
+ARCHIVO_INDICE = 'indice_similitud.db'
+# Posiciones del espacio de hashing (las colisiones son raras con este tamaño)
+DIMENSION_HASH = 1 << 20
+# Ejemplos recuperados por correo
+K_VECINOS = 5
+# Tope de caracteres de los ejemplos que van en el prompt de cada correo
+MAX_CARACTERES_EJEMPLOS = 1200
+
+_RE_PALABRA = re.compile(r'\w{3,}')
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFD', str(texto).lower())
+    return ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+
+
+def _atributos(subject, remitente):
+    """Palabras del asunto más email y dominio del remitente"""
+    atributos = _RE_PALABRA.findall(_normalizar(subject))
+    email = parseaddr(str(remitente))[1].lower()
+    if email:
+        atributos.append(f"de:{email}")
+        atributos.append(f"dominio:{email.rpartition('@')[2]}")
+    return atributos
+
+
+def vectorizar(subject, remitente):
+    """Vector disperso {posición: frecuencia} de un correo"""
+    return dict(Counter(zlib.crc32(a.encode('utf-8')) % DIMENSION_HASH
+                        for a in _atributos(subject, remitente)))
+
+
+class IndiceSimilitud:
+    """Índice persistente de correos etiquetados para recuperar ejemplos parecidos"""
+
+    def __init__(self, ruta=ARCHIVO_INDICE):
+        self.ruta = ruta
+        self.conn = sqlite3.connect(ruta)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS ejemplos (
+                item_id   TEXT PRIMARY KEY,
+                subject   TEXT,
+                remitente TEXT,
+                labels    TEXT,
+                categoria TEXT,
+                vector    TEXT
+            )
+        """)
+        # En memoria: ejemplos, índice invertido y frecuencias de documento
+        self.ejemplos = {}
+        self.vectores = {}
+        self.invertido = defaultdict(dict)
+        self.frecuencias = Counter()
+        for item_id, subject, remitente, labels, categoria, vector in self.conn.execute(
+                "SELECT item_id, subject, remitente, labels, categoria, vector FROM ejemplos"):
+            self._indexar(item_id, {'subject': subject, 'from': remitente,
+                                    'labels': labels, 'categoria': categoria},
+                          {int(k): v for k, v in json.loads(vector).items()})
+
+    def __len__(self):
+        return len(self.ejemplos)
+
+    def _indexar(self, item_id, ejemplo, vector):
+        self.ejemplos[item_id] = ejemplo
+        self.vectores[item_id] = vector
+        for posicion, frecuencia in vector.items():
+            self.invertido[posicion][item_id] = frecuencia
+            self.frecuencias[posicion] += 1
+
+    def _desindexar(self, item_id):
+        for posicion in self.vectores.pop(item_id, {}):
+            del self.invertido[posicion][item_id]
+            self.frecuencias[posicion] -= 1
+        self.ejemplos.pop(item_id, None)
+
+    def categoria(self, item_id):
+        ejemplo = self.ejemplos.get(item_id)
+        return ejemplo['categoria'] if ejemplo else None
+
+    def agregar(self, item_id, correo, categoria):
+        """Agrega (o reemplaza) un correo etiquetado en el índice y en disco"""
+        self.agregar_varios([(item_id, correo, categoria)])
+
+    def agregar_varios(self, items):
+        """Agrega una lista de (item_id, correo, categoria) en una sola transacción"""
+        filas = []
+        for item_id, correo, categoria in items:
+            ejemplo = {
+                'subject': str(correo.get('subject', ''))[:80],
+                'from': str(correo.get('from', ''))[:50],
+                'labels': str(correo.get('label_names', '')),
+                'categoria': categoria,
+            }
+            vector = vectorizar(correo.get('subject', ''), correo.get('from', ''))
+            self._desindexar(item_id)
+            self._indexar(item_id, ejemplo, vector)
+            filas.append((item_id, ejemplo['subject'], ejemplo['from'], ejemplo['labels'],
+                          categoria, json.dumps(vector)))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO ejemplos VALUES (?, ?, ?, ?, ?, ?)", filas
+            )
+
+    def sincronizar(self, correos, etiquetas):
+        """
+        Agrega los correos etiquetados que aún no están en el índice o cuya
+        categoría cambió (p. ej. el historial tiene nuevas filas etiquetadas).
+        Devuelve la cantidad de ejemplos agregados o actualizados.
+        """
+        nuevos = {}
+        for correo, categoria in zip(correos, etiquetas):
+            if categoria is None:
+                continue
+            item_id = str(correo.get('message_id') or '') or \
+                f"h{zlib.crc32((str(correo.get('subject')) + str(correo.get('from'))).encode('utf-8'))}"
+            if self.categoria(item_id) != categoria:
+                nuevos[item_id] = (item_id, correo, categoria)
+        if nuevos:
+            self.agregar_varios(list(nuevos.values()))
+        return len(nuevos)
+
+    def _idf(self, posicion):
+        return math.log((1 + len(self.ejemplos)) / (1 + self.frecuencias[posicion])) + 1
+
+    def _norma(self, vector):
+        return math.sqrt(sum((f * self._idf(p)) ** 2 for p, f in vector.items())) or 1.0
+
+    def vecinos(self, correo, k=K_VECINOS, excluir=None):
+        """Devuelve los k ejemplos más parecidos como lista de (similitud, ejemplo)"""
+        consulta = vectorizar(correo.get('subject', ''), correo.get('from', ''))
+        puntajes = defaultdict(float)
+        for posicion, frecuencia in consulta.items():
+            candidatos = self.invertido.get(posicion)
+            if not candidatos:
+                continue
+            peso = frecuencia * self._idf(posicion) ** 2
+            for item_id, frecuencia_item in candidatos.items():
+                puntajes[item_id] += peso * frecuencia_item
+        if excluir is not None:
+            puntajes.pop(excluir, None)
+        norma_consulta = self._norma(consulta)
+        mejores = sorted(
+            ((p / (norma_consulta * self._norma(self.vectores[i])), i) for i, p in puntajes.items()),
+            reverse=True
+        )[:k]
+        return [(similitud, self.ejemplos[item_id]) for similitud, item_id in mejores]
+
+    def ejemplos_para_prompt(self, correo, k=K_VECINOS, max_caracteres=MAX_CARACTERES_EJEMPLOS):
+        """Texto con los ejemplos más parecidos del historial, acotado a `max_caracteres`"""
+        lineas, largo = [], 0
+        for _, ejemplo in self.vecinos(correo, k, excluir=correo.get('message_id')):
+            linea = (f"- [{ejemplo['categoria']}] Asunto: {ejemplo['subject']} | "
+                     f"De: {ejemplo['from']} | Labels: {ejemplo['labels']}")
+            if largo + len(linea) > max_caracteres:
+                break
+            lineas.append(linea)
+            largo += len(linea)
+        return "\n        ".join(lineas)
+
+    def cerrar(self):
+        self.conn.close()
@@ -0,0 +1,140 @@
+"""
+Lectura incremental de exportaciones JSON grandes
+
+Un export del BCP es un objeto con metadata ('exportDate', 'totalEmails'...)
+y un arreglo 'emails' que puede ocupar cientos de MB. En lugar de json.load
+sobre el archivo completo, LectorJSONIncremental lee por bloques, recorre las
+claves del objeto de primer nivel y entrega los elementos del arreglo de a
+uno con json.JSONDecoder.raw_decode: la memoria depende del tamaño de un
+elemento, no del archivo, y el primer consumo está disponible de inmediato.
+"""
+
+import codecs
+import json
+
+# Caracteres leídos por bloque
+TAMANO_BLOQUE = 1 << 16
+_ESPACIOS = ' \t\n\r'
+
+
+class LectorJSONIncremental:
+    """
+    Recorre el arreglo `clave` de un objeto JSON sin cargar el archivo completo.
+
+    `archivo` puede ser una ruta o un archivo abierto (texto o binario UTF-8,
+    p. ej. el de un UploadFile). Al crearlo se leen las claves anteriores al
+    arreglo, disponibles en `metadata`; las posteriores se agregan al terminar
+    de iterar. Los errores de sintaxis se informan como json.JSONDecodeError.
+    """
+
+    def __init__(self, archivo, clave='emails', tamano_bloque=TAMANO_BLOQUE):
+        self.clave = clave
+        self.tamano_bloque = tamano_bloque
+        self._propio = isinstance(archivo, str)
+        self._archivo = open(archivo, 'r', encoding='utf-8') if self._propio else archivo
+        if isinstance(self._archivo.read(0), bytes):
+            self._archivo = codecs.getreader('utf-8')(self._archivo)
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._fin_archivo = False
+        self._en_arreglo = False
+        self._iterado = False
+        self.metadata = {}
+        self.elementos = 0
+
+        self._esperar('{')
+        self._leer_metadata()
+
+    # --- Buffer ---
+
+    def _leer_bloque(self):
+        """Agrega un bloque al buffer (descartando lo ya consumido); False al final del archivo"""
+        if self._fin_archivo:
+            return False
+        bloque = self._archivo.read(self.tamano_bloque)
+        if not bloque:
+            self._fin_archivo = True
+            return False
+        self._buffer = self._buffer[self._pos:] + bloque
+        self._pos = 0
+        return True
+
+    def _siguiente_caracter(self):
+        """Salta espacios y devuelve el próximo carácter sin consumirlo ('' al final)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _ESPACIOS:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._leer_bloque():
+                return ''
+
+    def _error(self, mensaje):
+        return json.JSONDecodeError(mensaje, self._buffer, self._pos)
+
+    def _esperar(self, caracteres):
+        caracter = self._siguiente_caracter()
+        if not caracter or caracter not in caracteres:
+            raise self._error(f"Se esperaba uno de {caracteres!r}")
+        self._pos += 1
+        return caracter
+
+    def _decodificar(self):
+        """Decodifica el próximo valor JSON completo, leyendo más bloques si hace falta"""
+        self._siguiente_caracter()
+        while True:
+            try:
+                valor, fin = self._decoder.raw_decode(self._buffer, self._pos)
+                # Un número al final del buffer puede seguir en el próximo bloque
+                if fin < len(self._buffer) or self._fin_archivo:
+                    self._pos = fin
+                    return valor
+            except json.JSONDecodeError:
+                if self._fin_archivo:
+                    raise
+            self._leer_bloque()
+
+    # --- Objeto de primer nivel ---
+
+    def _leer_metadata(self):
+        """Lee pares clave/valor hasta el arreglo `clave` (o hasta el final del objeto)"""
+        while True:
+            if self._siguiente_caracter() == '}':
+                self._pos += 1
+                return
+            nombre = self._decodificar()
+            if not isinstance(nombre, str):
+                raise self._error("Se esperaba el nombre de una clave")
+            self._esperar(':')
+            if nombre == self.clave and self._siguiente_caracter() == '[':
+                self._pos += 1
+                self._en_arreglo = True
+                return
+            self.metadata[nombre] = self._decodificar()
+            if self._esperar(',}') == '}':
+                return
+
+    def __iter__(self):
+        if self._iterado:
+            raise RuntimeError("El lector solo se puede recorrer una vez")
+        self._iterado = True
+        try:
+            if self._en_arreglo:
+                if self._siguiente_caracter() == ']':
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._decodificar()
+                        self.elementos += 1
+                        if self._esperar(',]') == ']':
+                            break
+                self._en_arreglo = False
+                if self._esperar(',}') == ',':
+                    self._leer_metadata()
+        finally:
+            self.cerrar()
+
+    def cerrar(self):
+        if self._propio and not self._archivo.closed:
+            self._archivo.close()
@@ -0,0 +1,156 @@
+"""
+Clasificación por lotes con Gemini
+
+Empaqueta varios items en un solo prompt (el contexto de instrucciones se
+envía una vez por lote, no una vez por item) y pide una respuesta JSON con
+un objeto por item numerado. Los resultados se mapean de vuelta por número;
+los items que no se pudieron parsear se reintentan en lotes más chicos.
+"""
+
+import json
+import re
+
+from ejecutor_llm import EjecutorLLM
+
+# Heurística: ~4 caracteres por token
+CARACTERES_POR_TOKEN = 4
+# Presupuesto de tokens de entrada por lote (contexto + items)
+MAX_TOKENS_ENTRADA = 24000
+# Límite de tokens de salida del modelo por llamada
+MAX_TOKENS_SALIDA = 8192
+# Items por lote como máximo (el tamaño real se ajusta a los límites de tokens)
+MAX_ITEMS_LOTE = 20
+
+_RE_ARREGLO_JSON = re.compile(r'\[.*\]', re.DOTALL)
+
+
+def estimar_tokens(texto):
+    return len(texto) // CARACTERES_POR_TOKEN + 1
+
+
+def agrupar(iterable, tamano):
+    """Agrupa un iterable (p. ej. un generador de correos) en listas de `tamano` elementos"""
+    grupo = []
+    for item in iterable:
+        grupo.append(item)
+        if len(grupo) >= tamano:
+            yield grupo
+            grupo = []
+    if grupo:
+        yield grupo
+
+
+def armar_lotes(textos, tokens_base, max_items, tokens_salida_por_item):
+    """
+    Reparte los índices de `textos` en lotes que respetan la cantidad máxima de
+    items, el presupuesto de tokens de entrada y el límite de tokens de salida.
+    """
+    max_items = max(1, min(max_items, MAX_TOKENS_SALIDA // tokens_salida_por_item))
+    lotes, actual, tokens = [], [], tokens_base
+    for indice, texto in enumerate(textos):
+        tokens_item = estimar_tokens(texto)
+        if actual and (len(actual) >= max_items or tokens + tokens_item > MAX_TOKENS_ENTRADA):
+            lotes.append(actual)
+            actual, tokens = [], tokens_base
+        actual.append(indice)
+        tokens += tokens_item
+    if actual:
+        lotes.append(actual)
+    return lotes
+
+
+def armar_prompt(contexto, textos, instrucciones, formato_respuesta):
+    """Arma el prompt de un lote: contexto una vez, items numerados y esquema JSON"""
+    items = "\n".join(f"[{numero}]\n{texto}" for numero, texto in enumerate(textos, 1))
+    return f"""
+        {contexto}
+
+        ITEMS A CLASIFICAR ({len(textos)}):
+        {items}
+
+        {instrucciones}
+
+        Responde SOLO con un arreglo JSON con un objeto por item, sin texto adicional:
+        [{{"id": <número del item>, {formato_respuesta}}}, ...]
+        """
+
+
+def parsear_respuesta(texto):
+    """Devuelve un dict número → objeto a partir de la respuesta JSON del modelo"""
+    match = _RE_ARREGLO_JSON.search(texto or '')
+    if not match:
+        return {}
+    try:
+        objetos = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    resultado = {}
+    for objeto in objetos if isinstance(objetos, list) else []:
+        if isinstance(objeto, dict) and 'id' in objeto:
+            try:
+                resultado[int(objeto['id'])] = objeto
+            except (TypeError, ValueError):
+                continue
+    return resultado
+
+
+def clasificar_en_lotes(model, contexto, textos, instrucciones, formato_respuesta,
+                        generation_config, tokens_salida_por_item=80,
+                        max_items_lote=MAX_ITEMS_LOTE, max_intentos=3, ejecutor=None):
+    """
+    Clasifica `textos` (descripciones ya formateadas de cada item) en lotes.
+
+    Devuelve una lista alineada con `textos`: el objeto JSON de cada item o
+    None si no se pudo obtener tras `max_intentos` (el llamador decide el
+    fallback). En cada reintento solo vuelven a enviarse los items fallidos,
+    con lotes de la mitad de tamaño. Los lotes de cada ronda se envían en
+    paralelo a través de `ejecutor` (EjecutorLLM).
+    """
+    ejecutor = ejecutor or EjecutorLLM()
+    resultados = [None] * len(textos)
+    pendientes = list(range(len(textos)))
+    tokens_base = estimar_tokens(contexto) + estimar_tokens(instrucciones) + 100
+
+    def _clasificar_lote(indices):
+        prompt = armar_prompt(contexto, [textos[i] for i in indices],
+                              instrucciones, formato_respuesta)
+        config = dict(generation_config)
+        config['max_output_tokens'] = min(MAX_TOKENS_SALIDA,
+                                          tokens_salida_por_item * len(indices) + 50)
+        try:
+            return parsear_respuesta(model.generate_content(prompt, generation_config=config).text)
+        except Exception:
+            return {}
+
+    for _ in range(max_intentos):
+        if not pendientes:
+            break
+        lotes = [[pendientes[i] for i in lote] for lote in armar_lotes(
+            [textos[i] for i in pendientes], tokens_base, max_items_lote, tokens_salida_por_item)]
+        respuestas = ejecutor.mapear(_clasificar_lote, lotes, descripcion="Lotes enviados a Gemini")
+        fallidos = []
+        for indices, respuesta in zip(lotes, respuestas):
+            for numero, indice in enumerate(indices, 1):
+                if numero in respuesta:
+                    resultados[indice] = respuesta[numero]
+                else:
+                    fallidos.append(indice)
+        pendientes = fallidos
+        max_items_lote = max(1, max_items_lote // 2)
+
+    return resultados
+
+
+def completar_individualmente(resultados, items, funcion, ejecutor=None):
+    """
+    Reemplaza los None de `resultados` por funcion(item), con una llamada
+    individual por item pendiente (en paralelo a través de `ejecutor`)
+    """
+    pendientes = [i for i, resultado in enumerate(resultados) if resultado is None]
+    if pendientes:
+        ejecutor = ejecutor or EjecutorLLM()
+        individuales = ejecutor.mapear(funcion, [items[i] for i in pendientes],
+                                       descripcion="Llamadas individuales a Gemini")
+        for indice, resultado in zip(pendientes, individuales):
+            resultados[indice] = resultado
+    return resultados
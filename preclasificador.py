@@ -0,0 +1,309 @@
+"""
+Pre-clasificador local en cascada (IMPORTANTE / NO_IMPORTANTE)
+
+Primer nivel del clasificador de correos: decide sin llamar a Gemini los
+casos evidentes y solo escala los de baja confianza. Los niveles, en orden:
+
+1. labels: reglas de labels de Gmail (promociones, social, spam, destacados)
+2. remitente: historial del mismo remitente o dominio
+3. bayes: naive Bayes sobre palabras del asunto, remitente y labels
+
+Cada nivel devuelve una confianza calibrada con el historial: las reglas y
+los remitentes con la regla de sucesión de Laplace sobre sus aciertos, y
+naive Bayes con una tabla por intervalos medida sobre una partición
+reservada del historial.
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from email.utils import parseaddr
+
+from reglas import evaluar_reglas_importancia
+
+IMPORTANTE = 'IMPORTANTE'
+NO_IMPORTANTE = 'NO_IMPORTANTE'
+
+# Confianza mínima para resolver un correo sin escalarlo a Gemini
+UMBRAL_CONFIANZA = 0.9
+# Una de cada N filas del historial se reserva para calibrar naive Bayes
+FRACCION_CALIBRACION = 5
+# Intervalos de probabilidad de la tabla de calibración
+INTERVALOS_CALIBRACION = 10
+# Correos mínimos de un remitente o dominio para usarlo como regla
+MIN_CORREOS_REMITENTE = 3
+
+REGLAS_LABELS = {
+    'spam_o_papelera': (NO_IMPORTANTE, {'SPAM', 'TRASH'}),
+    'promociones_o_social': (NO_IMPORTANTE, {'CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL'}),
+    'destacado': (IMPORTANTE, {'STARRED'}),
+}
+_LABELS_IMPORTANTES = {'IMPORTANT', 'STARRED'}
+
+# Webmail público: sus remitentes no tienen nada en común, el dominio no es una señal
+_RE_DOMINIO_PUBLICO = re.compile(
+    r'^(gmail|googlemail|hotmail|outlook|live|msn|yahoo|ymail|rocketmail|icloud|me|mac|aol|'
+    r'protonmail|proton|gmx|zoho|yandex|mail)\.(com|net|me|[a-z]{2}|com?\.[a-z]{2})$'
+)
+
+_RE_PALABRA = re.compile(r'\w{3,}')
+_RE_LABEL = re.compile(r'[A-Z][A-Z_/]+')
+
+
+def normalizar_categoria(texto):
+    """
+    Reduce la respuesta del modelo a IMPORTANTE o NO_IMPORTANTE, o None si no
+    trae ninguna de las dos (respuesta vacía, ERROR...): esos correos quedan
+    sin clasificar. NO_IMPORTANTE también contiene la subcadena IMPORTANTE: se
+    revisa primero.
+    """
+    texto = str(texto).upper().replace(' ', '_')
+    if 'NO_IMPORTANTE' in texto:
+        return NO_IMPORTANTE
+    if 'IMPORTANTE' in texto:
+        return IMPORTANTE
+    return None
+
+
+def es_dominio_publico(dominio):
+    """True para dominios de webmail compartidos por cualquiera (gmail.com, hotmail.es...)"""
+    return bool(_RE_DOMINIO_PUBLICO.match(dominio.lower()))
+
+
+def _labels(correo):
+    valor = correo.get('label_names')
+    if isinstance(valor, (list, tuple)):
+        return set(valor)
+    return set(_RE_LABEL.findall(str(valor or '')))
+
+
+def _remitente(correo):
+    """Devuelve (email, dominio) del remitente en minúsculas"""
+    email = parseaddr(str(correo.get('from', '')))[1].lower()
+    return email, email.rpartition('@')[2]
+
+
+def _tokens(correo):
+    """Atributos del correo para naive Bayes (cada uno cuenta una vez)"""
+    email, dominio = _remitente(correo)
+    tokens = {p for p in _RE_PALABRA.findall(str(correo.get('subject', '')).lower())}
+    tokens.update(f"label:{label}" for label in _labels(correo))
+    if email:
+        tokens.add(f"de:{email}")
+        tokens.add(f"dominio:{dominio}")
+    return tokens
+
+
+def _laplace(aciertos, total):
+    """Probabilidad de acierto estimada con la regla de sucesión de Laplace"""
+    return (aciertos + 1) / (total + 2)
+
+
+def _regla_labels(correo):
+    """Nombre de la primera regla de labels que aplica, o None"""
+    labels = _labels(correo)
+    for nombre, (categoria, requeridos) in REGLAS_LABELS.items():
+        if labels & requeridos and (categoria == IMPORTANTE or not labels & _LABELS_IMPORTANTES):
+            return nombre
+    return None
+
+
+class _NaiveBayes:
+    """Naive Bayes multinomial con suavizado de Laplace sobre atributos binarios"""
+
+    def __init__(self):
+        self.conteos = defaultdict(Counter)
+        self.totales = Counter()
+        self.documentos = Counter()
+        self.vocabulario = set()
+
+    def entrenar(self, documentos, etiquetas):
+        for tokens, etiqueta in zip(documentos, etiquetas):
+            self.conteos[etiqueta].update(tokens)
+            self.totales[etiqueta] += len(tokens)
+            self.documentos[etiqueta] += 1
+            self.vocabulario.update(tokens)
+        return self
+
+    def probabilidades(self, tokens):
+        """Probabilidad posterior de cada clase (los atributos desconocidos se ignoran)"""
+        n_docs = sum(self.documentos.values())
+        if not n_docs:
+            return {}
+        v = len(self.vocabulario)
+        log_probs = {}
+        for clase, docs in self.documentos.items():
+            log_p = math.log(docs / n_docs)
+            denominador = self.totales[clase] + v
+            for token in tokens:
+                if token in self.vocabulario:
+                    log_p += math.log((self.conteos[clase][token] + 1) / denominador)
+            log_probs[clase] = log_p
+        maximo = max(log_probs.values())
+        exp = {c: math.exp(lp - maximo) for c, lp in log_probs.items()}
+        suma = sum(exp.values())
+        return {c: e / suma for c, e in exp.items()}
+
+
+class PreClasificador:
+    """Clasificador local en cascada con confianza calibrada"""
+
+    def __init__(self, umbral=UMBRAL_CONFIANZA):
+        self.umbral = umbral
+        self.bayes = _NaiveBayes()
+        self.calibracion = []
+        self.precision_reglas = {}
+        self.remitentes = defaultdict(Counter)
+        self.entrenado = False
+
+    @staticmethod
+    def etiquetar_historial(df):
+        """
+        Etiquetas de entrenamiento del historial: la columna 'clasificacion' si
+        está llena; si no, las heurísticas de reglas.py (importante tiene prioridad).
+        Devuelve una lista alineada con las filas (None = sin etiqueta).
+        """
+        reglas = evaluar_reglas_importancia(df)
+        etiquetas = [
+            IMPORTANTE if imp else NO_IMPORTANTE if no_imp else None
+            for imp, no_imp in zip(reglas['es_importante'], reglas['es_no_importante'])
+        ]
+        if 'clasificacion' in df.columns:
+            for i, valor in enumerate(df['clasificacion']):
+                categoria = normalizar_categoria(valor) if isinstance(valor, str) else None
+                if categoria is not None:
+                    etiquetas[i] = categoria
+        return etiquetas
+
+    def entrenar(self, df):
+        """Entrena los tres niveles con el DataFrame de correos históricos"""
+        correos = df.to_dict('records')
+        ejemplos = [(c, e) for c, e in zip(correos, self.etiquetar_historial(df)) if e is not None]
+
+        # Precisión de cada regla de labels sobre el historial etiquetado
+        aciertos, totales = Counter(), Counter()
+        for correo, etiqueta in ejemplos:
+            regla = _regla_labels(correo)
+            if regla:
+                totales[regla] += 1
+                aciertos[regla] += REGLAS_LABELS[regla][0] == etiqueta
+        self.precision_reglas = {r: _laplace(aciertos[r], totales[r]) for r in REGLAS_LABELS}
+
+        # Historial por remitente y por dominio
+        self.remitentes = defaultdict(Counter)
+        for correo, etiqueta in ejemplos:
+            email, dominio = _remitente(correo)
+            if email:
+                self.remitentes[email][etiqueta] += 1
+                if not es_dominio_publico(dominio):
+                    self.remitentes['@' + dominio][etiqueta] += 1
+
+        # Calibración: se entrena sin la partición reservada y se mide sobre ella
+        entrenamiento = [x for i, x in enumerate(ejemplos) if i % FRACCION_CALIBRACION]
+        reservados = [x for i, x in enumerate(ejemplos) if not i % FRACCION_CALIBRACION]
+        modelo = _NaiveBayes().entrenar([_tokens(c) for c, _ in entrenamiento],
+                                        [e for _, e in entrenamiento])
+        aciertos_intervalo = [0] * INTERVALOS_CALIBRACION
+        totales_intervalo = [0] * INTERVALOS_CALIBRACION
+        for correo, etiqueta in reservados:
+            probs = modelo.probabilidades(_tokens(correo))
+            if not probs:
+                continue
+            clase, prob = max(probs.items(), key=lambda x: x[1])
+            intervalo = self._intervalo(prob)
+            totales_intervalo[intervalo] += 1
+            aciertos_intervalo[intervalo] += clase == etiqueta
+        # Un intervalo sin datos queda en 0.5: esas predicciones siempre se escalan
+        self.calibracion = [_laplace(a, t) for a, t in zip(aciertos_intervalo, totales_intervalo)]
+
+        # El modelo final usa todo el historial (la tabla de calibración se conserva)
+        self.bayes = _NaiveBayes().entrenar([_tokens(c) for c, _ in ejemplos],
+                                            [e for _, e in ejemplos])
+        self.entrenado = bool(ejemplos)
+        return self
+
+    @staticmethod
+    def _intervalo(prob):
+        return min(int(prob * INTERVALOS_CALIBRACION), INTERVALOS_CALIBRACION - 1)
+
+    def _nivel_remitente(self, correo):
+        email, dominio = _remitente(correo)
+        claves = (email,) if es_dominio_publico(dominio) else (email, '@' + dominio)
+        for clave in claves:
+            conteo = self.remitentes.get(clave)
+            if conteo and sum(conteo.values()) >= MIN_CORREOS_REMITENTE:
+                categoria, n = conteo.most_common(1)[0]
+                return categoria, _laplace(n, sum(conteo.values()))
+        return None
+
+    def _nivel_bayes(self, correo):
+        tokens = _tokens(correo) & self.bayes.vocabulario
+        if not tokens or not self.calibracion:
+            return None
+        categoria, prob = max(self.bayes.probabilidades(tokens).items(), key=lambda x: x[1])
+        return categoria, self.calibracion[self._intervalo(prob)]
+
+    def predecir(self, correo):
+        """
+        Devuelve (categoria, confianza, nivel, escalar). Se usa el primer nivel
+        que alcance el umbral; si ninguno lo alcanza, la predicción más confiable
+        con escalar=True para que la resuelva Gemini (categoria None si ningún
+        nivel aplica).
+        """
+        candidatos = []
+        regla = _regla_labels(correo)
+        if regla:
+            candidatos.append((REGLAS_LABELS[regla][0], self.precision_reglas.get(regla, 0.5), 'labels'))
+        for nivel, funcion in (('remitente', self._nivel_remitente), ('bayes', self._nivel_bayes)):
+            resultado = funcion(correo) if self.entrenado else None
+            if resultado:
+                candidatos.append((*resultado, nivel))
+
+        for categoria, confianza, nivel in candidatos:
+            if confianza >= self.umbral:
+                return categoria, confianza, nivel, False
+        if not candidatos:
+            return None, 0.0, 'ninguno', True
+        categoria, confianza, nivel = max(candidatos, key=lambda x: x[1])
+        return categoria, confianza, nivel, True
+
+
+class MetricasCascada:
+    """Tasa de escalamiento y concordancia entre el nivel local y Gemini"""
+
+    def __init__(self):
+        self.locales = Counter()
+        self.escalados = 0
+        self.comparados = 0
+        self.concordancias = 0
+
+    def registrar_local(self, nivel):
+        self.locales[nivel] += 1
+
+    def registrar_escalado(self, categoria_local, categoria_llm=None):
+        """Sin predicción local o sin respuesta válida de Gemini no se mide concordancia"""
+        self.escalados += 1
+        if categoria_llm is not None:
+            categoria_llm = normalizar_categoria(categoria_llm)
+        if categoria_local is not None and categoria_llm is not None:
+            self.comparados += 1
+            self.concordancias += categoria_local == categoria_llm
+
+    @property
+    def total(self):
+        return sum(self.locales.values()) + self.escalados
+
+    def tasa_escalamiento(self):
+        return self.escalados / self.total if self.total else 0.0
+
+    def tasa_concordancia(self):
+        return self.concordancias / self.comparados if self.comparados else None
+
+    def imprimir(self):
+        print("\n🧮 CLASIFICACIÓN EN CASCADA:")
+        for nivel, cantidad in sorted(self.locales.items()):
+            print(f"   ⚡ Resueltos por {nivel}: {cantidad}")
+        print(f"   🤖 Escalados a Gemini: {self.escalados} ({self.tasa_escalamiento():.0%})")
+        concordancia = self.tasa_concordancia()
+        if concordancia is not None:
+            print(f"   🤝 Concordancia local/Gemini en escalados: {concordancia:.0%}")
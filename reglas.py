@@ -0,0 +1,279 @@
+"""
+Reglas de palabras clave de los clasificadores
+
+Cada lista de palabras se compila a una sola expresión regular (alternación
+ordenada de la palabra más larga a la más corta) y se evalúa sobre columnas
+completas de pandas con operaciones vectorizadas, en lugar de recorrer los
+correos fila por fila con any(keyword in ...).
+"""
+
+import re
+import unicodedata
+
+import pandas as pd
+
+# --- Importancia (ClasificadorCorreos) ---
+
+LABELS_IMPORTANTES = ['IMPORTANT', 'STARRED', 'PRIORITY']
+LABELS_NO_IMPORTANTES = ['CATEGORY_PROMOTIONS', 'CATEGORY_SOCIAL', 'SPAM', 'TRASH']
+
+PALABRAS_IMPORTANTES_ASUNTO = [
+    'URGENTE', 'IMPORTANTE', 'PRIORITY', 'URGENT', 'CRÍTICO', 'CRITICAL',
+    'FACTURA', 'INVOICE', 'PAGO', 'PAYMENT', 'VENCIMIENTO', 'DUE',
+    'REUNIÓN', 'MEETING', 'CITA', 'APPOINTMENT'
+]
+
+# Dominios de trabajo comunes (puedes personalizar)
+DOMINIOS_TRABAJO = ['@work.com', '@empresa.com', '@company.com', '@office.com', '@trabajo.com']
+
+# Remitentes bancarios o gubernamentales
+REMITENTES_INSTITUCIONALES = ['banco', 'bank', 'sunat', 'gobierno', 'ministerio', 'seguro']
+
+REMITENTES_PROMOCIONALES = [
+    'noreply', 'no-reply', 'newsletter', 'marketing', 'promo', 'offer',
+    'duolingo', 'youtube', 'facebook', 'instagram', 'twitter', 'linkedin',
+    'amazon', 'mercadolibre', 'aliexpress'
+]
+
+PALABRAS_PROMOCIONALES_ASUNTO = [
+    'OFERTA', 'DESCUENTO', 'PROMOCIÓN', 'SALE', 'OFFER', 'DISCOUNT',
+    'GRATIS', 'FREE', 'NEWSLETTER', 'SUSCRIPCIÓN'
+]
+
+# --- Correos financieros (ClasificadorFinanciero) ---
+
+# Palabras clave financieras en el asunto
+PALABRAS_FINANCIERAS = [
+    'PAGO', 'PAYMENT', 'TRANSFERENCIA', 'TRANSFER', 'COMPRA', 'PURCHASE',
+    'FACTURA', 'INVOICE', 'RECIBO', 'RECEIPT', 'COBRO', 'CHARGE',
+    'TARJETA', 'CARD', 'DÉBITO', 'DEBIT', 'CRÉDITO', 'CREDIT',
+    'BANCO', 'BANK', 'CUENTA', 'ACCOUNT', 'SALDO', 'BALANCE',
+    'TRANSACCIÓN', 'TRANSACTION', 'MOVIMIENTO', 'MOVEMENT',
+    'RETIRO', 'WITHDRAWAL', 'DEPÓSITO', 'DEPOSIT', 'AHORRO', 'SAVINGS',
+    'PRÉSTAMO', 'LOAN', 'CUOTA', 'INSTALLMENT', 'INTERÉS', 'INTEREST',
+    'COMISIÓN', 'COMMISSION', 'FEE', 'COSTO', 'COST', 'PRECIO', 'PRICE',
+    'TOTAL', 'AMOUNT', 'SUMA', 'MONTO', 'VALOR', 'VALUE',
+    'YAPE', 'PLIN', 'BCP', 'BBVA', 'INTERBANK', 'SCOTIABANK',
+    'VISA', 'MASTERCARD', 'AMERICAN EXPRESS', 'DINERS'
+]
+
+# Remitentes financieros conocidos
+REMITENTES_FINANCIEROS = [
+    'banco', 'bank', 'bcp', 'bbva', 'interbank', 'scotiabank',
+    'visa', 'mastercard', 'yape', 'plin', 'paypal', 'mercadopago',
+    'culqi', 'izipay', 'payme', 'tunki', 'lukita', 'billetera',
+    'wallet', 'fintech', 'nequi', 'daviplata', 'financier',
+    'credito', 'prestamo', 'seguros', 'insurance', 'sunat',
+    'tributario', 'tax', 'facturacion', 'billing', 'cobranza'
+]
+
+# Dominios de los remitentes de notificaciones financieras. La búsqueda de Gmail
+# no encuentra 'bcp' dentro de 'notificacionesbcp.com.pe': solo para el prefiltro
+DOMINIOS_FINANCIEROS = [
+    'notificacionesbcp.com.pe', 'bcp.com.pe', 'viabcp.com', 'bbva.pe', 'bbva.com',
+    'interbank.pe', 'interbank.com.pe', 'scotiabank.com.pe', 'yape.com.pe', 'plin.pe',
+    'paypal.com', 'mercadopago.com', 'izipay.pe', 'culqi.com', 'sunat.gob.pe'
+]
+
+# Formas que Gmail tampoco deriva de PALABRAS_FINANCIERAS ("pagó", "consumo"...)
+TERMINOS_FINANCIEROS_GMAIL = [
+    'PAGÓ', 'PAGASTE', 'PAGAR', 'COMPRÓ', 'COMPRASTE', 'CONSUMO', 'CONSUMOS', 'CONSUMISTE',
+    'TRANSFERISTE', 'YAPEASTE', 'YAPEO', 'CARGO', 'CARGOS', 'ABONO', 'ABONOS', 'OPERACIÓN',
+    'OPERACIONES', 'CONSTANCIA', 'ESTADO DE CUENTA'
+]
+
+# Patrones de montos (S/, $, €, etc.)
+PATRON_MONTO = r'[S$€£¥]\s*[\d,]+\.?\d*|[\d,]+\.?\d*\s*[S$€£¥]|PEN|USD|EUR|GBP'
+# Códigos de moneda del patrón de montos (la búsqueda de Gmail ignora los símbolos)
+MONEDAS = ['PEN', 'USD', 'EUR', 'GBP']
+
+# Largo máximo de cada query de búsqueda enviada a Gmail
+MAX_LARGO_QUERY = 1000
+
+
+def compilar_patron(palabras):
+    """
+    Compila una lista de palabras (subcadenas literales) a una sola regex que
+    ignora mayúsculas, así no hace falta pasar cada texto por upper()/lower()
+    """
+    alternativas = sorted(set(palabras), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(p) for p in alternativas), re.IGNORECASE)
+
+
+RE_LABELS_IMPORTANTES = compilar_patron(LABELS_IMPORTANTES)
+RE_LABELS_NO_IMPORTANTES = compilar_patron(LABELS_NO_IMPORTANTES)
+RE_IMPORTANT_O_STARRED = compilar_patron(['IMPORTANT', 'STARRED'])
+RE_ASUNTO_IMPORTANTE = compilar_patron(PALABRAS_IMPORTANTES_ASUNTO)
+RE_REMITENTE_IMPORTANTE = compilar_patron(DOMINIOS_TRABAJO + REMITENTES_INSTITUCIONALES)
+RE_REMITENTE_PROMOCIONAL = compilar_patron(REMITENTES_PROMOCIONALES)
+RE_ASUNTO_PROMOCIONAL = compilar_patron(PALABRAS_PROMOCIONALES_ASUNTO)
+RE_PALABRAS_FINANCIERAS = compilar_patron(PALABRAS_FINANCIERAS)
+RE_REMITENTES_FINANCIEROS = compilar_patron(REMITENTES_FINANCIEROS)
+RE_MONTO = re.compile(PATRON_MONTO, re.IGNORECASE)
+
+
+# Todas las palabras de cada columna en una sola regex: en evaluar_reglas_importancia
+# la columna se recorre una vez y solo las filas que coinciden se atribuyen a cada regla
+RE_COLUMNA_LABELS = compilar_patron(LABELS_IMPORTANTES + LABELS_NO_IMPORTANTES + ['UNREAD'])
+RE_COLUMNA_ASUNTO = compilar_patron(PALABRAS_IMPORTANTES_ASUNTO + PALABRAS_PROMOCIONALES_ASUNTO)
+RE_COLUMNA_REMITENTE = compilar_patron(DOMINIOS_TRABAJO + REMITENTES_INSTITUCIONALES
+                                       + REMITENTES_PROMOCIONALES)
+
+
+def _sin_acentos(texto):
+    return ''.join(c for c in unicodedata.normalize('NFD', texto) if unicodedata.category(c) != 'Mn')
+
+
+def _terminos_gmail(palabras):
+    """
+    Términos de búsqueda de Gmail para una lista de palabras: en minúsculas,
+    con y sin acentos, y entre comillas si tienen espacios o puntuación
+    """
+    terminos = []
+    for palabra in palabras:
+        for variante in (palabra.lower(), _sin_acentos(palabra.lower())):
+            terminos.append(f'"{variante}"' if re.search(r'[^\w]', variante) else variante)
+    return list(dict.fromkeys(terminos))
+
+
+def _plurales(palabras):
+    """Plural de cada palabra simple ("PAGO" -> "PAGOS", "TRANSACCIÓN" -> "TRANSACCIONES")"""
+    plurales = []
+    for palabra in palabras:
+        if not palabra.isalpha():
+            continue
+        if palabra[-1] in 'AEIOUaeiou':
+            plurales.append(palabra + 'S')
+        else:
+            plurales.append(_sin_acentos(palabra) + 'ES')
+    return plurales
+
+
+def _texto_query(grupos):
+    return ' OR '.join(f"{operador}:({' OR '.join(terminos)})" for operador, terminos in grupos.items())
+
+
+def compilar_queries_gmail(filtros, max_largo=MAX_LARGO_QUERY):
+    """
+    Compila listas de palabras a queries de búsqueda de Gmail de la forma
+    'from:(a OR b) OR subject:(c OR d)'. `filtros` es una lista de pares
+    (operador, palabras). Si la expresión supera `max_largo` caracteres se
+    reparte en varias queries; la unión de sus resultados equivale a la
+    expresión completa.
+
+    Gmail busca por palabras completas y no por subcadenas, así que el
+    resultado es un prefiltro: la evaluación local sigue siendo la precisa.
+    """
+    queries, grupos = [], {}
+    for operador, palabras in filtros:
+        for termino in _terminos_gmail(palabras):
+            candidato = {op: list(ts) for op, ts in grupos.items()}
+            candidato.setdefault(operador, []).append(termino)
+            if grupos and len(_texto_query(candidato)) > max_largo:
+                queries.append(_texto_query(grupos))
+                candidato = {operador: [termino]}
+            grupos = candidato
+    if grupos:
+        queries.append(_texto_query(grupos))
+    return queries
+
+
+# Prefiltro de correos financieros del lado del servidor de Gmail. Gmail busca
+# palabras completas, así que se agregan plurales, formas verbales y dominios;
+# aun así no equivale a las reglas locales (subcadenas y montos como 'S/ 25.00'):
+# por eso el prefiltro es opcional
+QUERIES_FINANCIERAS = compilar_queries_gmail([
+    ('from', REMITENTES_FINANCIEROS + DOMINIOS_FINANCIEROS),
+    ('subject', PALABRAS_FINANCIERAS + _plurales(PALABRAS_FINANCIERAS)
+     + TERMINOS_FINANCIEROS_GMAIL + MONEDAS),
+])
+
+
+def _columna_texto(df, columna):
+    """Columna como texto para aplicar las reglas (las listas de labels se unen con espacios)"""
+    if columna not in df.columns:
+        return pd.Series('', index=df.index)
+    serie = df[columna]
+    no_nulos = serie.dropna()
+    if len(no_nulos) and isinstance(no_nulos.iloc[0], list):
+        return serie.map(lambda v: ' '.join(v) if isinstance(v, list) else str(v))
+    return serie.astype(str)
+
+
+def _evaluar_columna(serie, patron_columna, reglas):
+    """
+    Evalúa varias reglas sobre una columna de texto y devuelve {nombre: serie
+    booleana}. La regex combinada de la columna se aplica una vez por valor
+    distinto (los labels y remitentes del historial se repiten mucho); cada
+    regla solo se prueba sobre los valores en los que la combinada coincidió.
+    """
+    codigos, valores = pd.factorize(serie)
+    unicos = pd.Series(valores)
+    coincide = unicos.str.contains(patron_columna).to_numpy(dtype=bool)
+    candidatos = unicos[coincide]
+    resultado = {}
+    for nombre, patron in reglas.items():
+        marcas = coincide.copy()
+        marcas[coincide] = candidatos.str.contains(patron).to_numpy(dtype=bool)
+        resultado[nombre] = pd.Series(marcas[codigos], index=serie.index)
+    return resultado
+
+
+def evaluar_reglas_importancia(df):
+    """
+    Evalúa en una pasada las heurísticas de importancia sobre el DataFrame de
+    correos históricos: una regex combinada por columna (labels, asunto y
+    remitente). Devuelve un DataFrame booleano con las columnas
+    'es_importante' y 'es_no_importante', alineado con el índice de `df`.
+    """
+    labels = _evaluar_columna(_columna_texto(df, 'label_names'), RE_COLUMNA_LABELS, {
+        'importante': RE_LABELS_IMPORTANTES,
+        'importante_o_destacado': RE_IMPORTANT_O_STARRED,
+        'no_importante': RE_LABELS_NO_IMPORTANTES,
+        'no_leido': re.compile('UNREAD'),
+    })
+    subject = _evaluar_columna(_columna_texto(df, 'subject'), RE_COLUMNA_ASUNTO, {
+        'importante': RE_ASUNTO_IMPORTANTE,
+        'promocional': RE_ASUNTO_PROMOCIONAL,
+    })
+    from_email = _evaluar_columna(_columna_texto(df, 'from'), RE_COLUMNA_REMITENTE, {
+        'importante': RE_REMITENTE_IMPORTANTE,
+        'promocional': RE_REMITENTE_PROMOCIONAL,
+    })
+
+    es_importante = (
+        labels['importante']
+        | subject['importante']
+        | from_email['importante']
+    )
+
+    # Solo UNREAD sin otros labels importantes (IMPORTANT/STARRED)
+    solo_no_leido = labels['no_leido'] & ~labels['importante_o_destacado']
+    es_no_importante = (
+        labels['no_importante']
+        | solo_no_leido
+        | from_email['promocional']
+        | subject['promocional']
+    )
+
+    return es_importante.to_frame('es_importante').assign(es_no_importante=es_no_importante)
+
+
+def es_correo_financiero(correo):
+    """Versión por registro de evaluar_reglas_financieras (para el flujo en streaming)"""
+    subject = str(correo.get('subject', ''))
+    return bool(
+        RE_PALABRAS_FINANCIERAS.search(subject)
+        or RE_REMITENTES_FINANCIEROS.search(str(correo.get('from', '')))
+        or RE_MONTO.search(subject)
+    )
+
+
+def evaluar_reglas_financieras(df):
+    """Devuelve una serie booleana: True para los correos con información financiera"""
+    subject = _columna_texto(df, 'subject')
+    return (
+        subject.str.contains(RE_PALABRAS_FINANCIERAS)
+        | _columna_texto(df, 'from').str.contains(RE_REMITENTES_FINANCIEROS)
+        | subject.str.contains(RE_MONTO)
+    )
@@ -0,0 +1,121 @@
+"""
+Reglas de comercios de los consumos BCP
+
+La taxonomía de categorías vive en reglas_comercios.json (versionado) y de
+ahí salen las dos cosas que antes estaban duplicadas en el texto del prompt:
+
+- el contexto que se envía a Gemini (categorías, rubros y comercios de ejemplo)
+- un trie de caracteres con los nombres de comercio normalizados, que resuelve
+  localmente los comercios conocidos sin llamar al modelo
+
+La búsqueda recorre el trie desde el inicio de cada palabra del comercio y se
+queda con la coincidencia más larga ("AMAZON PRIME" gana sobre "AMAZON"), así
+un consumo "PAYU*NETFLIX" o "KFC N° 12" se resuelve con una pasada. Los rubros
+de ubicación (centros comerciales) pierden contra cualquier comercio: "KFC
+MEGA PLAZA" es un consumo en KFC, no en el centro comercial.
+"""
+
+import json
+import os
+import re
+import unicodedata
+
+ARCHIVO_REGLAS_COMERCIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                        'reglas_comercios.json')
+
+# Marca de fin de palabra clave en los nodos del trie
+_FIN = '$'
+
+
+def normalizar_nombre(texto):
+    """Mayúsculas sin acentos; apóstrofes fuera y el resto de la puntuación como espacio"""
+    texto = unicodedata.normalize('NFD', str(texto).upper())
+    texto = ''.join(c for c in texto if unicodedata.category(c) != 'Mn')
+    texto = re.sub(r"['’`]", '', texto)
+    return ' '.join(re.sub(r'[^\w]+|_', ' ', texto).split())
+
+
+class ReglasComercios:
+    """Taxonomía de categorías cargada desde el archivo de reglas"""
+
+    def __init__(self, ruta=ARCHIVO_REGLAS_COMERCIOS):
+        self.ruta = ruta
+        with open(ruta, 'r', encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+        self.version = datos['version']
+        self.categorias = datos['categorias']
+        self.reglas_prompt = datos.get('reglas_prompt', [])
+        self.emojis = {c['nombre']: c['emoji'] for c in self.categorias}
+        self.trie = {}
+        self.cantidad = 0
+        for categoria in self.categorias:
+            for rubro in categoria['rubros']:
+                for comercio in rubro.get('comercios', []):
+                    self._agregar_comercio(comercio, categoria['nombre'], rubro['rubro'],
+                                           rubro.get('ubicacion', False))
+
+    def _agregar_comercio(self, comercio, categoria, rubro, ubicacion=False):
+        alias = comercio.split('|')
+        nombre = alias[0]
+        for palabra_clave in alias:
+            prefijo = palabra_clave.endswith('*')
+            clave = normalizar_nombre(palabra_clave.rstrip('*'))
+            if not clave:
+                continue
+            nodo = self.trie
+            for caracter in clave:
+                nodo = nodo.setdefault(caracter, {})
+            nodo[_FIN] = (categoria, nombre, rubro, prefijo, ubicacion)
+            self.cantidad += 1
+
+    def buscar(self, empresa):
+        """
+        Devuelve (categoria, comercio, rubro) del comercio conocido que aparece en
+        `empresa` (la coincidencia más larga, empezando en una palabra, y un
+        comercio antes que una ubicación) o None.
+        """
+        texto = normalizar_nombre(empresa)
+        mejor, prioridad_mejor = None, (False, 0)
+        for inicio in range(len(texto)):
+            if inicio and texto[inicio - 1] != ' ':
+                continue
+            nodo = self.trie
+            posicion = inicio
+            while posicion < len(texto) and texto[posicion] in nodo:
+                nodo = nodo[texto[posicion]]
+                posicion += 1
+                regla = nodo.get(_FIN)
+                # Palabra completa, salvo las palabras clave de prefijo ("BOTICA*")
+                if regla and (regla[3] or posicion == len(texto) or texto[posicion] == ' '):
+                    prioridad = (not regla[4], posicion - inicio)
+                    if prioridad > prioridad_mejor:
+                        mejor, prioridad_mejor = regla, prioridad
+        return mejor[:3] if mejor else None
+
+    def clasificar(self, empresa):
+        """Clasificación local en formato CATEGORIA|justificación, o None si no hay regla"""
+        regla = self.buscar(empresa)
+        if not regla:
+            return None
+        categoria, comercio, rubro = regla
+        return f"{categoria}|Regla local: {comercio} ({rubro})"
+
+    def generar_contexto(self):
+        """Contexto del prompt de Gemini con las categorías, rubros y comercios del archivo"""
+        lineas = [f"Eres un clasificador especializado en gastos bancarios. Clasifica cada consumo "
+                  f"en UNA de estas {len(self.categorias)} categorías:"]
+        for categoria in self.categorias:
+            lineas.append("")
+            lineas.append(f"{categoria['emoji']} {categoria['nombre']}:")
+            for rubro in categoria['rubros']:
+                nombres = [c.split('|')[0] for c in rubro.get('comercios', [])]
+                nombres += rubro.get('ambiguos', [])
+                linea = rubro['rubro']
+                if nombres:
+                    linea += ": " + ", ".join(nombres)
+                lineas.append(f"- {linea}{rubro.get('sufijo', '')}")
+        if self.reglas_prompt:
+            lineas.append("")
+            lineas.append("REGLAS:")
+            lineas.extend(f"- {regla}" for regla in self.reglas_prompt)
+        return "\n" + "\n".join(f"        {linea}" if linea else "" for linea in lineas) + "\n        "
@@ -0,0 +1,154 @@
+"""
+Reputación de remitentes (SQLite)
+
+Guarda, por remitente y por dominio, cuántas veces Gemini clasificó sus
+correos como IMPORTANTE o NO_IMPORTANTE y cuándo fue el último veredicto.
+Los remitentes estables se deciden desde esta tabla sin llamar al modelo.
+"""
+
+import sqlite3
+import time
+from email.utils import parseaddr
+
+from preclasificador import IMPORTANTE, NO_IMPORTANTE, normalizar_categoria, es_dominio_publico
+
+ARCHIVO_REPUTACION = 'reputacion_remitentes.db'
+# Confianza mínima (regla de sucesión de Laplace) para decidir desde la tabla
+UMBRAL_REPUTACION = 0.9
+# Veredictos mínimos de un remitente antes de confiar en su reputación
+MIN_VEREDICTOS = 3
+# Segundos sin veredictos nuevos tras los que una reputación deja de usarse (30 días)
+TTL_REPUTACION = 30 * 24 * 3600
+
+
+def claves_remitente(remitente):
+    """
+    Devuelve las claves de un remitente: su email y '@dominio' (en minúsculas).
+    Los dominios de webmail público (gmail.com, hotmail.com...) no son clave:
+    un veredicto sobre un remitente no dice nada del resto de sus usuarios.
+    """
+    email = parseaddr(str(remitente))[1].lower()
+    if '@' not in email:
+        return []
+    dominio = email.rpartition('@')[2]
+    if es_dominio_publico(dominio):
+        return [email]
+    return [email, '@' + dominio]
+
+
+class ReputacionRemitentes:
+    """
+    Tabla persistente de veredictos por remitente y dominio.
+
+    Las entradas con override (fijadas a mano) tienen prioridad, no vencen y
+    no se purgan. El resto se usa solo si tiene al menos `min_veredictos`, la
+    categoría mayoritaria alcanza `umbral` y el último veredicto es más nuevo
+    que `ttl` segundos.
+    """
+
+    def __init__(self, ruta=ARCHIVO_REPUTACION, umbral=UMBRAL_REPUTACION,
+                 min_veredictos=MIN_VEREDICTOS, ttl=TTL_REPUTACION):
+        self.ruta = ruta
+        self.umbral = umbral
+        self.min_veredictos = min_veredictos
+        self.ttl = ttl
+        self.conn = sqlite3.connect(ruta)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS remitentes (
+                clave          TEXT PRIMARY KEY,
+                importantes    INTEGER NOT NULL DEFAULT 0,
+                no_importantes INTEGER NOT NULL DEFAULT 0,
+                primer_visto   REAL,
+                ultimo_visto   REAL,
+                override       TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_remitentes_visto ON remitentes(ultimo_visto);
+        """)
+
+    def registrar(self, remitente, categoria):
+        """
+        Suma un veredicto (respuesta de Gemini) al remitente y a su dominio; una
+        respuesta sin categoría reconocida no se registra
+        """
+        categoria = normalizar_categoria(categoria)
+        if categoria is None:
+            return
+        columna = 'importantes' if categoria == IMPORTANTE else 'no_importantes'
+        ahora = time.time()
+        with self.conn:
+            for clave in claves_remitente(remitente):
+                self.conn.execute(
+                    f"""INSERT INTO remitentes (clave, {columna}, primer_visto, ultimo_visto)
+                        VALUES (?, 1, ?, ?)
+                        ON CONFLICT(clave) DO UPDATE SET
+                            {columna} = {columna} + 1, ultimo_visto = excluded.ultimo_visto""",
+                    (clave, ahora, ahora)
+                )
+
+    def consultar(self, remitente):
+        """
+        Devuelve (categoria, confianza, clave) si la reputación del remitente (o,
+        si no alcanza, la de su dominio) permite decidir sin el modelo; si no, None.
+        """
+        claves = claves_remitente(remitente)
+        if not claves:
+            return None
+        filas = {fila[0]: fila[1:] for fila in self.conn.execute(
+            f"""SELECT clave, importantes, no_importantes, ultimo_visto, override
+                FROM remitentes WHERE clave IN ({','.join('?' * len(claves))})""",
+            claves
+        )}
+        vigencia = time.time() - self.ttl
+        for clave in claves:
+            if clave not in filas:
+                continue
+            importantes, no_importantes, ultimo_visto, override = filas[clave]
+            if override:
+                return override, 1.0, clave
+            total = importantes + no_importantes
+            if total < self.min_veredictos or (ultimo_visto or 0) < vigencia:
+                continue
+            categoria = IMPORTANTE if importantes > no_importantes else NO_IMPORTANTE
+            confianza = (max(importantes, no_importantes) + 1) / (total + 2)
+            if confianza >= self.umbral:
+                return categoria, confianza, clave
+        return None
+
+    def fijar(self, clave, categoria):
+        """Fija a mano la categoría de un remitente ('a@b.com') o dominio ('@b.com')"""
+        clave = clave.strip().lower()
+        override = normalizar_categoria(categoria)
+        if override is None:
+            raise ValueError(f"Categoría no reconocida: {categoria!r}")
+        if clave.startswith('@') and es_dominio_publico(clave[1:]):
+            raise ValueError(f"{clave} es un dominio de webmail público: fija el remitente")
+        with self.conn:
+            self.conn.execute(
+                """INSERT INTO remitentes (clave, primer_visto, ultimo_visto, override)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(clave) DO UPDATE SET override = excluded.override""",
+                (clave, time.time(), time.time(), override)
+            )
+
+    def quitar_override(self, clave):
+        """Vuelve a decidir el remitente por sus veredictos"""
+        with self.conn:
+            self.conn.execute("UPDATE remitentes SET override = NULL WHERE clave = ?",
+                              (clave.strip().lower(),))
+
+    def olvidar(self, clave):
+        """Elimina la reputación (y el override) de un remitente o dominio"""
+        with self.conn:
+            return self.conn.execute("DELETE FROM remitentes WHERE clave = ?",
+                                     (clave.strip().lower(),)).rowcount
+
+    def purgar_vencidos(self):
+        """Elimina las reputaciones sin veredictos dentro del TTL (no toca overrides)"""
+        with self.conn:
+            return self.conn.execute(
+                "DELETE FROM remitentes WHERE override IS NULL AND ultimo_visto < ?",
+                (time.time() - self.ttl,)
+            ).rowcount
+
+    def cerrar(self):
+        self.conn.close()
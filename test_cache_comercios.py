@@ -0,0 +1,47 @@
+"""
+Pruebas de la clave normalizada de comercios y del caché comercio -> categoría
+"""
+
+from cache_comercios import CacheComercios, normalizar_comercio
+
+
+def test_nombres_con_palabras_de_sucursal_se_conservan():
+    assert normalizar_comercio("HOUSE OF PIZZA") == "HOUSE OF PIZZA"
+    assert normalizar_comercio("BANK OF CHINA") == "BANK OF CHINA"
+    assert normalizar_comercio("LA TIENDA DE JUAN") == "LA TIENDA DE JUAN"
+    assert normalizar_comercio("TIENDA X") == "TIENDA X"
+
+
+def test_numero_en_la_segunda_palabra_es_parte_del_nombre():
+    assert normalizar_comercio("CAFE 1900") == "CAFE 1900"
+    assert normalizar_comercio("CAFE 2 CHAIRS") == "CAFE 2 CHAIRS"
+    assert normalizar_comercio("CHIFA 8 TESOROS") == "CHIFA 8 TESOROS"
+    assert normalizar_comercio("7-ELEVEN") == "7 ELEVEN"
+
+
+def test_asterisco_sin_pasarela_conserva_el_servicio():
+    assert normalizar_comercio("UBER *EATS") == "UBER EATS"
+    assert normalizar_comercio("UBER *TRIP") == "UBER TRIP"
+    assert normalizar_comercio("UBER *EATS") != normalizar_comercio("UBER *TRIP")
+    assert normalizar_comercio("GOOGLE *CLOUD") == "GOOGLE CLOUD"
+    assert normalizar_comercio("DLC*GOOGLE YOUTUBE") == "GOOGLE YOUTUBE"
+
+
+def test_sucursal_numero_de_tienda_y_razon_social_se_descartan():
+    assert normalizar_comercio("TAMBO SUC MIRAFLORES") == "TAMBO"
+    assert normalizar_comercio("PIZZA HUT TDA JOCKEY") == "PIZZA HUT"
+    assert normalizar_comercio("KFC N° 12") == "KFC"
+    assert normalizar_comercio("PLAZA VEA #45") == "PLAZA VEA"
+    assert normalizar_comercio("PLAZA VEA 045 SURCO") == "PLAZA VEA"
+    assert normalizar_comercio("Restaurant El Sol S.A.C.") == "RESTAURANT EL SOL"
+    assert normalizar_comercio("N/A") == ''
+
+
+def test_cache_distingue_servicios_del_mismo_comercio(tmp_path):
+    cache = CacheComercios(ruta=str(tmp_path / 'cache.db'))
+    cache.guardar("UBER *EATS", "ALIMENTACIÓN", "delivery")
+    cache.guardar("UBER *TRIP", "TRANSPORTE", "viaje")
+    assert cache.obtener("UBER *EATS 1234")[0] == "ALIMENTACIÓN"
+    assert cache.obtener("UBER *TRIP")[0] == "TRANSPORTE"
+    assert cache.obtener("UBER") is None
+    cache.cerrar()
@@ -0,0 +1,30 @@
+"""
+Pruebas del registro Consumo y de su conversión desde y hacia diccionarios
+"""
+
+from consumo import Consumo, como_consumo, monto_a_centavos
+
+
+def test_diccionario_de_entrada_ida_y_vuelta():
+    datos = {'monto': 'S/ 1,234.50', 'empresa': 'TAMBO', 'fecha': 'Mon, 06 Oct 2026',
+             'tipo_tarjeta': 'Débito', 'email_id': 'abc', 'leido': True}
+    consumo = como_consumo(datos)
+    assert isinstance(consumo, Consumo)
+    assert consumo.centavos == 123450
+    assert consumo.a_datos() == datos
+    assert como_consumo(consumo) is consumo
+
+
+def test_diccionario_parcial_como_el_de_la_api():
+    consumo = Consumo.desde_dict({'empresa': 'UBER *TRIP', 'monto': 'S/ 12.00',
+                                  'tipo_tarjeta': 'Crédito', 'fecha': '2025-01-01'})
+    assert consumo.email_id == '' and consumo.leido is False
+    consumo.clasificar('TRANSPORTE', 'viaje')
+    assert consumo.a_dict()['categoria'] == 'TRANSPORTE'
+    assert consumo.a_dict()['monto_numerico'] == 12.0
+
+
+def test_montos_ilegibles():
+    assert monto_a_centavos('N/A') is None
+    assert monto_a_centavos('S/ abc') is None
+    assert Consumo('', 'X', 'N/A', 'Débito').monto_numerico == 0
@@ -0,0 +1,126 @@
+"""
+Pruebas de la descarga de mensajes en lotes batch de Gmail (_obtener_mensajes_batch)
+
+Se usa un endpoint falso en memoria con la interfaz de httplib2.Http: responde
+los batch multipart mensaje por mensaje y registra el tamaño de cada lote.
+"""
+
+import json
+import re
+import threading
+
+import httplib2
+from googleapiclient.discovery import build
+
+import gmail
+from gmail import EjecutorGmail, LimitadorCuota, MAX_BATCH_SIZE, _obtener_mensajes_batch
+
+_FRONTERA = 'respuesta_batch'
+
+
+def _mensaje(msg_id):
+    return {'id': msg_id, 'threadId': 't' + msg_id, 'labelIds': ['INBOX'],
+            'payload': {'headers': [{'name': 'Subject', 'value': 'Asunto ' + msg_id}]}}
+
+
+class _GmailFalso:
+    """
+    Endpoint falso de Gmail. `fallos` asigna a un message_id una lista de códigos
+    HTTP que se devuelven (uno por intento) antes de responder 200. Registra los
+    IDs de cada lote batch y de cada get individual.
+    """
+
+    def __init__(self, fallos=None):
+        self.fallos = {msg_id: list(codigos) for msg_id, codigos in (fallos or {}).items()}
+        self.lotes = []
+        self.gets = []
+        self._lock = threading.Lock()
+
+    def _respuesta(self, msg_id):
+        with self._lock:
+            codigos = self.fallos.get(msg_id)
+            codigo = codigos.pop(0) if codigos else 200
+        if codigo == 200:
+            return 200, json.dumps(_mensaje(msg_id))
+        return codigo, json.dumps({'error': {'code': codigo, 'message': 'falla simulada'}})
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        if method == 'GET':
+            msg_id = re.search(r'/messages/([^?/]+)', uri).group(1)
+            with self._lock:
+                self.gets.append(msg_id)
+            codigo, contenido = self._respuesta(msg_id)
+            return httplib2.Response({'status': codigo, 'content-type': 'application/json'}), \
+                contenido.encode()
+
+        cuerpo = body.decode() if isinstance(body, bytes) else body
+        frontera = re.search(r'boundary="?([^";]+)', headers['content-type']).group(1)
+        partes = [p for p in cuerpo.split('--' + frontera) if 'Content-ID' in p]
+        ids = [re.search(r'/messages/([^?\s]+)', parte).group(1) for parte in partes]
+        with self._lock:
+            self.lotes.append(ids)
+        respuesta = ''
+        for parte, msg_id in zip(partes, ids):
+            content_id = re.search(r'Content-ID: <(.+?)>', parte).group(1)
+            codigo, contenido = self._respuesta(msg_id)
+            respuesta += (f'--{_FRONTERA}\r\nContent-Type: application/http\r\n'
+                          f'Content-ID: <response-{content_id}>\r\n\r\n'
+                          f'HTTP/1.1 {codigo} OK\r\nContent-Type: application/json\r\n\r\n'
+                          f'{contenido}\r\n')
+        respuesta += f'--{_FRONTERA}--'
+        return httplib2.Response({'status': 200,
+                                  'content-type': f'multipart/mixed; boundary={_FRONTERA}'}), \
+            respuesta.encode()
+
+
+class _EjecutorFalso(EjecutorGmail):
+    """EjecutorGmail que envía todo al endpoint falso y sin límite de cuota"""
+
+    def __init__(self, service, falso):
+        super().__init__(service, limitador=LimitadorCuota(10 ** 9))
+        self.falso = falso
+
+    def _http_hilo(self):
+        return self.falso
+
+
+def _descargar(ids, falso, monkeypatch, **kwargs):
+    monkeypatch.setattr(gmail, '_espera_backoff', lambda *args, **kw: 0)
+    service = build('gmail', 'v1', http=falso, static_discovery=True)
+    return _obtener_mensajes_batch(service, ids, ejecutor=_EjecutorFalso(service, falso),
+                                   **gmail.PERFILES_DESCARGA['metadata'], **kwargs)
+
+
+def test_lotes_de_a_100(monkeypatch):
+    falso = _GmailFalso()
+    ids = [f"m{i}" for i in range(250)]
+    mensajes = _descargar(ids, falso, monkeypatch)
+    assert sorted(len(lote) for lote in falso.lotes) == [50, MAX_BATCH_SIZE, MAX_BATCH_SIZE]
+    assert sorted(sum(falso.lotes, [])) == sorted(ids)
+    assert set(mensajes) == set(ids)
+    assert mensajes['m7']['threadId'] == 'tm7'
+
+
+def test_batch_size_mayor_al_maximo_se_acota(monkeypatch):
+    falso = _GmailFalso()
+    _descargar([f"m{i}" for i in range(150)], falso, monkeypatch, batch_size=500)
+    assert max(len(lote) for lote in falso.lotes) == MAX_BATCH_SIZE
+
+
+def test_fallos_temporales_se_reintentan_y_los_definitivos_se_informan(monkeypatch, capsys):
+    falso = _GmailFalso(fallos={'m3': [404], 'm5': [429], 'm8': [503], 'm9': [500] * 100})
+    ids = [f"m{i}" for i in range(120)]
+    mensajes = _descargar(ids, falso, monkeypatch)
+
+    # El primer intento va en dos lotes; los errores temporales se reintentan juntos en otro
+    assert sorted(len(lote) for lote in falso.lotes[:2]) == [20, MAX_BATCH_SIZE]
+    assert sorted(falso.lotes[2]) == ['m5', 'm8', 'm9']
+    assert {'m5', 'm8'} <= set(mensajes)
+    # 404 no se reintenta: se pide una sola vez y se informa
+    assert sum(lote.count('m3') for lote in falso.lotes) + falso.gets.count('m3') == 1
+    salida = capsys.readouterr().out
+    assert "Error obteniendo correo m3" in salida
+    # m9 agota los reintentos y recién entonces se informa
+    assert 'm9' not in mensajes
+    assert "Error obteniendo correo m9" in salida
+    assert len(mensajes) == len(ids) - 2
@@ -0,0 +1,93 @@
+"""
+Pruebas de las reglas de palabras clave y del prefiltro de Gmail
+"""
+
+import re
+
+import pandas as pd
+
+from reglas import (QUERIES_FINANCIERAS, MAX_LARGO_QUERY, es_correo_financiero,
+                    evaluar_reglas_financieras,
+                    evaluar_reglas_importancia, LABELS_IMPORTANTES, LABELS_NO_IMPORTANTES,
+                    PALABRAS_IMPORTANTES_ASUNTO, PALABRAS_PROMOCIONALES_ASUNTO,
+                    DOMINIOS_TRABAJO, REMITENTES_INSTITUCIONALES, REMITENTES_PROMOCIONALES)
+
+
+def _palabras(texto):
+    return re.findall(r'\w+', texto.lower())
+
+
+def _coincide_gmail(query, correo):
+    """
+    Aproximación de la búsqueda de Gmail para 'from:(a OR b) OR subject:(c)':
+    un término coincide si sus palabras aparecen seguidas en el campo (palabras
+    completas, no subcadenas)
+    """
+    for operador, terminos in re.findall(r'(\w+):\(([^)]*)\)', query):
+        campo = _palabras(str(correo.get(operador, '')))
+        for termino in terminos.split(' OR '):
+            buscadas = _palabras(termino.strip('"'))
+            if any(campo[i:i + len(buscadas)] == buscadas for i in range(len(campo))):
+                return True
+    return False
+
+
+def _pasa_prefiltro(correo):
+    return any(_coincide_gmail(query, correo) for query in QUERIES_FINANCIERAS)
+
+
+def test_queries_financieras_respetan_el_largo_maximo():
+    assert all(len(query) <= MAX_LARGO_QUERY for query in QUERIES_FINANCIERAS)
+
+
+def test_notificaciones_bcp_pasan_el_prefiltro():
+    correos = [
+        {'from': "BCP <notificaciones@notificacionesbcp.com.pe>", 'subject': "Constancia de operación"},
+        {'from': "Servicio <avisos@otro.pe>", 'subject': "Pagos realizados"},
+        {'from': "Servicio <avisos@otro.pe>", 'subject': "Se pagó tu recibo de luz"},
+        {'from': "Yape <notificaciones@yape.com.pe>", 'subject': "Yapeaste S/ 20"},
+    ]
+    for correo in correos:
+        assert es_correo_financiero(correo), correo
+        assert _pasa_prefiltro(correo), correo
+    # Formas que Gmail no deriva de PALABRAS_FINANCIERAS
+    for asunto in ("Pagos", "Confirmación: pagó", "Tus consumos de la semana"):
+        assert _pasa_prefiltro({'from': "avisos@otro.pe", 'subject': asunto}), asunto
+
+
+def test_montos_en_minusculas_son_financieros():
+    correos = pd.DataFrame([
+        {'from': "avisos@otro.pe", 'subject': "te cobramos 30 usd"},
+        {'from': "avisos@otro.pe", 'subject': "Recibiste 25 soles"},
+    ])
+    assert all(es_correo_financiero(correo) for correo in correos.to_dict('records'))
+    assert evaluar_reglas_financieras(correos).all()
+
+
+def test_prefiltro_no_deja_pasar_correos_ajenos():
+    assert not _pasa_prefiltro({'from': "Ana <ana@gmail.com>", 'subject': "Fotos del viaje"})
+
+
+def test_reglas_de_importancia_equivalen_a_la_evaluacion_por_correo():
+    def contiene(texto, palabras):
+        return any(p.lower() in texto.lower() for p in palabras)
+
+    correos = pd.DataFrame({
+        'subject': ["URGENTE: pago", "Oferta gratis", "Hola", "Reunión", "", "PAGOFERTA"],
+        'from': ["jefe@empresa.com", "promo@tienda.com", "ana@gmail.com", "banco@noreply.pe",
+                 "x@y.com", "sunat@twitter.com"],
+        'label_names': [['INBOX', 'IMPORTANT'], ['CATEGORY_PROMOTIONS'], ['UNREAD'],
+                        ['UNREAD', 'STARRED'], [], ['PRIORITY', 'TRASH']],
+    })
+    resultado = evaluar_reglas_importancia(correos)
+    for i, correo in correos.iterrows():
+        labels = ' '.join(correo['label_names'])
+        importante = (contiene(labels, LABELS_IMPORTANTES)
+                      or contiene(correo['subject'], PALABRAS_IMPORTANTES_ASUNTO)
+                      or contiene(correo['from'], DOMINIOS_TRABAJO + REMITENTES_INSTITUCIONALES))
+        no_importante = (contiene(labels, LABELS_NO_IMPORTANTES)
+                         or ('UNREAD' in labels and not contiene(labels, ['IMPORTANT', 'STARRED']))
+                         or contiene(correo['from'], REMITENTES_PROMOCIONALES)
+                         or contiene(correo['subject'], PALABRAS_PROMOCIONALES_ASUNTO))
+        assert resultado['es_importante'][i] == importante, correo.to_dict()
+        assert resultado['es_no_importante'][i] == no_importante, correo.to_dict()
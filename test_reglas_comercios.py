@@ -0,0 +1,21 @@
+"""
+Pruebas de la resolución local de comercios BCP
+"""
+
+from reglas_comercios import ReglasComercios
+
+
+def test_comercio_gana_sobre_centro_comercial():
+    reglas = ReglasComercios()
+    assert reglas.buscar("KFC MEGA PLAZA")[0] == 'ALIMENTACIÓN'
+    assert reglas.buscar("TAMBO MEGAPLAZA")[0] == 'ALIMENTACIÓN'
+    # Sin otro comercio, el centro comercial sigue resolviendo
+    assert reglas.buscar("MEGAPLAZA INDEPENDENCIA")[1] == 'Mega Plaza'
+
+
+def test_coincidencia_mas_larga_y_palabra_completa():
+    reglas = ReglasComercios()
+    assert reglas.buscar("PAYU*NETFLIX.COM") is not None
+    assert reglas.buscar("KFC N° 12")[1] == 'KFC'
+    assert reglas.buscar("KFCX") is None
+    assert reglas.buscar("COMERCIO DESCONOCIDO") is None
@@ -0,0 +1,52 @@
+"""
+Pruebas de la reputación de remitentes y del nivel por remitente del pre-clasificador
+"""
+
+import pandas as pd
+import pytest
+
+from preclasificador import PreClasificador, IMPORTANTE, NO_IMPORTANTE, es_dominio_publico
+from reputacion_remitentes import ReputacionRemitentes, claves_remitente
+
+
+def test_claves_remitente_omite_dominios_de_webmail():
+    assert claves_remitente("Ana <Ana.Perez@Gmail.com>") == ['ana.perez@gmail.com']
+    for dominio in ('hotmail.com', 'hotmail.es', 'outlook.com', 'yahoo.com.pe', 'live.com',
+                    'icloud.com'):
+        assert claves_remitente(f"x@{dominio}") == [f"x@{dominio}"]
+    assert claves_remitente("BCP <notificaciones@notificacionesbcp.com.pe>") == \
+        ['notificaciones@notificacionesbcp.com.pe', '@notificacionesbcp.com.pe']
+    assert not es_dominio_publico('mail.empresa.com')
+
+
+def test_un_remitente_de_gmail_no_decide_por_los_demas(tmp_path):
+    reputacion = ReputacionRemitentes(ruta=str(tmp_path / 'reputacion.db'))
+    for _ in range(10):
+        reputacion.registrar("spam@gmail.com", "NO_IMPORTANTE")
+        reputacion.registrar("ofertas@tienda.com", "NO_IMPORTANTE")
+    assert reputacion.consultar("spam@gmail.com")[0] == NO_IMPORTANTE
+    assert reputacion.consultar("mama@gmail.com") is None
+    assert reputacion.consultar("pedidos@tienda.com")[2] == '@tienda.com'
+    with pytest.raises(ValueError):
+        reputacion.fijar('@gmail.com', 'NO_IMPORTANTE')
+    reputacion.cerrar()
+
+
+def test_respuestas_sin_categoria_no_se_registran(tmp_path):
+    reputacion = ReputacionRemitentes(ruta=str(tmp_path / 'reputacion.db'), min_veredictos=1)
+    reputacion.registrar("jefe@empresa.com", "ERROR|timeout")
+    reputacion.registrar("jefe@empresa.com", "")
+    assert reputacion.consultar("jefe@empresa.com") is None
+    reputacion.cerrar()
+
+
+def test_preclasificador_no_generaliza_dominios_de_webmail():
+    historial = pd.DataFrame({
+        'subject': [f"Promo {i}" for i in range(6)] + ["Reunión de directorio"],
+        'from': [f"promo{i}@gmail.com" for i in range(6)] + ["jefe@empresa.com"],
+        'label_names': [[]] * 7,
+        'clasificacion': [NO_IMPORTANTE] * 6 + [IMPORTANTE],
+    })
+    preclasificador = PreClasificador().entrenar(historial)
+    assert preclasificador._nivel_remitente({'from': "mama@gmail.com"}) is None
+    assert '@gmail.com' not in preclasificador.remitentes